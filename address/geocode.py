@@ -0,0 +1,179 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Offline batch geocoding of Address instances.  Coordinates come from local files only; nothing here
+makes network requests.  Two tab-delimited files are supported:
+
+    Postal codes - The GeoNames postal code format (http://download.geonames.org/export/zip/), without a
+    header row.  Columns: country code, postal code, place name, admin name1, admin code1, admin name2,
+    admin code2, admin name3, admin code3, latitude, longitude, accuracy.  This gives the centroid of a
+    postal code, and the average of those centroids approximates each city.
+
+    Street ranges - A header row naming the columns street, from_number, to_number, postal_code,
+    from_latitude, from_longitude, to_latitude, and to_longitude, followed by one row per block face.
+    TIGER/Line address range files can be converted to this format.  A building number within a range
+    is located by linear interpolation between the range's end points.
+
+An address is located as precisely as the files allow: street, then postal code, then city.  Results
+are cached by normalized address in the GeocodedLocation table, and only addresses that have never
+been geocoded are considered, so a run can be repeated cheaply after importing new voter lists.
+Addresses that were not found are remembered as such; after loading better files, retry them with
+retry_unmatched (the geocodeaddresses option --retry-unmatched).
+"""
+
+from address.models import Address, GeocodedLocation
+from csv import DictReader, reader
+from datetime import datetime
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+import re
+
+BATCH_SIZE = 500
+
+STREET_SUBSTITUTIONS = (    # Extends address.forms.AddressForm.clean_street
+    (r'\bROAD\b', 'RD'),
+    (r'\bSTREET\b', 'STR'),
+    (r'\bST\b', 'STR'),
+    (r'\bAVENUE\b', 'AVE'),
+    (r'\bPARKWAY\b', 'PKWY'),
+    (r'\bSUITE\b', 'STE'),
+    (r'\bAPARTMENT\b', 'APT'),
+    (r'[.,#]', ''),
+    (r'\s+', ' '),
+)
+
+def normalizeStreet(street):
+    """Return the street upper-cased and with common abbreviations substituted."""
+    street = street.strip().upper()
+    for pattern, replacement in STREET_SUBSTITUTIONS:
+        street = re.sub(pattern, replacement, street)
+    return street.strip()
+
+def splitStreet(street):
+    """Return the tuple (building number, street name) for a normalized street, or (None, street)."""
+    match = re.match(r'^(\d+)[A-Z]?\s+(.+)$', street)
+    if match:
+        return int(match.group(1)), match.group(2)
+    return None, street
+
+def normalizeAddress(street, city, state, country, postal_code):
+    """Return a key identifying an address regardless of capitalization and abbreviations."""
+    return '|'.join([normalizeStreet(street), city.strip().upper(), state.strip().upper(), str(country).upper(),
+        postal_code.strip().upper()[:5]])[:150]
+
+class Gazetteer(object):
+    """Coordinates of postal codes, cities, and street address ranges loaded from local files."""
+
+    def __init__(self):
+        self.postal_codes = {}  # (country, postal code) -> (latitude, longitude)
+        self.cities = {}        # (country, state, city) -> (latitude, longitude)
+        self.streets = {}       # (street name, postal code) -> [(from, to, from lat, from lon, to lat, to lon), ...]
+
+    def loadPostalCodes(self, path):
+        """Load a GeoNames postal code file.  See the module documentation."""
+        city_sums = {}
+        with open(path) as f:
+            for row in reader(f, delimiter='\t'):
+                try:
+                    latitude, longitude = float(row[9]), float(row[10])
+                except (IndexError, ValueError):
+                    continue
+                country = row[0].upper()
+                self.postal_codes[(country, row[1].strip().upper())] = (latitude, longitude)
+                sums = city_sums.setdefault((country, row[4].strip().upper(), row[2].strip().upper()), [0.0, 0.0, 0])
+                sums[0] += latitude
+                sums[1] += longitude
+                sums[2] += 1
+        for key, (latitude_sum, longitude_sum, count) in city_sums.items():
+            self.cities[key] = (latitude_sum / count, longitude_sum / count)
+
+    def loadStreetRanges(self, path):
+        """Load a street range file.  See the module documentation."""
+        with open(path) as f:
+            for row in DictReader(f, delimiter='\t'):
+                try:
+                    entry = (int(row['from_number']), int(row['to_number']), float(row['from_latitude']),
+                        float(row['from_longitude']), float(row['to_latitude']), float(row['to_longitude']))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                key = (normalizeStreet(row['street']), row['postal_code'].strip().upper()[:5])
+                self.streets.setdefault(key, []).append(entry)
+
+    def locate(self, address):
+        """Return the tuple (latitude, longitude, precision) for an Address, or (None, None, '')."""
+        postal_code = address.postal_code.strip().upper()[:5]
+        number, street = splitStreet(normalizeStreet(address.street))
+        if number is not None:
+            for low, high, from_latitude, from_longitude, to_latitude, to_longitude in self.streets.get((street, postal_code), []):
+                if min(low, high) <= number <= max(low, high):
+                    fraction = float(number - low) / (high - low) if high != low else 0.5
+                    return (from_latitude + fraction * (to_latitude - from_latitude),
+                        from_longitude + fraction * (to_longitude - from_longitude), 'street')
+        country = str(address.country).upper()
+        if (country, postal_code) in self.postal_codes:
+            return self.postal_codes[(country, postal_code)] + ('postal',)
+        key = (country, address.state.strip().upper(), address.city.strip().upper())
+        if key in self.cities:
+            return self.cities[key] + ('city',)
+        return None, None, ''
+
+def geocodeAddresses(gazetteer, batch_size=BATCH_SIZE, retry_unmatched=False):
+    """
+    Geocode every Address instance that has not been geocoded yet, and, if 'retry_unmatched', every
+    Address that was not found before.  Return a dictionary counting addresses by outcome: 'street',
+    'postal', 'city', 'unmatched', and 'cached' (found in the cache).
+
+    Addresses are processed in batches ordered by primary key.  Each batch costs one query to read
+    addresses, one to read the cache, one to add new cache entries, and one UPDATE for as many of its
+    addresses as the database accepts parameters for (199 on SQLite).
+    """
+    counts = dict.fromkeys(['street', 'postal', 'city', 'unmatched', 'cached'], 0)
+    to_geocode = Q(geocoded_on=None)
+    if retry_unmatched:
+        GeocodedLocation.objects.filter(latitude=None).delete()     # Cached misses would be reused
+        to_geocode |= Q(latitude=None)
+    last_pk = 0
+    while True:
+        addresses = list(Address.objects.filter(to_geocode, pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not addresses:
+            return counts
+        last_pk = addresses[-1].pk
+        keys = dict((address.pk, normalizeAddress(address.street, address.city, address.state, address.country,
+            address.postal_code)) for address in addresses)
+        cached = dict((location.key, location) for location in GeocodedLocation.objects.filter(key__in=set(keys.values())))
+
+        new_locations = {}
+        coordinates = {}    # Address pk -> (latitude, longitude)
+        for address in addresses:
+            key = keys[address.pk]
+            if key in cached:
+                location = cached[key]
+                counts['cached'] += 1
+            elif key in new_locations:
+                location = new_locations[key]
+                counts['cached'] += 1
+            else:
+                latitude, longitude, precision = gazetteer.locate(address)
+                location = GeocodedLocation(key=key, latitude=latitude, longitude=longitude, precision=precision)
+                new_locations[key] = location
+                counts[precision or 'unmatched'] += 1
+            coordinates[address.pk] = (location.latitude, location.longitude)
+        GeocodedLocation.objects.bulk_create(new_locations.values())
+
+        # One UPDATE sets different coordinates on many addresses.  Each address costs four parameters in
+        # the CASE expressions and one in the WHERE clause.
+        pks = sorted(coordinates)
+        update_size = max(1, connection.ops.bulk_batch_size([None] * 5, pks))
+        geocoded_on = datetime.now()
+        for start in range(0, len(pks), update_size):
+            update_pks = pks[start:start + update_size]
+            Address.objects.filter(pk__in=update_pks).update(
+                latitude=Case(*[When(pk=pk, then=Value(coordinates[pk][0])) for pk in update_pks],
+                    output_field=FloatField()),
+                longitude=Case(*[When(pk=pk, then=Value(coordinates[pk][1])) for pk in update_pks],
+                    output_field=FloatField()),
+                geocoded_on=geocoded_on)
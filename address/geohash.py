@@ -0,0 +1,92 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Geohash grid cells for proximity queries.  A geohash names a rectangular cell of the earth, and each
+additional character divides the cell into 32 smaller cells.  Rows store the geohash of their location
+at a fixed precision, so finding rows near a point means finding the cells that cover a circle around
+it and matching those cells exactly, which an ordinary B-tree index answers.
+
+http://en.wikipedia.org/wiki/Geohash
+"""
+
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS = 6371.0   # Kilometers
+KM_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+# Cells of 6 characters are about 1.2 km wide and 0.6 km tall, which suits walking distances.
+PRECISION = 6
+MAX_CELLS = 500         # Limits the size of IN clauses.  See cellsWithin.
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Return the geohash of the cell of the given precision containing the point."""
+    latitude_range, longitude_range = [-90.0, 90.0], [-180.0, 180.0]
+    characters = []
+    bits, value, even = 0, 0, True
+    while len(characters) < precision:
+        # Bits alternate between longitude and latitude, starting with longitude.
+        interval, coordinate = (longitude_range, longitude) if even else (latitude_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            characters.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(characters)
+
+def cellSize(precision=PRECISION):
+    """Return the tuple (height, width), in degrees, of cells of the given precision."""
+    longitude_bits = (5 * precision + 1) // 2
+    latitude_bits = 5 * precision // 2
+    return 180.0 / 2 ** latitude_bits, 360.0 / 2 ** longitude_bits
+
+def boundingBox(latitude, longitude, radius):
+    """
+    Return the tuple (min latitude, max latitude, min longitude, max longitude) of a box containing
+    every point within 'radius' kilometers of the given point.
+    """
+    latitude_delta = radius / KM_PER_DEGREE
+    longitude_delta = radius / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+    return (max(latitude - latitude_delta, -90.0), min(latitude + latitude_delta, 90.0),
+        longitude - longitude_delta, longitude + longitude_delta)
+
+def cellsWithin(latitude, longitude, radius, precision=PRECISION):
+    """
+    Return a set of geohashes of the given precision whose cells cover the circle of 'radius'
+    kilometers around the point.  The circle's bounding box is walked one cell at a time.  A radius
+    too large for MAX_CELLS cells raises ValueError; use a coarser precision for such searches.
+    """
+    min_latitude, max_latitude, min_longitude, max_longitude = boundingBox(latitude, longitude, radius)
+    height, width = cellSize(precision)
+    # Snap to cell centers so that each step lands in the next cell
+    first_latitude = (math.floor(min_latitude / height) + 0.5) * height
+    first_longitude = (math.floor(min_longitude / width) + 0.5) * width
+    rows = int(math.floor((max_latitude - first_latitude) / height + 0.5)) + 1
+    columns = int(math.floor((max_longitude - first_longitude) / width + 0.5)) + 1
+    if rows * columns > MAX_CELLS:
+        raise ValueError('A radius of {0} km needs more than {1} cells.'.format(radius, MAX_CELLS))
+    cells = set()
+    for row in range(rows):
+        cell_latitude = min(first_latitude + row * height, 90.0 - height / 2)
+        for column in range(columns):
+            cell_longitude = (first_longitude + column * width + 180.0) % 360.0 - 180.0    # Wrap at 180 degrees
+            cells.add(encode(cell_latitude, cell_longitude, precision))
+    return cells
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """Return the great-circle distance in kilometers between two points (haversine formula)."""
+    latitude1, longitude1, latitude2, longitude2 = map(math.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = math.sin((latitude2 - latitude1) / 2) ** 2 + \
+        math.cos(latitude1) * math.cos(latitude2) * math.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
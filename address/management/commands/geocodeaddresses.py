@@ -0,0 +1,36 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from address.geocode import BATCH_SIZE, Gazetteer, geocodeAddresses
+from django.core.management.base import BaseCommand, CommandError
+
+class Command(BaseCommand):
+    help = ('Geocode addresses that have not been geocoded yet using local gazetteer files.  See address.geocode.  '
+        'Afterwards, run indexvoterlocations.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--postal-codes', action='append', default=[], help='GeoNames postal code file')
+        parser.add_argument('--street-ranges', action='append', default=[], help='Street address range file')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Addresses per batch')
+        parser.add_argument('--retry-unmatched', action='store_true',
+            help='Also geocode addresses that earlier runs did not find, such as after adding files')
+
+    def handle(self, *args, **options):
+        if not options['postal_codes'] and not options['street_ranges']:
+            raise CommandError('Give at least one --postal-codes or --street-ranges file.')
+        gazetteer = Gazetteer()
+        try:
+            for path in options['postal_codes']:
+                gazetteer.loadPostalCodes(path)
+            for path in options['street_ranges']:
+                gazetteer.loadStreetRanges(path)
+        except IOError as e:
+            raise CommandError(str(e))
+        counts = geocodeAddresses(gazetteer, batch_size=options['batch_size'],
+            retry_unmatched=options['retry_unmatched'])
+        self.stdout.write('Located {street} by street, {postal} by postal code, and {city} by city; reused {cached} '
+            'cached results; {unmatched} not found.'.format(**counts))
@@ -21,9 +21,30 @@ class Address(models.Model):
     postal_code = models.CharField(max_length=10)   # TODO - Verify that no country uses longer codes
     datetime = models.DateTimeField(auto_now_add=True)
 
+    # Coordinates are filled in offline by address.geocode.  'geocoded_on' is set when geocoding is attempted,
+    # even if no coordinates are found, so that each run only considers new addresses.
+    latitude = models.FloatField(null=True, blank=True, editable=False)
+    longitude = models.FloatField(null=True, blank=True, editable=False)
+    geocoded_on = models.DateTimeField(null=True, blank=True, editable=False)
+
     def getLocation(self):
         return '{0}, {1}'.format(self.city, self.state)
 
     def __unicode__(self):
         """Returns 'street address; City, State Country postal_code'"""
         return '{0}; {1}, {2} {3} {4}'.format(self.street, self.city, self.state, self.country.alpha3, self.postal_code)
+
+class GeocodedLocation(models.Model):
+    """
+    A cache of geocoding results keyed by normalized address.  Many Address rows share the same
+    normalized address, and re-running the geocoder should not repeat lookups.  Rows with null
+    coordinates record addresses the gazetteer could not locate.
+    """
+    key = models.CharField(max_length=150, unique=True)   # See address.geocode.normalizeAddress
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    precision = models.CharField(max_length=6, blank=True,
+        choices=(('street', 'Street address'), ('postal', 'Postal code'), ('city', 'City')))
+
+    def __unicode__(self):
+        return '{0} ({1}, {2})'.format(self.key, self.latitude, self.longitude)
@@ -6,7 +6,14 @@ the author's qualifications.  No other uses are permitted.
 """
 
 from address.forms import AddressForm
+from address.geocode import Gazetteer, geocodeAddresses
+from address.models import Address, GeocodedLocation
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+import os
+import shutil
+import tempfile
 
 class AddressFormTests(TestCase):
     """Tests for AddressForm."""
@@ -55,3 +62,78 @@ class AddressFormTests(TestCase):
         """
         self.assertEqual(self.address_form.cleaned_data['street'], '217 Tyne Rd')
         # TODO - Test other abbreviations; maybe; if one works, they all will work
+
+class GeocodeTests(TestCase):
+    """Tests for offline batch geocoding."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        postal_codes = os.path.join(directory, 'postal_codes.txt')
+        with open(postal_codes, 'w') as f:
+            f.write('US\t40207\tLouisville\tKentucky\tKY\t\t\t\t\t38.2650\t-85.6500\t4\n')
+            f.write('US\t40202\tLouisville\tKentucky\tKY\t\t\t\t\t38.2450\t-85.7500\t4\n')
+        street_ranges = os.path.join(directory, 'street_ranges.txt')
+        with open(street_ranges, 'w') as f:
+            f.write('street\tfrom_number\tto_number\tpostal_code\tfrom_latitude\tfrom_longitude\tto_latitude\tto_longitude\n')
+            f.write('Tyne Road\t200\t300\t40207\t38.0\t-85.0\t39.0\t-86.0\n')
+        self.gazetteer = Gazetteer()
+        self.gazetteer.loadPostalCodes(postal_codes)
+        self.gazetteer.loadStreetRanges(street_ranges)
+
+        fields = {'city': 'Louisville', 'state': 'KY', 'country': 'US'}
+        self.street = Address.objects.create(street='250 Tyne Rd', postal_code='40207', **fields)
+        self.duplicate = Address.objects.create(street='250 TYNE ROAD', postal_code='40207', **fields)
+        self.postal = Address.objects.create(street='1 Main Str', postal_code='40207', **fields)
+        self.city = Address.objects.create(street='1 Main Str', postal_code='40299', **fields)
+        self.unmatched = Address.objects.create(street='1 Main Str', city='Lexington', state='KY', country='US',
+            postal_code='40507')
+
+    def testGeocodeAddresses(self):
+        """Each address is located as precisely as possible, and equivalent addresses are looked up once."""
+        counts = geocodeAddresses(self.gazetteer, batch_size=2)
+        self.assertEqual(counts, {'street': 1, 'postal': 1, 'city': 1, 'unmatched': 1, 'cached': 1})
+
+        addresses = Address.objects.in_bulk([self.street.pk, self.duplicate.pk, self.postal.pk, self.city.pk,
+            self.unmatched.pk])
+        self.assertAlmostEqual(addresses[self.street.pk].latitude, 38.5)       # Interpolated halfway along the range
+        self.assertAlmostEqual(addresses[self.street.pk].longitude, -85.5)
+        self.assertAlmostEqual(addresses[self.duplicate.pk].latitude, 38.5)
+        self.assertAlmostEqual(addresses[self.postal.pk].latitude, 38.265)
+        self.assertAlmostEqual(addresses[self.city.pk].latitude, 38.255)       # Average of the city's postal codes
+        self.assertIsNone(addresses[self.unmatched.pk].latitude)
+        self.assertTrue(all(address.geocoded_on for address in addresses.values()))
+        self.assertEqual(GeocodedLocation.objects.count(), 4)
+
+    def testLargeBatch(self):
+        """A batch with more parameters than SQLite allows in one statement should be updated in parts."""
+        Address.objects.bulk_create([Address(street='{0} Main Str'.format(i), city='Louisville', state='KY',
+            country='US', postal_code='40202') for i in range(300)])
+        with CaptureQueriesContext(connection) as captured:
+            counts = geocodeAddresses(self.gazetteer, batch_size=500)
+        self.assertEqual(counts['postal'], 301)
+        updates = [query for query in captured if query['sql'].startswith('UPDATE "address_address"')]
+        self.assertEqual(len(updates), 2 if connection.vendor == 'sqlite' else 1)   # 199 per UPDATE on SQLite
+        self.assertFalse(Address.objects.filter(geocoded_on=None).exists())
+        self.assertEqual(Address.objects.filter(latitude=38.245).count(), 300)
+
+    def testIncrementalRun(self):
+        """A second run only considers new addresses, and reuses cached results for them."""
+        geocodeAddresses(self.gazetteer)
+        new = Address.objects.create(street=' 250  tyne road ', city='Louisville', state='KY', country='US',
+            postal_code='40207')
+        with self.assertNumQueries(4):  # Read addresses, read the cache, UPDATE, and the final empty read
+            counts = geocodeAddresses(self.gazetteer)
+        self.assertEqual(counts['cached'], 1)
+        self.assertEqual(sum(counts.values()), 1)
+        self.assertAlmostEqual(Address.objects.get(pk=new.pk).latitude, 38.5)
+
+    def testRetryUnmatched(self):
+        """Addresses not found are skipped by later runs unless retried, for example with a better file."""
+        geocodeAddresses(self.gazetteer)
+        self.gazetteer.postal_codes[('US', '40507')] = (38.03, -84.5)
+        self.assertEqual(sum(geocodeAddresses(self.gazetteer).values()), 0)
+        counts = geocodeAddresses(self.gazetteer, retry_unmatched=True)
+        self.assertEqual((counts['postal'], sum(counts.values())), (1, 1))
+        self.assertAlmostEqual(Address.objects.get(pk=self.unmatched.pk).latitude, 38.03)
+        self.assertFalse(GeocodedLocation.objects.filter(latitude=None).exists())
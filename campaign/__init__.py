@@ -0,0 +1,8 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+default_app_config = 'campaign.apps.CampaignConfig'
@@ -5,11 +5,17 @@ All rights reserved.  You are welcome to inspect this code for your education or
 the author's qualifications.  No other uses are permitted.
 """
 
-from campaign.models import Campaign
+from campaign.models import Campaign, WalkList
+from campaign.walklist import assignWalkList
 from tastypie.authentication import BasicAuthentication, MultiAuthentication, SessionAuthentication
 from tastypie.authorization import ReadOnlyAuthorization
+from tastypie.exceptions import BadRequest
 from tastypie.resources import ModelResource
-from tastypie.throttle import CacheThrottle
+from tcswebapp.apicache import CachedListMixin
+from tcswebapp.metrics import TimedSerializer
+from tcswebapp.pagination import KeysetPaginator
+from tcswebapp.throttle import TokenBucketThrottle
+import json
 
 class CampaignAuthorization(ReadOnlyAuthorization):
     """Return a list of campaigns the user owns or for which the user works."""
@@ -23,15 +29,69 @@ class CampaignAuthorization(ReadOnlyAuthorization):
         campaigns = bundle.request.user.works_for.filter(is_active=True) | Campaign.objects.filter(owner=bundle.request.user, is_active=True)
         return campaigns.distinct()
 
-class CampaignResource(ModelResource):
-    """Use this resource to return a list of campaigns the user owns or for which the user works."""
+class CampaignResource(CachedListMixin, ModelResource):
+    """
+    Use this resource to return a list of campaigns the user owns or for which the user works.  Responses
+    are cached per user by the versions 'campaigns', which changes whenever a campaign is saved or deleted,
+    and 'campaigns_user_<pk>', which changes whenever the user joins or leaves a campaign's workers.  See
+    tcswebapp.apicache.
+
+    The list is ordered by id, or by name with "order_by=name", and paged by keyset: pass the cursor
+    meta.after of a page as the GET parameter 'after' to get the next.  See tcswebapp.pagination.
+    """
     class Meta:
         queryset = Campaign.objects.filter(is_active=True)
         max_limit = 20
+        paginator_class = KeysetPaginator
+        ordering = ['name']
         authentication = MultiAuthentication(SessionAuthentication(), BasicAuthentication())
         authorization = CampaignAuthorization()
         list_allowed_methods = ['get']
         detail_allowed_methods = []
         include_resource_uri = False
         fields = ['id', 'name']
-        throttling = CacheThrottle(throttle_at=1, timeframe=60) # 1 request every minute
+        throttle = TokenBucketThrottle('campaign', capacity=3, refill_seconds=20) # 3 requests every minute
+        serializer = TimedSerializer()
+
+    def getCacheVariant(self, request):
+        return str(request.user.pk)
+
+    def getCacheVersionNames(self, request):
+        return ['campaigns', 'campaigns_user_{0}'.format(request.user.pk)]
+
+class WalkListResource(ModelResource):
+    """
+    Use this resource to receive a walk list for door-to-door canvassing near the user.  GET parameters
+    'campaign_id', 'latitude', and 'longitude' are required.  The response lists at most one walk list,
+    with its route of households and voters embedded.  See campaign.walklist.assignWalkList.
+    """
+    class Meta:
+        queryset = WalkList.objects.all()
+        authentication = MultiAuthentication(SessionAuthentication(), BasicAuthentication())
+        list_allowed_methods = ['get']
+        detail_allowed_methods = []
+        fields = ['id', 'num_households', 'num_voters', 'distance', 'route']
+        throttle = TokenBucketThrottle('walklist', capacity=5, refill_seconds=600) # 1 request every 10 minutes
+        serializer = TimedSerializer()
+
+    def get_list(self, request, **kwargs):
+        """Assign the nearest walk list, or return the walk list already assigned to the user today."""
+        try:
+            campaign_id = int(request.GET['campaign_id'])
+            latitude, longitude = float(request.GET['latitude']), float(request.GET['longitude'])
+        except (KeyError, ValueError):
+            raise BadRequest("Invalid campaign_id, latitude, or longitude")
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):   # Also false for NaN
+            raise BadRequest("Invalid campaign_id, latitude, or longitude")
+        campaign = Campaign.objects.filter(pk=campaign_id, is_active=True).first()
+        walk_list = None
+        if campaign and campaign.authorizes(request.user):
+            try:
+                walk_list = assignWalkList(campaign, request.user, latitude, longitude)
+            except ValueError:  # Near the poles, the search radius needs too many geohash cells
+                raise BadRequest("Walk lists are not available at this latitude")
+        objects = []
+        if walk_list:
+            objects.append(dict((name, getattr(walk_list, name)) for name in self._meta.fields))
+            objects[0]['route'] = json.loads(walk_list.route)
+        return self.create_response(request, {'objects': objects})
@@ -0,0 +1,17 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django.apps import AppConfig
+
+class CampaignConfig(AppConfig):
+    name = 'campaign'
+    verbose_name = 'Campaign'
+
+    def ready(self):
+        """Connect signals."""
+        super(CampaignConfig, self).ready()
+        import campaign.signals
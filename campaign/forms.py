@@ -49,3 +49,7 @@ class CampaignSearchForm(forms.ModelForm):
 
     id = forms.IntegerField(min_value=1, required=False)
     name = forms.CharField(max_length=100, required=False, widget=forms.TextInput(attrs={'class': 'form-control'}))
+
+class VolunteerImportForm(forms.Form):
+    """Use this form to upload a CSV file of volunteers.  See tcsuser.onboarding."""
+    csv_file = forms.FileField(label='CSV file')
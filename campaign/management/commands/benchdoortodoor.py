@@ -0,0 +1,93 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from address import geohash
+from address.models import Address
+from campaign.models import Campaign, CampaignsToVoters, orderByDistance
+from datetime import date
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from timeit import default_timer
+from voter.models import Voter, VoterList
+import random
+
+class Command(BaseCommand):
+    help = ('Compare finding the nearest voters for door-to-door contact with the geohash index and with a bounding '
+        'box scan of every campaign voter.  Synthetic voters are added to the database and removed afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=1000000, help='Geocoded voters in the campaign (default 1000000)')
+        parser.add_argument('--queries', type=int, default=50, help='Queries per method (default 50)')
+        parser.add_argument('--radius', type=float, default=1.0, help='Search radius in kilometers (default 1)')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        with transaction.atomic():
+            try:
+                campaign = self.createVoters(options['voters'])
+                self.benchmark(campaign, options['queries'], options['radius'])
+            finally:
+                transaction.set_rollback(True)  # Remove the synthetic data
+
+    def createVoters(self, num_voters, batch_size=10000):
+        """Return a new campaign with voters spread evenly over a 50 km square around Columbus, Ohio."""
+        start = default_timer()
+        # bulk_create skips the post_save listener that e-mails an activation link
+        get_user_model().objects.bulk_create([get_user_model()(email='benchdoortodoor@tcs.com')])
+        owner = get_user_model().objects.get(email='benchdoortodoor@tcs.com')
+        home = Address.objects.create(street='1 Main Str', city='Columbus', state='OH', country='US', postal_code='43215')
+        campaign = Campaign.objects.create(owner=owner, address=home, name='Door-to-door benchmark', is_active=True)
+        voter_list = VoterList.objects.create(dump_date=date.today(), campaign=campaign, file_name='/dev/null')
+
+        # bulk_create does not return primary keys on every database, so assign them
+        first_address_pk = (Address.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+        first_voter_pk = (Voter.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+        for offset in range(0, num_voters, batch_size):
+            addresses, voters, relations = [], [], []
+            for i in range(offset, min(offset + batch_size, num_voters)):
+                latitude, longitude = 39.96 + random.uniform(-0.225, 0.225), -83.0 + random.uniform(-0.29, 0.29)
+                addresses.append(Address(pk=first_address_pk + i, street='{0} Main Str'.format(i), city='Columbus',
+                    state='OH', country='US', postal_code='43215', latitude=latitude, longitude=longitude))
+                voters.append(Voter(pk=first_voter_pk + i, first_name='Voter', last_name=str(i), dump_date=date.today(),
+                    address_id=first_address_pk + i))
+                relations.append(CampaignsToVoters(campaign=campaign, voter_id=first_voter_pk + i, voter_list=voter_list,
+                    geohash=geohash.encode(latitude, longitude)))
+            Address.objects.bulk_create(addresses)
+            Voter.objects.bulk_create(voters)
+            CampaignsToVoters.objects.bulk_create(relations)
+        self.stdout.write('Created {0} voters in {1:.1f} seconds.'.format(num_voters, default_timer() - start))
+        return campaign
+
+    def benchmark(self, campaign, num_queries, radius):
+        points = [(39.96 + random.uniform(-0.2, 0.2), -83.0 + random.uniform(-0.26, 0.26)) for i in range(num_queries)]
+
+        def scan(latitude, longitude):
+            min_latitude, max_latitude, min_longitude, max_longitude = geohash.boundingBox(latitude, longitude, radius)
+            voters = campaign.getVotersToContact().filter(address__latitude__range=(min_latitude, max_latitude),
+                address__longitude__range=(min_longitude, max_longitude)).exclude(wrong_address__gt=1)
+            return list(orderByDistance(voters, latitude, longitude).values_list('pk', flat=True)[:20])
+
+        def index(latitude, longitude):
+            voters = campaign.getVotersDoorToDoor(latitude, longitude, radius)
+            return list(orderByDistance(voters, latitude, longitude).values_list('pk', flat=True)[:20])
+
+        if any(scan(*point) != index(*point) for point in points[:5]):
+            self.stderr.write('The two methods found different voters.')
+            return
+
+        results = []
+        for name, function in (('Bounding box scan', scan), ('Geohash index', index)):
+            start = default_timer()
+            for point in points:
+                function(*point)
+            milliseconds = (default_timer() - start) * 1000 / num_queries
+            results.append(milliseconds)
+            self.stdout.write('{0:<18}{1:10.2f} milliseconds per query'.format(name, milliseconds))
+        self.stdout.write('Speedup: {0:.1f}x'.format(results[0] / results[1]))
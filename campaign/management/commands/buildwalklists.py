@@ -0,0 +1,31 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from campaign.models import Campaign
+from campaign.walklist import ROUTE_TIME_LIMIT, TURF_SIZE, buildWalkLists
+from django.core.management.base import BaseCommand
+from timeit import default_timer
+
+class Command(BaseCommand):
+    help = ("Rebuild the unassigned walk lists for door-to-door canvassing of active campaigns.  Run this after "
+        "indexvoterlocations, and daily so that walk lists leave out voters recently contacted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_id', type=int, nargs='*', help='Campaigns to rebuild (default: all active)')
+        parser.add_argument('--turf-size', type=int, default=TURF_SIZE, help='Households per walk list')
+        parser.add_argument('--time-limit', type=float, default=ROUTE_TIME_LIMIT,
+            help='Seconds to spend improving each route')
+
+    def handle(self, *args, **options):
+        campaigns = Campaign.objects.filter(is_active=True)
+        if options['campaign_id']:
+            campaigns = campaigns.filter(pk__in=options['campaign_id'])
+        for campaign in campaigns:
+            start = default_timer()
+            count = buildWalkLists(campaign, turf_size=options['turf_size'], time_limit=options['time_limit'])
+            self.stdout.write('{0}: built {1} walk lists in {2:.1f} seconds.'.format(campaign, count,
+                default_timer() - start))
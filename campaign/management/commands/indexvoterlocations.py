@@ -0,0 +1,19 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from campaign.models import indexVoterLocations
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+    help = ("Index campaign constituents by the geohash of their geocoded addresses for door-to-door contact.  "
+        "Run this after geocodeaddresses.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per batch')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Indexed {0} constituents.'.format(indexVoterLocations(batch_size=options['batch_size'])))
@@ -0,0 +1,44 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# See campaign.search for how these indexes are used.
+
+def createSearchIndex(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute('CREATE INDEX campaign_campaign_name_trgm ON campaign_campaign USING gin (name gin_trgm_ops)')
+        schema_editor.execute('CREATE INDEX campaign_office_title_trgm ON campaign_office USING gin (title gin_trgm_ops)')
+    elif connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 34, 0):
+        schema_editor.execute("CREATE VIRTUAL TABLE campaign_campaign_fts USING fts5(name, office, tokenize='trigram')")
+        schema_editor.execute(
+            "INSERT INTO campaign_campaign_fts (rowid, name, office) "
+            "SELECT c.id, c.name, COALESCE(o.title, '') FROM campaign_campaign c "
+            "LEFT OUTER JOIN campaign_office o ON o.id = c.office_id")
+
+def dropSearchIndex(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS campaign_campaign_name_trgm')
+        schema_editor.execute('DROP INDEX IF EXISTS campaign_office_title_trgm')
+    elif connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS campaign_campaign_fts')
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0002_auto_20160909_1851'),
+    ]
+
+    operations = [
+        migrations.RunPython(createSearchIndex, dropSearchIndex),
+    ]
@@ -0,0 +1,31 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-19 17:36
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaign', '0003_campaign_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaignstovoters',
+            name='geohash',
+            field=models.CharField(blank=True, default=b'', editable=False, max_length=12),
+        ),
+        migrations.AlterIndexTogether(
+            name='campaignstovoters',
+            index_together=set([('campaign', 'geohash')]),
+        ),
+    ]
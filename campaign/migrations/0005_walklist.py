@@ -0,0 +1,46 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-19 17:49
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('campaign', '0004_campaignstovoters_geohash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalkList',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('geohash', models.CharField(max_length=12)),
+                ('num_households', models.PositiveIntegerField()),
+                ('num_voters', models.PositiveIntegerField()),
+                ('distance', models.FloatField(help_text=b'Kilometers from the first stop to the last')),
+                ('route', models.TextField()),
+                ('assigned_on', models.DateTimeField(blank=True, null=True)),
+                ('assigned_to', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='campaign.Campaign')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='walklist',
+            index_together=set([('campaign', 'assigned_to', 'geohash')]),
+        ),
+    ]
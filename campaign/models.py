@@ -5,13 +5,17 @@ All rights reserved.  You are welcome to inspect this code for your education or
 the author's qualifications.  No other uses are permitted.
 """
 
+from address import geohash
 from address.models import Address
 from datetime import date, timedelta
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models import Q
+from django.db.models import Case, CharField, Count, ExpressionWrapper, F, FloatField, Q, Value, When
 from django_countries.fields import CountryField
+import math
+
+DOOR_TO_DOOR_RADIUS = 1.0   # Kilometers
 
 class Office(models.Model):
     """
@@ -127,11 +131,14 @@ class Campaign(models.Model):
         # TODO
         return self.workers.all()
 
-    def getVotersToContact(self):
+    def getVotersToContact(self, **lookups):
         """
         Return active constituent voters who have not been contacted since the last election and
         have not been served to a supporter in the last two days.  Don't limit the size of the
         result set here; let APIs do that.
+
+        Optional keyword arguments are further lookups.  They are applied in the same filter() call,
+        so lookups spanning 'campaignstovoters' apply to this campaign's row.
         """
         two_days_ago = date.today() - timedelta(2)
         year_ago = date.today() - timedelta(365)
@@ -139,7 +146,8 @@ class Campaign(models.Model):
             Q(campaignstovoters__last_served=None) | Q(campaignstovoters__last_served__lt=two_days_ago),
             Q(campaignstovoters__last_contacted=None) | Q(campaignstovoters__last_contacted__lt=year_ago),
             campaignstovoters__is_active=True,
-            is_active=True)
+            is_active=True,
+            **lookups)
 
     def getVotersToDial(self):
         """
@@ -150,13 +158,29 @@ class Campaign(models.Model):
             (Q(phone_number1='') | Q(wrong_phone_number1__gt=1)),
             (Q(phone_number2='') | Q(wrong_phone_number2__gt=1)))
 
-    def getVotersDoorToDoor(self, latitude, longitude):
+    def getVotersDoorToDoor(self, latitude, longitude, radius=DOOR_TO_DOOR_RADIUS):
         """
         Return active constituent voters in proximity to given latitude and longitude coordinates.  (Database
         contrainsts require all rows in the voters table to have valid address information.)  Don't limit the
         size of the result set here; let APIs do that.
+
+        Voters are found within a box around a circle of 'radius' kilometers.  Only the rows of CampaignsToVoters
+        in the geohash cells covering the circle are read, using the index on (campaign, geohash).  Use
+        orderByDistance to serve the nearest voters first.
+        """
+        min_latitude, max_latitude, min_longitude, max_longitude = geohash.boundingBox(latitude, longitude, radius)
+        return self.getVotersToCanvass(
+            campaignstovoters__geohash__in=geohash.cellsWithin(latitude, longitude, radius),
+            address__latitude__range=(min_latitude, max_latitude),
+            address__longitude__range=(min_longitude, max_longitude))
+
+    def getVotersToCanvass(self, **lookups):
+        """
+        Return voters to contact whose addresses have been geocoded and indexed (see indexVoterLocations).  Like
+        getVotersToDial, exclude voters whose contact information, here the address, has been flagged more than
+        once.  Optional keyword arguments are passed to getVotersToContact.
         """
-        pass
+        return self.getVotersToContact(campaignstovoters__geohash__gt='', **lookups).exclude(wrong_address__gt=1)
 
     def removeWorker(self, user):
         """
@@ -180,6 +204,10 @@ class Campaign(models.Model):
         """Return the number of voters a user has contacted for the campaign."""
         return self.votercontact_set.filter(user=user).count()
 
+    def voterContactCounts(self):
+        """Return a dictionary mapping the id of each user who has contacted voters for the campaign to the count."""
+        return dict(self.votercontact_set.order_by().values_list('user').annotate(count=Count('pk')))
+
     def __unicode__(self):
         return self.name
 
@@ -195,6 +223,72 @@ class CampaignsToVoters(models.Model):
     last_contacted = models.DateField(null=True, default=None)
     last_served = models.DateField(null=True, default=None)
     is_active = models.BooleanField(default=True)
+    # The geohash of the voter's geocoded address, or '' until indexVoterLocations runs.  See address.geohash.
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
+
+    class Meta:
+        index_together = [('campaign', 'geohash')]
 
     def __unicode__(self):
         return 'id={0}, campaign_id={1}, voter_id={2}, list_id={3}'.format(self.pk, self.campaign.pk, self.voter.pk, self.voter_list.pk)
+
+def indexVoterLocations(batch_size=500, voter_list=None):
+    """
+    Set the geohash of rows in CampaignsToVoters whose voters' addresses have been geocoded since the
+    rows were created.  Run this after address.geocode.geocodeAddresses.  Return the number of rows
+    updated.  Each batch is read with one query and written with one UPDATE.  Pass 'voter_list' to
+    index only the rows of one list.
+    """
+    count = 0
+    last_pk = 0
+    rows_to_index = CampaignsToVoters.objects.filter(geohash='', voter__address__latitude__isnull=False)
+    if voter_list is not None:
+        rows_to_index = rows_to_index.filter(voter_list=voter_list)
+    while True:
+        rows = list(rows_to_index.filter(pk__gt=last_pk)
+            .order_by('pk').values_list('pk', 'voter__address__latitude', 'voter__address__longitude')[:batch_size])
+        if not rows:
+            return count
+        last_pk = rows[-1][0]
+        CampaignsToVoters.objects.filter(pk__in=[row[0] for row in rows]).update(geohash=Case(
+            *[When(pk=pk, then=Value(geohash.encode(latitude, longitude))) for pk, latitude, longitude in rows],
+            output_field=CharField()))
+        count += len(rows)
+
+def orderByDistance(voters, latitude, longitude):
+    """
+    Order a QuerySet of voters nearest first.  The distance is approximated by treating a small area
+    as flat, which needs only arithmetic that every database supports and is accurate within a few
+    kilometers.  Use it with Campaign.getVotersDoorToDoor, after any intersection of QuerySets.
+    """
+    scale = math.cos(math.radians(latitude))   # Degrees of longitude shrink away from the equator
+    latitude_delta = F('address__latitude') - Value(latitude)
+    longitude_delta = (F('address__longitude') - Value(longitude)) * Value(scale)
+    return voters.annotate(distance=ExpressionWrapper(latitude_delta * latitude_delta + longitude_delta * longitude_delta,
+        output_field=FloatField())).order_by('distance', 'pk')
+
+class WalkList(models.Model):
+    """
+    A precomputed route through nearby households for one canvassing shift.  Walk lists are built in
+    batch by campaign.walklist.buildWalkLists and assigned to one canvasser each.  'route' is a JSON
+    list of stops in walking order, each listing the voters of one household, so serving a walk list
+    needs no further queries.
+    """
+    campaign = models.ForeignKey(Campaign)
+    created_on = models.DateTimeField(auto_now_add=True)
+    # The first stop, and the geohash of the first stop to find walk lists near a canvasser
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    geohash = models.CharField(max_length=12)
+    num_households = models.PositiveIntegerField()
+    num_voters = models.PositiveIntegerField()
+    distance = models.FloatField(help_text='Kilometers from the first stop to the last')
+    route = models.TextField()
+    assigned_to = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True)
+    assigned_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = [('campaign', 'assigned_to', 'geohash')]
+
+    def __unicode__(self):
+        return '{0} households near {1}, {2}'.format(self.num_households, self.latitude, self.longitude)
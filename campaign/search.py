@@ -0,0 +1,178 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Indexed campaign search.  Prospective volunteers search for campaigns by name, office, and district.
+A case-insensitive substring filter (name__icontains) cannot use an index, so it scans the entire
+campaign table.  Instead, this module ranks matches using an index appropriate to the database:
+
+    PostgreSQL - pg_trgm GIN indexes on campaign_campaign.name and campaign_office.title
+    SQLite - An FTS5 virtual table, campaign_campaign_fts, using the trigram tokenizer
+
+The migration campaign.0003_campaign_search creates these indexes.  On SQLite, the listeners in
+campaign.signals keep the virtual table synchronized with the campaign table.  If neither index is
+available, or if the query text is too short for trigram matching, searching falls back to a filter
+on the campaign name.
+
+Results are paginated by keyset rather than by offset.  Every page is ordered by (rank, id), and the
+cursor for the next page encodes the rank and id of the last result on the current page.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from campaign.models import Campaign
+from django.db import connection
+
+FTS_TABLE = 'campaign_campaign_fts'
+MIN_TERM_LENGTH = 3     # Trigram matching ignores shorter terms
+
+_indexed_databases = set()  # Names of the SQLite databases known to have FTS_TABLE
+
+def hasSearchIndex():
+    """
+    Return True if the default database has an index for campaign search.  On SQLite, the migration
+    creates FTS_TABLE only if the SQLite library of the time had the trigram tokenizer, so look for
+    the table rather than at the version of the library.  A table found is remembered, so only
+    databases without one pay for the lookup on every call.
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _indexed_databases:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            if cursor.fetchone() is None:
+                return False
+        _indexed_databases.add(name)
+    return True
+
+def encodeCursor(rank, pk):
+    """Return an opaque string identifying the position of a search result."""
+    return urlsafe_b64encode('{0!r}:{1}'.format(rank, pk))
+
+def decodeCursor(cursor):
+    """
+    Return the tuple (rank, pk) encoded by encodeCursor, or return None if 'cursor' is empty or
+    has been tampered with.
+    """
+    if not cursor:
+        return None
+    try:
+        rank, pk = urlsafe_b64decode(str(cursor)).split(':')
+        return float(rank), int(pk)
+    except (TypeError, ValueError):
+        return None
+
+def updateSearchIndex(pks):
+    """
+    Replace the full-text index rows for the campaigns with the given primary keys.  This is only
+    necessary on SQLite; the PostgreSQL indexes are on the campaign and office tables themselves.
+    """
+    pks = list(pks)
+    if not pks or connection.vendor != 'sqlite' or not hasSearchIndex():
+        return
+    placeholders = ', '.join(['%s'] * len(pks))
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE rowid IN ({1})'.format(FTS_TABLE, placeholders), pks)
+        cursor.execute(
+            'INSERT INTO {0} (rowid, name, office) '
+            'SELECT c.id, c.name, COALESCE(o.title, \'\') FROM campaign_campaign c '
+            'LEFT OUTER JOIN campaign_office o ON o.id = c.office_id '
+            'WHERE c.id IN ({1})'.format(FTS_TABLE, placeholders), pks)
+
+def removeFromSearchIndex(pks):
+    """Delete the full-text index rows for the campaigns with the given primary keys."""
+    pks = list(pks)
+    if not pks or connection.vendor != 'sqlite' or not hasSearchIndex():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE rowid IN ({1})'.format(FTS_TABLE, ', '.join(['%s'] * len(pks))), pks)
+
+def searchCampaigns(campaigns, text, after=None, limit=10):
+    """
+    Return a tuple (results, cursor).  'results' is a list of at most 'limit' Campaign instances
+    from the QuerySet 'campaigns' that match 'text', best matches first.  Matches on the campaign
+    name rank above matches on the office title, and a number in 'text' that equals a campaign's
+    district raises the campaign's rank.  'cursor' is an opaque string to pass as 'after' to get
+    the next page of results, or None if there are no more results.
+    """
+    words = text.split()
+    terms = [word for word in words if len(word) >= MIN_TERM_LENGTH]
+    districts = [int(word) for word in words if word.isdigit()]
+    district = districts[0] if districts else None
+    position = decodeCursor(after)
+
+    if terms and hasSearchIndex():
+        # Use the campaigns QuerySet as a subquery so that callers' filters apply before LIMIT
+        subquery, subquery_params = campaigns.values('pk').query.sql_with_params()
+        if connection.vendor == 'postgresql':
+            rows = _searchPostgresql(terms, text, district, subquery, subquery_params, position, limit + 1)
+        else:
+            rows = _searchSqlite(terms, district, subquery, subquery_params, position, limit + 1)
+    else:
+        # Unindexed fallback.  Every result has the same rank, so order by primary key only.
+        if text:
+            campaigns = campaigns.filter(name__icontains=text)
+        if position is not None:
+            campaigns = campaigns.filter(pk__gt=position[1])
+        rows = [(pk, 0.0) for pk in campaigns.order_by('pk').values_list('pk', flat=True)[:limit + 1]]
+
+    cursor = encodeCursor(rows[limit - 1][1], rows[limit - 1][0]) if len(rows) > limit else None
+    rows = rows[:limit]
+    found = Campaign.objects.select_related('address', 'office', 'party').in_bulk([pk for pk, rank in rows])
+    return [found[pk] for pk, rank in rows if pk in found], cursor
+
+def _keysetClause(position):
+    """Return SQL and parameters restricting ranked rows to those after 'position'."""
+    if position is None:
+        return '', []
+    rank, pk = position
+    return 'WHERE rank > %s OR (rank = %s AND id > %s)', [rank, rank, pk]
+
+def _searchPostgresql(terms, text, district, subquery, subquery_params, position, limit):
+    """
+    Rank with pg_trgm similarity.  Each term must appear in the campaign name or office title;
+    ILIKE patterns with leading wildcards can use the trigram GIN indexes.  Ranks are negated so
+    that, as with SQLite's bm25, smaller is better.
+    """
+    patterns = ['%{0}%'.format(term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')) for term in terms]
+    keyset, keyset_params = _keysetClause(position)
+    sql = (
+        'SELECT id, rank FROM ('
+        'SELECT c.id AS id, CAST(-(2 * similarity(c.name, %s) + COALESCE(similarity(o.title, %s), 0) '
+        '+ CASE WHEN c.district = %s THEN 1 ELSE 0 END) AS double precision) AS rank '
+        'FROM campaign_campaign c LEFT OUTER JOIN campaign_office o ON o.id = c.office_id '
+        'WHERE {0} AND c.id IN ({1})'
+        ') AS ranked {2} ORDER BY rank, id LIMIT %s').format(
+            ' AND '.join(['(c.name ILIKE %s OR o.title ILIKE %s)'] * len(patterns)), subquery, keyset)
+    params = [text, text, district]
+    for pattern in patterns:
+        params.extend([pattern, pattern])
+    params.extend(subquery_params)
+    params.extend(keyset_params)
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+def _searchSqlite(terms, district, subquery, subquery_params, position, limit):
+    """
+    Rank with FTS5's bm25 function, weighting the name column above the office column.  Each
+    term is quoted as a phrase, which the trigram tokenizer matches as a substring of any column.
+    """
+    match = ' '.join('"{0}"'.format(term.replace('"', '""')) for term in terms)
+    keyset, keyset_params = _keysetClause(position)
+    sql = (
+        'SELECT id, rank FROM ('
+        'SELECT c.id AS id, bm25({0}, 10.0, 5.0) - CASE WHEN c.district = %s THEN 10.0 ELSE 0.0 END AS rank '
+        'FROM {0} JOIN campaign_campaign c ON c.id = {0}.rowid '
+        'WHERE {0} MATCH %s AND c.id IN ({1})'
+        ') {2} ORDER BY rank, id LIMIT %s').format(FTS_TABLE, subquery, keyset)
+    params = [district, match] + list(subquery_params) + keyset_params + [limit]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
@@ -0,0 +1,82 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from campaign.models import Campaign, Office
+from campaign.search import removeFromSearchIndex, updateSearchIndex
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from tcsuser.models import TcsUserProfile
+from tcswebapp.apicache import ROSTER_VERSION, bumpVersions
+
+@receiver(post_save, sender=Campaign)
+def indexCampaign(sender, instance, **kwargs):
+    """Keep the campaign search index synchronized with changes to a campaign's name or office."""
+    updateSearchIndex([instance.pk])
+
+@receiver(post_delete, sender=Campaign)
+def unindexCampaign(sender, instance, **kwargs):
+    """Remove a deleted campaign from the campaign search index."""
+    removeFromSearchIndex([instance.pk])
+
+@receiver(post_save, sender=Office)
+def reindexOfficeCampaigns(sender, created, instance, **kwargs):
+    """When an office's title changes, reindex the campaigns seeking that office."""
+    if not created:
+        updateSearchIndex(Campaign.objects.filter(office=instance).values_list('pk', flat=True))
+
+@receiver(post_save, sender=Campaign)
+@receiver(post_delete, sender=Campaign)
+def bumpCampaignsVersion(sender, instance, **kwargs):
+    """Invalidate cached campaign API responses.  See campaign.api.CampaignResource."""
+    bumpVersions('campaigns')
+
+@receiver(m2m_changed, sender=Campaign.workers.through)
+def bumpWorkersVersion(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate cached campaign API responses for users who joined or left a campaign's workers.
+    'instance' is a Campaign, or a TcsUser if the change was made through the reverse relation.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        bumpVersions('campaigns_user_{0}'.format(instance.pk))
+    elif pk_set:
+        bumpVersions(*['campaigns_user_{0}'.format(pk) for pk in pk_set])
+    else:
+        bumpVersions('campaigns')   # post_clear doesn't identify the users
+
+# The reverse accessor of each membership relation, used to find the campaigns a user is cleared from
+MEMBERSHIP_ACCESSORS = {Campaign.workers.through: 'works_for', Campaign.prospects.through: 'prospect_for'}
+
+@receiver(m2m_changed, sender=Campaign.prospects.through)
+@receiver(m2m_changed, sender=Campaign.workers.through)
+def bumpRosterVersions(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidate the cached rosters of campaigns whose workers or prospects changed, and the cached
+    home pages of the users who joined or left.  See campaign.views.campaignManage and tcswebapp.views.home.
+    """
+    if action == 'pre_clear' and reverse:
+        # post_clear doesn't identify the campaigns, so remember them
+        instance._cleared_campaign_ids = set(getattr(instance, MEMBERSHIP_ACCESSORS[sender]).values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        campaign_ids = pk_set if action != 'post_clear' else getattr(instance, '_cleared_campaign_ids', ())
+        bumpVersions('campaigns_user_{0}'.format(instance.pk), *[ROSTER_VERSION.format(pk) for pk in campaign_ids])
+    elif pk_set is None:
+        bumpVersions(ROSTER_VERSION.format(instance.pk), 'campaigns')    # post_clear doesn't identify the users
+    else:
+        bumpVersions(ROSTER_VERSION.format(instance.pk), *['campaigns_user_{0}'.format(pk) for pk in pk_set])
+
+@receiver(post_save, sender=TcsUserProfile)
+def bumpProfileRosterVersions(sender, instance, **kwargs):
+    """Invalidate the cached rosters that show a user's name and address."""
+    campaign_ids = set(Campaign.objects.filter(workers=instance.user_id).values_list('pk', flat=True))
+    campaign_ids.update(Campaign.objects.filter(prospects=instance.user_id).values_list('pk', flat=True))
+    if campaign_ids:
+        bumpVersions(*[ROSTER_VERSION.format(pk) for pk in campaign_ids])
@@ -7,11 +7,20 @@ the author's qualifications.  No other uses are permitted.
 
 from address.models import Address
 from campaign.forms import CampaignForm
-from campaign.models import Campaign, CampaignsToVoters, Office, PoliticalParty
+from address import geohash
+from campaign.models import Campaign, CampaignsToVoters, Office, PoliticalParty, WalkList, indexVoterLocations, orderByDistance
+from campaign import search
+from campaign.search import hasSearchIndex, searchCampaigns
+from campaign.walklist import buildWalkLists, clusterTurfs, orderRoute
 from datetime import date
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from tcsuser.models import TcsUser
-from voter.models import Voter, VoterList
+from tcswebapp.querybudget import QueryBudgetMixin, countQueries
+from voter.models import ContactMethod, Voter, VoterContact, VoterList
+import json
+import math
 
 class CampaignTests(TestCase):
     """Tests for the campaign.models.Campaign."""
@@ -176,6 +185,46 @@ class CampaignTests(TestCase):
         self.assertFalse(voters1.filter(pk=8).exists()) # Two numbers; both reported as incorrect
         self.assertEqual(voters1.count(), 3)
 
+    def testGetVotersDoorToDoor(self):
+        """
+        Test the Campaign model's getVotersDoorToDoor method, which should return voters to contact whose
+        geocoded and indexed addresses are near a point.
+        """
+        latitude, longitude = 38.2527, -85.7585
+        # Voter primary key: kilometers north of the point
+        for pk, kilometers in ((7, 0.5), (8, 0.2), (9, 0.9), (10, 3.0)):
+            address = Address.objects.create(street='{0} Main Str'.format(pk), city='Louisville', state='KY',
+                country='US', postal_code='40202', latitude=latitude + kilometers / geohash.KM_PER_DEGREE,
+                longitude=longitude)
+            Voter.objects.filter(pk=pk).update(address=address)
+        self.assertFalse(self.campaign1.getVotersDoorToDoor(latitude, longitude).exists())    # Not indexed yet
+        self.assertEqual(indexVoterLocations(), 4)
+        self.assertEqual(indexVoterLocations(), 0)
+
+        voters = orderByDistance(self.campaign1.getVotersDoorToDoor(latitude, longitude), latitude, longitude)
+        self.assertEqual([voter.pk for voter in voters], [8, 7, 9])
+        self.assertEqual(self.campaign1.getVotersDoorToDoor(latitude, longitude, radius=5).count(), 4)
+        self.assertFalse(self.campaign2.getVotersDoorToDoor(latitude, longitude, radius=5).exists())
+
+        # Exclude voters whose address has been reported as wrong more than once
+        Voter.objects.filter(pk=8).update(wrong_address=2)
+        self.assertFalse(self.campaign1.getVotersDoorToDoor(latitude, longitude).filter(pk=8).exists())
+
+    def testGeohash(self):
+        """Test geohash encoding and the cells covering a circle."""
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertAlmostEqual(geohash.distance(38.0, -85.0, 38.0 + 1 / geohash.KM_PER_DEGREE, -85.0), 1.0)
+        cells = geohash.cellsWithin(38.2527, -85.7585, 1.0)
+        self.assertIn(geohash.encode(38.2527, -85.7585), cells)
+        # Every point on the circle should be in a covered cell
+        for bearing in range(0, 360, 15):
+            point_latitude = 38.2527 + math.cos(math.radians(bearing)) / geohash.KM_PER_DEGREE
+            point_longitude = -85.7585 + math.sin(math.radians(bearing)) / (geohash.KM_PER_DEGREE *
+                math.cos(math.radians(38.2527)))
+            self.assertIn(geohash.encode(point_latitude, point_longitude), cells)
+        with self.assertRaises(ValueError):
+            geohash.cellsWithin(38.2527, -85.7585, 100.0)
+
 class CampaignFormTests(TestCase):
     """Tests for the campaign.forms.CampaignForm."""
     fixtures = ['offices.json', 'politicalparties.json']
@@ -218,3 +267,278 @@ class CampaignFormTests(TestCase):
         self.assertTrue(CampaignForm(data).is_valid())  # Omitting election_date
         data['office'] = None
         self.assertTrue(CampaignForm(data).is_valid())  # Omitting both
+
+class CampaignSearchTests(TestCase):
+    """Tests for campaign.search.searchCampaigns."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json']
+
+    def setUp(self):
+        """Create 12 active campaigns and 1 inactive campaign, each with a different owner."""
+        super(CampaignSearchTests, self).setUp()
+        address = Address.objects.first()
+        self.potus = Office.objects.get(country='US', level='F', title='President')
+        names = ['Smith for Congress {0}'.format(i) for i in range(10)] + ['Jones for Senate', 'Smithers for Mayor']
+        for i, name in enumerate(names + ['Smith the Inactive']):
+            Campaign.objects.create(
+                owner=TcsUser.objects.create_user('user{0}@tcs.com'.format(i), 'Pa33word44'),
+                address=address,
+                name=name,
+                is_active=(i < len(names)),
+                office=self.potus if name == 'Jones for Senate' else None,
+                district=i,
+            )
+        self.campaigns = Campaign.objects.filter(is_active=True)
+
+    def testMatching(self):
+        """Search terms should match substrings of campaign names and office titles."""
+        results, cursor = searchCampaigns(self.campaigns, 'smith', limit=20)
+        self.assertEqual(len(results), 11)  # The inactive campaign is excluded
+        self.assertIsNone(cursor)
+        self.assertTrue(all('Smith' in campaign.name for campaign in results))
+
+        # 'Jones for Senate' is the only campaign seeking the office of President
+        results, cursor = searchCampaigns(self.campaigns, 'president')
+        self.assertEqual([campaign.name for campaign in results], ['Jones for Senate'])
+
+        # A matching district should be ranked first
+        results, cursor = searchCampaigns(self.campaigns, 'smith 4')
+        self.assertEqual(results[0].name, 'Smith for Congress 4')
+
+        # Renaming a campaign should update the index
+        campaign = Campaign.objects.get(name='Jones for Senate')
+        campaign.name = 'Johnson for Senate'
+        campaign.save()
+        self.assertFalse(searchCampaigns(self.campaigns, 'jones')[0])
+        self.assertTrue(searchCampaigns(self.campaigns, 'johnson')[0])
+
+    def testKeysetPagination(self):
+        """Following cursors should visit every match exactly once."""
+        for text in ('smith', ''):  # Indexed and unindexed searches
+            seen = []
+            results, cursor = searchCampaigns(self.campaigns, text, limit=4)
+            seen.extend(results)
+            while cursor:
+                results, cursor = searchCampaigns(self.campaigns, text, after=cursor, limit=4)
+                seen.extend(results)
+            self.assertEqual(len(seen), self.campaigns.filter(name__icontains=text).count())
+            self.assertEqual(len(set(campaign.pk for campaign in seen)), len(seen))
+
+    def testSearchIndexLookup(self):
+        """Whether the index is used should depend on the table the migration left, not the SQLite version."""
+        self.addCleanup(search._indexed_databases.clear)
+        sqlite_version_info = connection.Database.sqlite_version_info
+        connection.Database.sqlite_version_info = (3, 8, 0)
+        try:
+            self.assertTrue(hasSearchIndex())
+        finally:
+            connection.Database.sqlite_version_info = sqlite_version_info
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(hasSearchIndex())
+        self.assertEqual(len(queries), 0)   # Remembered
+
+        # As if the migration ran on an SQLite library without the trigram tokenizer
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE {0}'.format(search.FTS_TABLE))
+        search._indexed_databases.clear()
+        self.assertFalse(hasSearchIndex())
+        Campaign.objects.filter(name='Jones for Senate').get().save()  # Does not update the missing table
+        results, cursor = searchCampaigns(self.campaigns, 'smith', limit=20)
+        self.assertEqual(len(results), 11)
+
+@override_settings(API_THROTTLE_RATES={'campaign': (100, 1)})
+class CampaignResourceTests(TestCase):
+    """Tests for conditional GET and response caching by campaign.api.CampaignResource."""
+    fixtures = ['addresses.json']
+
+    def setUp(self):
+        """Create an active campaign and log in a user who does not work for it."""
+        super(CampaignResourceTests, self).setUp()
+        self.owner = TcsUser.objects.create_user('test@tcs.com', 'Pa33word44')
+        self.user = TcsUser.objects.create_user('Neazy@tcs.com', 'Pa33word44')
+        TcsUser.objects.update(is_active=True)
+        self.campaign = Campaign.objects.create(owner=self.owner, address=Address.objects.first(),
+            name='Sprout for POTUS', is_active=True)
+        self.client.login(email='Neazy@tcs.com', password='Pa33word44')
+
+    def testConditionalGet(self):
+        """Joining a campaign's workers or renaming a campaign should change the user's ETag."""
+        response = self.client.get('/api/v1/campaign/')
+        self.assertEqual(json.loads(response.content)['objects'], [])
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/v1/campaign/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.campaign.addWorker(self.user)
+        response = self.client.get('/api/v1/campaign/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['objects'], [{'id': self.campaign.pk, 'name': 'Sprout for POTUS'}])
+        etag = response['ETag']
+
+        self.campaign.name = 'Sprout for President'
+        self.campaign.save()
+        response = self.client.get('/api/v1/campaign/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(json.loads(response.content)['objects'][0]['name'], 'Sprout for President')
+
+        self.user.works_for.remove(self.campaign)
+        response = self.client.get('/api/v1/campaign/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(json.loads(response.content)['objects'], [])
+
+    def testKeysetPagination(self):
+        """Following meta.next should return every campaign once, in order, without OFFSET queries."""
+        for i, name in enumerate(['B', 'A', 'C', 'A', 'B', 'A']):
+            owner = TcsUser.objects.create_user('owner{0}@tcs.com'.format(i), 'Pa33word44')
+            Campaign.objects.create(owner=owner, address=self.campaign.address, name=name,
+                is_active=True).addWorker(self.user)
+        campaigns = Campaign.objects.filter(workers=self.user)
+        for url, expected in (('/api/v1/campaign/?limit=2', list(campaigns.order_by('pk'))),
+                ('/api/v1/campaign/?limit=4&order_by=name', list(campaigns.order_by('name', 'pk')))):
+            seen = []
+            with CaptureQueriesContext(connection) as captured:
+                while url:
+                    page = json.loads(self.client.get(url).content)
+                    seen.extend(campaign['id'] for campaign in page['objects'])
+                    url = page['meta']['next']
+            self.assertEqual(seen, [campaign.pk for campaign in expected])
+            self.assertFalse([query for query in captured if 'OFFSET' in query['sql']])
+
+        self.assertEqual(self.client.get('/api/v1/campaign/?after=bogus').status_code, 400)
+        self.assertEqual(self.client.get('/api/v1/campaign/?offset=2').status_code, 400)
+        after = json.loads(self.client.get('/api/v1/campaign/?limit=2').content)['meta']['after']
+        self.assertEqual(self.client.get('/api/v1/campaign/?order_by=name&after=' + after).status_code, 400)
+
+@override_settings(API_THROTTLE_RATES={'walklist': (100, 1)})
+class WalkListTests(TestCase):
+    """Tests for campaign.walklist and campaign.api.WalkListResource."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json', 'voterdialingtesting.json']
+
+    def setUp(self):
+        super(WalkListTests, self).setUp()
+        self.user = TcsUser.objects.create_user('test@tcs.com', 'Pa33word44')
+        self.user.is_active = True
+        self.user.save()
+        self.campaign = Campaign.objects.create(owner=self.user, address=Address.objects.first(),
+            name='Sprout for POTUS', is_active=True)
+        voter_list = VoterList.objects.create(dump_date=date.today(), campaign=self.campaign, file_name='/dev/null')
+        CampaignsToVoters.objects.bulk_create([CampaignsToVoters(campaign=self.campaign, voter=voter,
+            voter_list=voter_list) for voter in Voter.objects.filter(affiliation__title='Democratic')])
+
+        # Voters 7 and 8 share a household.  Households are about 100 meters apart from north to south.
+        for pks, latitude in (([7, 8], 38.2527), ([9], 38.2536), ([10], 38.2545)):
+            Voter.objects.filter(pk__in=pks).update(address=Address.objects.create(street='1 Main Str',
+                city='Louisville', state='KY', country='US', postal_code='40202', latitude=latitude, longitude=-85.7585))
+        indexVoterLocations()
+
+    def testRouting(self):
+        """Turfs should be nearly equal in size, and routes should not double back."""
+        households = [{'latitude': 38.25 + (i * 7 % 50) * 0.001, 'longitude': -85.75, 'voters': []} for i in range(50)]
+        turfs = clusterTurfs(households, turf_size=20)
+        self.assertEqual(sorted(len(turf) for turf in turfs), [16, 17, 17])
+        for turf in turfs:
+            route, distance = orderRoute(turf, time_limit=1)
+            latitudes = [household['latitude'] for household in route]
+            self.assertIn(latitudes, [sorted(latitudes), sorted(latitudes, reverse=True)])
+            self.assertAlmostEqual(distance, (max(latitudes) - min(latitudes)) * geohash.KM_PER_DEGREE, places=3)
+
+    def testWalkLists(self):
+        """Build walk lists, and assign one to each canvasser who asks."""
+        self.assertEqual(buildWalkLists(self.campaign, turf_size=2), 2)
+        walk_lists = WalkList.objects.order_by('latitude')
+        self.assertEqual([(walk_list.num_households, walk_list.num_voters) for walk_list in walk_lists], [(2, 3), (1, 1)])
+        self.assertEqual(buildWalkLists(self.campaign, turf_size=2), 2)  # Rebuilding replaces unassigned walk lists
+        self.assertEqual(WalkList.objects.count(), 2)
+
+        self.client.login(email='test@tcs.com', password='Pa33word44')
+        url = '/api/v1/walklist/?campaign_id={0}&latitude=38.2527&longitude=-85.7585'.format(self.campaign.pk)
+        walk_list = json.loads(self.client.get(url).content)['objects'][0]
+        self.assertEqual(sorted(voter['id'] for household in walk_list['route'] for voter in household['voters']), [7, 8, 9])
+        self.assertEqual(json.loads(self.client.get(url).content)['objects'][0]['id'], walk_list['id'])  # Same again
+        self.assertEqual(CampaignsToVoters.objects.filter(last_served=date.today()).count(), 3)
+
+        # The next canvasser receives the other walk list, and after that there are none
+        worker = TcsUser.objects.create_user('worker@tcs.com', 'Pa33word44')
+        worker.is_active = True
+        worker.save()
+        self.campaign.addWorker(worker)
+        self.client.login(email='worker@tcs.com', password='Pa33word44')
+        self.assertEqual(len(json.loads(self.client.get(url).content)['objects'][0]['route']), 1)
+        WalkList.objects.filter(assigned_to=worker).update(assigned_on=date(2000, 1, 1))
+        self.assertEqual(json.loads(self.client.get(url).content)['objects'], [])
+        self.assertEqual(buildWalkLists(self.campaign), 0)  # Every voter has been served
+        self.assertEqual(self.client.get(url.replace('38.2527', 'north')).status_code, 400)
+        for latitude in ('91', 'nan', 'inf', '75'):    # 75 is valid, but too far north to search
+            self.assertEqual(self.client.get(url.replace('38.2527', latitude)).status_code, 400)
+
+class CampaignQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Query budgets for the views campaignManage and campaignSearch."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json', 'voterdialingtesting.json']
+
+    def setUp(self):
+        """Create a campaign with 2 workers and a prospect, and log in its owner."""
+        super(CampaignQueryBudgetTests, self).setUp()
+        self.address = Address.objects.first()
+        self.method = ContactMethod.objects.create(method='Telephone (voice)')
+        self.owner = self.createUser('test@tcs.com')
+        self.campaign = Campaign.objects.create(owner=self.owner, address=self.address, name='Smith for POTUS',
+            is_active=True, office=Office.objects.get(country='US', level='F', title='President'),
+            party=PoliticalParty.objects.get(country='US', title='Democratic'))
+        self.addVolunteers(2)
+        self.client.login(email='test@tcs.com', password='Pa33word44')
+
+    def addVolunteers(self, number):
+        """Add 'number' workers, each of whom has contacted a voter, and as many prospects."""
+        start = TcsUser.objects.count()
+        for i in range(start, start + number):
+            worker = self.createUser('worker{0}@tcs.com'.format(i))
+            self.campaign.addWorker(worker)
+            contact = VoterContact.objects.create(voter=Voter.objects.first(), user=worker, method=self.method)
+            contact.campaigns.add(self.campaign)
+            self.campaign.addProspect(self.createUser('prospect{0}@tcs.com'.format(i)))
+        return number * 2
+
+    def addCampaigns(self, number):
+        """Add 'number' active campaigns whose names match the search for 'smith'."""
+        start = Campaign.objects.count()
+        for i in range(start, start + number):
+            Campaign.objects.create(owner=self.createUser('owner{0}@tcs.com'.format(i)), address=self.address,
+                name='Smith for Congress {0}'.format(i), is_active=True, office=self.campaign.office,
+                party=self.campaign.party, district=i)
+        return number
+
+    def testCampaignManage(self):
+        url = '/campaign/{0}/manage/'.format(self.campaign.pk)
+        self.client.get(url)
+        # 3 of the queries read the versions and the newest contact keying the cached fragments
+        small, large = self.assertQueryBudget(9, lambda: self.getRendered(url), lambda: self.addVolunteers(20))
+        self.assertEqual(large.status_code, 200)
+        self.assertEqual(len(large.context['volunteer_counts']), 22)
+
+    def testCampaignManageCache(self):
+        """The cached tables should be rendered again when the roster or the contact counts change."""
+        url = '/campaign/{0}/manage/'.format(self.campaign.pk)
+        self.assertContains(self.client.get(url), 'Volunteers (2)')
+        with override_settings(METRICS_ENABLED=False):
+            response, captured = countQueries(lambda: self.client.get(url))
+        self.assertEqual(len(captured), 6)  # The session, the user, the campaign, 2 versions, and the newest contact
+        self.assertContains(response, 'Prospects (2)')
+
+        self.addVolunteers(1)
+        self.assertContains(self.client.get(url), 'Volunteers (3)')
+        worker = self.campaign.workers.order_by('pk').first()
+        worker.profile.name = 'Renamed Worker'
+        worker.profile.save()
+        self.assertContains(self.client.get(url), 'Renamed Worker')
+        contact = VoterContact.objects.create(voter=Voter.objects.first(), user=worker, method=self.method)
+        contact.campaigns.add(self.campaign)
+        self.assertContains(self.client.get(url), '<td>2</td>')
+        # Bulk uploads bump no versions, but they change the newest contact
+        contact = VoterContact.objects.create(voter=Voter.objects.first(), user=worker, method=self.method)
+        VoterContact.campaigns.through.objects.bulk_create([VoterContact.campaigns.through(votercontact=contact,
+            campaign=self.campaign)])
+        self.assertContains(self.client.get(url), '<td>3</td>')
+        self.client.get('/campaign/{0}/blacklist/{1}/'.format(self.campaign.pk, worker.pk))
+        self.assertContains(self.client.get(url), 'Volunteers (2)')
+
+    def testCampaignSearch(self):
+        search = lambda: self.client.post('/campaign/', {'name': 'smith'})
+        small, large = self.assertQueryBudget(6, search, lambda: self.addCampaigns(20))
+        self.assertEqual(len(small.context['campaigns']), 1)
+        self.assertEqual(len(large.context['campaigns']), 10)
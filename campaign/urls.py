@@ -17,4 +17,5 @@ urlpatterns = [
     url(r'^(?P<campaign_id>\d+)/join/$', views.campaignJoin, name='campaign_join'),
     url(r'^(?P<campaign_id>\d+)/leave/$', views.campaignLeave, name='campaign_leave'),
     url(r'^(?P<campaign_id>\d+)/manage/$', views.campaignManage, name='campaign_manage'),
+    url(r'^(?P<campaign_id>\d+)/onboard/$', views.campaignOnboard, name='campaign_onboard'),
 ]
@@ -6,8 +6,9 @@ the author's qualifications.  No other uses are permitted.
 """
 
 from address.forms import AddressForm
-from campaign.forms import CampaignForm, CampaignSearchForm
+from campaign.forms import CampaignForm, CampaignSearchForm, VolunteerImportForm
 from campaign.models import Campaign
+from campaign.search import searchCampaigns
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
@@ -15,7 +16,11 @@ from django.contrib.auth.forms import AuthenticationForm
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import get_object_or_404, render
+from django.utils.functional import SimpleLazyObject
 from tcsuser.models import TcsUser
+from tcsuser.onboarding import MAX_WEB_PASSWORDS, onboardVolunteers, parseVolunteers
+from tcswebapp.apicache import CONTACTS_VERSION, ROSTER_VERSION, getFragmentVersion
+from voter.models import getContactsMark
 
 @login_required
 def campaignAdd(request, campaign_id, user_id):
@@ -119,42 +124,83 @@ def campaignLeave(request, campaign_id):
 
 @login_required
 def campaignManage(request, campaign_id):
-    """Allow the user to manage workers and prospective volunteers."""
+    """
+    Allow the user to manage workers and prospective volunteers.  The template caches the tables
+    until the roster or the contact counts change, so the queries are lazy.
+    """
     campaign = get_object_or_404(Campaign, pk=campaign_id)
     if campaign.owner_id != request.user.pk:
         messages.error(request, "You cannot manage a campaign you do not own.")
         return HttpResponseRedirect(reverse('home'))
-    # Tablulate the number of voters each worker has contacted
-    volunteer_counts = [(volunteer, campaign.voterContactCount(volunteer)) for volunteer in campaign.workers.all()]
-    # Sort volunteers by their count in descending order
-    volunteer_counts.sort(key=lambda x: x[1], reverse=True)
+
+    def getVolunteerCounts():
+        # Tablulate the number of voters each worker has contacted, in one query for every worker
+        counts = campaign.voterContactCounts()
+        volunteer_counts = [(volunteer, counts.get(volunteer.pk, 0))
+            for volunteer in campaign.workers.select_related('profile__address')]
+        # Sort volunteers by their count in descending order
+        volunteer_counts.sort(key=lambda x: x[1], reverse=True)
+        return volunteer_counts
+
     return render(request, 'campaign/manage.html', {
         'campaign': campaign,
-        'volunteer_counts': volunteer_counts})
+        'import_form': VolunteerImportForm(),
+        'max_passwords': MAX_WEB_PASSWORDS,
+        'prospects': SimpleLazyObject(lambda: list(campaign.prospects.select_related('profile__address'))),
+        'volunteer_counts': SimpleLazyObject(getVolunteerCounts),
+        'roster_version': getFragmentVersion(ROSTER_VERSION.format(campaign.pk), CONTACTS_VERSION.format(campaign.pk),
+            marks=[getContactsMark(campaign_id=campaign.pk)])})
+
+@login_required
+def campaignOnboard(request, campaign_id):
+    """Register the volunteers in an uploaded CSV file as workers of the campaign."""
+    campaign = get_object_or_404(Campaign, pk=campaign_id)
+    if campaign.owner_id != request.user.pk:
+        messages.error(request, "You cannot manage a campaign you do not own.")
+        return HttpResponseRedirect(reverse('home'))
+    form = VolunteerImportForm(request.POST or None, request.FILES or None)
+    if form.is_valid():
+        # Passwords are hashed within the request, so only a few may be set.  See tcsuser.onboarding.
+        volunteers, errors = parseVolunteers(form.cleaned_data['csv_file'], str(campaign.address.country),
+            max_passwords=MAX_WEB_PASSWORDS)
+        count = onboardVolunteers(campaign, volunteers, processes=1, errors=errors)
+        if count:
+            messages.success(request, "You added {0} volunteers.  Each was e-mailed an activation link, or an "
+                "invitation to choose a password if the file gave none.".format(count))
+        for error in errors[:20]:
+            messages.error(request, error)
+        if len(errors) > 20:
+            messages.error(request, "{0} more rows were rejected.".format(len(errors) - 20))
+    else:
+        messages.error(request, "Choose a CSV file to upload.")
+    return HttpResponseRedirect(reverse('campaign_manage', args=(campaign.pk,)))
 
 @login_required
 def campaignSearch(request):
     """
     Find active campaigns based on a search query.  If the user supplies a value for 'id',
-    ignore all other inputs.  Return at most 10 results.
+    ignore all other inputs.  Return at most 10 results per page, best matches first.  The
+    POST parameter 'after' is the cursor for the next page of results.
     """
+    campaigns = []
+    next_cursor = None
     if request.method == 'POST':
         form = CampaignSearchForm(request.POST)
         if form.is_valid():
-            campaigns = Campaign.objects.filter(is_active=True)
+            results = Campaign.objects.filter(is_active=True)
             if form.cleaned_data['id']: # Must be None or a positive integer value
-                campaigns = campaigns.filter(pk=form.cleaned_data['id']) # QuerySet; don't want a Campaign instance
+                results = results.filter(pk=form.cleaned_data['id']) # QuerySet; don't want a Campaign instance
+                campaigns = list(results.select_related('address', 'office', 'party'))
             else:
-                # Construct a query from the remaining non-blank form fields
-                if form.cleaned_data['party'] != '':
-                    campaigns = campaigns.filter(party=form.cleaned_data['party'])
-                if form.cleaned_data['name'] != '':
-                    campaigns = campaigns.filter(name__icontains=form.cleaned_data['name'])
+                # Construct a query from the remaining non-blank form fields, and rank matches on the name
+                if form.cleaned_data['party'] is not None:
+                    results = results.filter(party=form.cleaned_data['party'])
                 if form.cleaned_data['office'] is not None:
-                    campaigns = campaigns.filter(office=form.cleaned_data['office'])
+                    results = results.filter(office=form.cleaned_data['office'])
                 if form.cleaned_data['district'] is not None:
-                    campaigns = campaigns.filter(district=form.cleaned_data['district'])
+                    results = results.filter(district=form.cleaned_data['district'])
+                campaigns, next_cursor = searchCampaigns(results, form.cleaned_data['name'],
+                    after=request.POST.get('after'))
     else:
         form = CampaignSearchForm()
-        campaigns = []
-    return render(request, 'campaign/search.html', {'form': form, 'campaigns': campaigns[:10]})
+    return render(request, 'campaign/search.html', {'form': form, 'campaigns': campaigns, 'next_cursor': next_cursor})
@@ -0,0 +1,162 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Walk lists for door-to-door canvassing.  A campaign's geocoded constituents are grouped into
+households (voters sharing an Address), households are divided into turfs of about the number a
+canvasser can visit in one shift, and each turf is ordered into a walking route.
+
+Turfs are made by recursive bisection: split the households at the median of the turf's longer side
+until each part is small enough.  This is fast and makes compact turfs of nearly equal size.  Routes
+are ordered by the nearest neighbour heuristic and improved by 2-opt moves until no move shortens the
+route or a time limit passes.  Walk lists are built in batch, one region of geohash cells at a time,
+so memory use does not grow with the size of the campaign.
+"""
+
+from address import geohash
+from campaign.models import CampaignsToVoters, WalkList
+from datetime import date, datetime
+from django.db import transaction
+from timeit import default_timer
+import json
+import math
+
+TURF_SIZE = 40              # Households a canvasser can visit in a three hour shift
+ROUTE_TIME_LIMIT = 0.1      # Seconds of 2-opt improvement per turf
+REGION_PRECISION = 5        # Walk lists are built separately for each geohash cell of this precision
+SEARCH_RADIUS = 5.0         # Kilometers from a canvasser to the first stop of an assigned walk list
+
+def getHouseholds(voters):
+    """
+    Return a list of households for a QuerySet of voters.  Each household is a dictionary with the
+    keys 'address_id', 'street', 'latitude', 'longitude', and 'voters', a list of dictionaries with
+    the keys 'id', 'first_name', 'last_name', and 'gender'.
+    """
+    households = []
+    rows = voters.order_by('address_id', 'pk').values_list('address_id', 'address__street', 'address__latitude',
+        'address__longitude', 'id', 'first_name', 'last_name', 'gender')
+    for address_id, street, latitude, longitude, pk, first_name, last_name, gender in rows:
+        if not households or households[-1]['address_id'] != address_id:
+            households.append({'address_id': address_id, 'street': street, 'latitude': latitude,
+                'longitude': longitude, 'voters': []})
+        households[-1]['voters'].append({'id': pk, 'first_name': first_name, 'last_name': last_name, 'gender': gender})
+    return households
+
+def clusterTurfs(households, turf_size=TURF_SIZE):
+    """Divide a list of households into a list of turfs, each a list of at most 'turf_size' households."""
+    if not households:
+        return []
+    return _bisect(households, int(math.ceil(len(households) / float(turf_size))))
+
+def _bisect(households, num_turfs):
+    if num_turfs <= 1:
+        return [households]
+    latitudes = [household['latitude'] for household in households]
+    longitudes = [household['longitude'] for household in households]
+    height = max(latitudes) - min(latitudes)
+    width = (max(longitudes) - min(longitudes)) * math.cos(math.radians(latitudes[0]))
+    households = sorted(households, key=lambda household: household['longitude' if width > height else 'latitude'])
+    # Give each side a share of the households proportional to its share of the turfs
+    left_turfs = num_turfs // 2
+    split = int(round(len(households) * left_turfs / float(num_turfs)))
+    return _bisect(households[:split], left_turfs) + _bisect(households[split:], num_turfs - left_turfs)
+
+def orderRoute(households, time_limit=ROUTE_TIME_LIMIT):
+    """
+    Return the tuple (households in walking order, kilometers walked).  The route starts at the
+    household farthest from the turf's center, so that it sweeps across the turf instead of
+    starting in the middle, and it ends wherever is shortest.
+    """
+    n = len(households)
+    if n < 2:
+        return list(households), 0.0
+    distances = [[geohash.distance(a['latitude'], a['longitude'], b['latitude'], b['longitude']) for b in households]
+        for a in households]
+
+    # Nearest neighbour
+    center_latitude = sum(household['latitude'] for household in households) / n
+    center_longitude = sum(household['longitude'] for household in households) / n
+    start = max(range(n), key=lambda i: geohash.distance(center_latitude, center_longitude,
+        households[i]['latitude'], households[i]['longitude']))
+    route = [start]
+    unvisited = set(range(n)) - set([start])
+    while unvisited:
+        last = distances[route[-1]]
+        route.append(min(unvisited, key=lambda i: last[i]))
+        unvisited.remove(route[-1])
+
+    # 2-opt: reversing route[i:j + 1] replaces the edges (i - 1, i) and (j, j + 1) with (i - 1, j) and
+    # (i, j + 1).  The route is a path, not a cycle, so an edge past either end costs nothing.
+    deadline = default_timer() + time_limit
+    improved = True
+    while improved and default_timer() < deadline:
+        improved = False
+        for i in range(n - 1):
+            before = route[i - 1] if i > 0 else None
+            for j in range(i + 1, n):
+                after = route[j + 1] if j + 1 < n else None
+                change = 0.0
+                if before is not None:
+                    change += distances[before][route[j]] - distances[before][route[i]]
+                if after is not None:
+                    change += distances[route[i]][after] - distances[route[j]][after]
+                if change < -1e-9:
+                    route[i:j + 1] = route[i:j + 1][::-1]
+                    improved = True
+            if default_timer() >= deadline:
+                break
+
+    length = sum(distances[route[k]][route[k + 1]] for k in range(n - 1))
+    return [households[i] for i in route], length
+
+def buildWalkLists(campaign, turf_size=TURF_SIZE, time_limit=ROUTE_TIME_LIMIT):
+    """
+    Replace the campaign's unassigned walk lists with new ones covering every voter returned by
+    Campaign.getVotersToCanvass.  Return the number of walk lists created.
+    """
+    cells = CampaignsToVoters.objects.filter(campaign=campaign).exclude(geohash='').values_list('geohash',
+        flat=True).distinct()
+    regions = {}
+    for cell in cells:
+        regions.setdefault(cell[:REGION_PRECISION], []).append(cell)
+
+    count = 0
+    with transaction.atomic():
+        WalkList.objects.filter(campaign=campaign, assigned_to=None).delete()
+        for prefix in sorted(regions):
+            households = getHouseholds(campaign.getVotersToCanvass(campaignstovoters__geohash__in=regions[prefix]))
+            walk_lists = []
+            for turf in clusterTurfs(households, turf_size):
+                route, distance = orderRoute(turf, time_limit)
+                walk_lists.append(WalkList(campaign=campaign, latitude=route[0]['latitude'],
+                    longitude=route[0]['longitude'], geohash=geohash.encode(route[0]['latitude'], route[0]['longitude']),
+                    num_households=len(route), num_voters=sum(len(household['voters']) for household in route),
+                    distance=distance, route=json.dumps(route)))
+            WalkList.objects.bulk_create(walk_lists)
+            count += len(walk_lists)
+    return count
+
+def assignWalkList(campaign, user, latitude, longitude):
+    """
+    Return the campaign's walk list for the user, or None if there is none nearby.  A walk list
+    assigned to the user today is returned again.  Otherwise, assign the nearest unassigned walk
+    list whose first stop is within SEARCH_RADIUS kilometers, and record that its voters were served.
+    """
+    walk_list = WalkList.objects.filter(campaign=campaign, assigned_to=user, assigned_on__gte=date.today()).first()
+    if walk_list:
+        return walk_list
+    candidates = WalkList.objects.filter(campaign=campaign, assigned_to=None,
+        geohash__in=geohash.cellsWithin(latitude, longitude, SEARCH_RADIUS)).defer('route')
+    for walk_list in sorted(candidates, key=lambda walk_list: geohash.distance(latitude, longitude,
+            walk_list.latitude, walk_list.longitude)):
+        # Another canvasser may have been assigned the walk list since it was read
+        if WalkList.objects.filter(pk=walk_list.pk, assigned_to=None).update(assigned_to=user,
+                assigned_on=datetime.now()):
+            walk_list = WalkList.objects.get(pk=walk_list.pk)
+            voter_ids = [voter['id'] for household in json.loads(walk_list.route) for voter in household['voters']]
+            CampaignsToVoters.objects.filter(campaign=campaign, voter__in=voter_ids).update(last_served=date.today())
+            return walk_list
+    return None
@@ -0,0 +1,225 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+A load-test harness that simulates volunteers running TCS Campaigner.  Each simulated volunteer is a
+thread that logs in through the login page, as the browser does, and then repeats the loop of
+campaigner-dial.js and campaigner-ir.js:
+
+    1. PATCH the intelligence reports (IRs) made since the last batch to /api/v1/votercontact/, as
+       campaigner-outbox.js does
+    2. PATCH the flagged phone numbers to /api/v1/voter/
+    3. GET a batch of voters from /api/v1/voter/?campaign_id=...
+    4. Dial each voter, waiting a random think time, and make an IR or flag a phone number
+
+The harness uses only the standard library and talks to a server on this machine, for example
+"python manage.py runserver --settings=tcswebapp.settings_loadtest", which lifts the API throttles.
+It reports throughput, latency percentiles and error rates by request kind, and the fraction of
+served voters that had already been served to some volunteer during the run.
+"""
+
+from threading import Lock, Thread
+from timeit import default_timer
+import cookielib
+import json
+import random
+import time
+import urllib
+import urllib2
+import uuid
+
+REQUEST_KINDS = ('login', 'voter_get', 'ir_patch', 'flag_patch')
+
+def percentile(sorted_values, fraction):
+    """Return the value at 'fraction' of a sorted list by the nearest-rank method, or None if it is empty."""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))]
+
+class Recorder(object):
+    """Thread-safe totals of requests and served voters."""
+    def __init__(self):
+        self.lock = Lock()
+        self.latencies = dict((kind, []) for kind in REQUEST_KINDS)
+        self.statuses = dict((kind, {}) for kind in REQUEST_KINDS)
+        self.served = 0
+        self.served_ids = set()
+        self.duplicates = 0
+        self.irs = 0
+        self.flags = 0
+
+    def recordRequest(self, kind, seconds, status):
+        """'status' is the HTTP status code, or the name of the exception if there was no response."""
+        with self.lock:
+            self.latencies[kind].append(seconds)
+            self.statuses[kind][status] = self.statuses[kind].get(status, 0) + 1
+
+    def recordServed(self, voter_ids):
+        with self.lock:
+            self.served += len(voter_ids)
+            for voter_id in voter_ids:
+                if voter_id in self.served_ids:
+                    self.duplicates += 1
+                else:
+                    self.served_ids.add(voter_id)
+
+    def recordContacts(self, irs, flags):
+        with self.lock:
+            self.irs += irs
+            self.flags += flags
+
+    def getReport(self, seconds, volunteers):
+        """Return a dictionary summarizing the run.  Latencies are in milliseconds."""
+        requests = {}
+        for kind in REQUEST_KINDS:
+            latencies = sorted(latency * 1000 for latency in self.latencies[kind])
+            count = len(latencies)
+            errors = sum(number for status, number in self.statuses[kind].items()
+                if not (isinstance(status, int) and status < 400))
+            requests[kind] = {
+                'count': count,
+                'per_second': round(count / seconds, 2),
+                'error_rate': round(errors / float(count), 4) if count else 0.0,
+                'statuses': dict((str(status), number) for status, number in self.statuses[kind].items()),
+                'p50_ms': percentile(latencies, 0.50),
+                'p90_ms': percentile(latencies, 0.90),
+                'p95_ms': percentile(latencies, 0.95),
+                'p99_ms': percentile(latencies, 0.99),
+                'max_ms': latencies[-1] if latencies else None,
+            }
+            for name in ('p50_ms', 'p90_ms', 'p95_ms', 'p99_ms', 'max_ms'):
+                if requests[kind][name] is not None:
+                    requests[kind][name] = round(requests[kind][name], 1)
+        total = sum(requests[kind]['count'] for kind in REQUEST_KINDS)
+        return {
+            'volunteers': volunteers,
+            'seconds': round(seconds, 1),
+            'requests_per_second': round(total / seconds, 2),
+            'requests': requests,
+            'voters_served': self.served,
+            'duplicate_voters_served': self.duplicates,
+            'duplicate_rate': round(self.duplicates / float(self.served), 4) if self.served else 0.0,
+            'irs': self.irs,
+            'flags': self.flags,
+        }
+
+class Volunteer(Thread):
+    """A simulated volunteer.  Call start(), and the thread stops after 'deadline' (a default_timer value)."""
+    def __init__(self, base_url, email, password, campaign_ids, recorder, deadline, think_time=2.0, ir_rate=0.7,
+            flag_rate=0.1, seed=None):
+        super(Volunteer, self).__init__()
+        self.daemon = True
+        self.base_url = base_url.rstrip('/')
+        self.email = email
+        self.password = password
+        self.campaign_ids = campaign_ids
+        self.recorder = recorder
+        self.deadline = deadline
+        self.think_time = think_time
+        self.ir_rate = ir_rate
+        self.flag_rate = flag_rate
+        self.random = random.Random(seed)
+        self.cookies = cookielib.CookieJar()
+        self.opener = urllib2.build_opener(urllib2.HTTPCookieProcessor(self.cookies))
+        self.irs = []
+        self.flags = []
+
+    def getCookie(self, name):
+        for cookie in self.cookies:
+            if cookie.name == name:
+                return cookie.value
+        return None
+
+    def request(self, kind, method, path, data=None, headers=None):
+        """Make a request and record it.  Return (status, body), with status None if there was no response."""
+        request = urllib2.Request(self.base_url + path, data, headers or {})
+        request.get_method = lambda: method
+        start = default_timer()
+        try:
+            response = self.opener.open(request, timeout=60)
+            status, body = response.getcode(), response.read()
+        except urllib2.HTTPError as e:
+            status, body = e.code, e.read()
+        except Exception as e:  # Connection refused or reset, timeout, etc.
+            self.recorder.recordRequest(kind, default_timer() - start, e.__class__.__name__)
+            return None, None
+        self.recorder.recordRequest(kind, default_timer() - start, status)
+        return status, body
+
+    def login(self):
+        """Log in through the login page, which sets the session and CSRF cookies.  Return True on success."""
+        self.opener.open(self.base_url + '/', timeout=60).read()    # Sets the CSRF cookie
+        status, body = self.request('login', 'POST', '/', urllib.urlencode({'username': self.email,
+            'password': self.password, 'csrfmiddlewaretoken': self.getCookie('csrftoken') or ''}),
+            {'Referer': self.base_url + '/'})
+        return status == 200 and self.getCookie('sessionid') is not None
+
+    def patch(self, kind, path, objects):
+        """PATCH a list of objects as Campaigner does.  Keep them for the next batch unless they were accepted."""
+        status, body = self.request(kind, 'PATCH', path, json.dumps({'objects': objects}), {
+            'Content-Type': 'application/json', 'X-CSRFToken': self.getCookie('csrftoken') or '',
+            'Referer': self.base_url + '/'})
+        return status == 202
+
+    def think(self):
+        """Wait like a volunteer dialing a voter.  Return False if the run is over."""
+        if self.think_time:
+            time.sleep(min(self.random.expovariate(1.0 / self.think_time), max(0, self.deadline - default_timer())))
+        return default_timer() < self.deadline
+
+    def run(self):
+        if not self.login():
+            return
+        while default_timer() < self.deadline:
+            if self.irs and self.patch('ir_patch', '/api/v1/votercontact/', self.irs):
+                self.irs = []
+            if self.flags and self.patch('flag_patch', '/api/v1/voter/', self.flags):
+                self.flags = []
+            status, body = self.request('voter_get', 'GET', '/api/v1/voter/?campaign_id=' +
+                ','.join(str(pk) for pk in self.campaign_ids), headers={'Accept': 'application/json'})
+            if status != 200:
+                if not self.think():    # Wait before retrying, as a volunteer would
+                    return
+                continue
+            voters = json.loads(body)['objects']
+            self.recorder.recordServed([voter['id'] for voter in voters])
+            if not voters:
+                self.think()
+            irs = flags = 0
+            for voter in voters:
+                if not self.think():
+                    break
+                chance = self.random.random()
+                if chance < self.flag_rate and voter['phone_number1']:
+                    self.flags.append({'resource_uri': voter['resource_uri'], 'phone_number1': 'flagged',
+                        'client_key': uuid.UUID(int=self.random.getrandbits(128)).hex})
+                    flags += 1
+                elif chance < self.flag_rate + self.ir_rate:
+                    self.irs.append({'method': 1, 'voter': voter['id'], 'client_key': uuid.UUID(int=self.random.getrandbits(128)).hex,
+                        'intelligence_report': {'support': [1], 'oppose': [], 'text': 'Load test'}})
+                    irs += 1
+            self.recorder.recordContacts(irs, flags)
+
+def runLoadTest(base_url, volunteers, duration=60, think_time=2.0, ramp_up=0, ir_rate=0.7, flag_rate=0.1, seed=0):
+    """
+    Simulate volunteers for 'duration' seconds and return the report of Recorder.getReport.
+    'volunteers' is a list of tuples (email, password, campaign_ids).  Volunteers start evenly over
+    'ramp_up' seconds; think times are exponentially distributed with mean 'think_time' seconds.
+    """
+    recorder = Recorder()
+    start = default_timer()
+    deadline = start + ramp_up + duration
+    threads = []
+    for i, (email, password, campaign_ids) in enumerate(volunteers):
+        if ramp_up and i:
+            time.sleep(float(ramp_up) / len(volunteers))
+        thread = Volunteer(base_url, email, password, campaign_ids, recorder, deadline, think_time, ir_rate, flag_rate,
+            seed + i)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(max(0, deadline - default_timer()) + 60)
+    return recorder.getReport(default_timer() - start, len(volunteers))
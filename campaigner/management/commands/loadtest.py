@@ -0,0 +1,92 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from campaign.models import Campaign
+from campaigner.loadtest import REQUEST_KINDS, runLoadTest
+from django.core.management.base import BaseCommand, CommandError
+from tcswebapp.synthetic import SYNTHETIC_DOMAIN, SYNTHETIC_PASSWORD
+import json
+import random
+
+class Command(BaseCommand):
+    help = ('Simulate volunteers running the Campaigner dial, IR, and PATCH loop against a running server, and '
+        'report throughput, latency, duplicate voters served, and errors.  Volunteers log in as synthetic '
+        'workers; run generatedata first.  Start the server with --settings=tcswebapp.settings_loadtest so '
+        'that the API throttles do not reject the simulated volunteers.  See campaigner.loadtest.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server (default http://127.0.0.1:8000)')
+        parser.add_argument('--volunteers', type=int, default=50, help='Concurrent volunteers (default 50)')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds after ramp-up (default 60)')
+        parser.add_argument('--ramp-up', type=float, default=0, help='Seconds over which volunteers start')
+        parser.add_argument('--think-time', type=float, default=2.0,
+            help='Mean seconds a volunteer spends on each voter (default 2)')
+        parser.add_argument('--ir-rate', type=float, default=0.7, help='Fraction of voters with an IR (default 0.7)')
+        parser.add_argument('--flag-rate', type=float, default=0.1,
+            help='Fraction of voters whose phone number is flagged (default 0.1)')
+        parser.add_argument('--campaign', action='append', default=[], metavar='ID[:WEIGHT]',
+            help='A campaign and its share of volunteers; may be repeated (default: every synthetic campaign equally)')
+        parser.add_argument('--output', help='Write the report as JSON to this file')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def getMix(self, specs):
+        """Return a list of (campaign, weight) from --campaign options."""
+        campaigns = Campaign.objects.filter(is_active=True, owner__email__endswith='@' + SYNTHETIC_DOMAIN)
+        if not specs:
+            return [(campaign, 1.0) for campaign in campaigns.order_by('pk')]
+        mix = []
+        for spec in specs:
+            try:
+                pk, weight = (spec.split(':') + ['1'])[:2]
+                mix.append((campaigns.get(pk=int(pk)), float(weight)))
+            except (ValueError, Campaign.DoesNotExist):
+                raise CommandError('Invalid campaign: {0}'.format(spec))
+        return mix
+
+    def getVolunteers(self, mix, count, seed):
+        """Assign each simulated volunteer a campaign by weight and a distinct worker of that campaign."""
+        rng = random.Random(seed)
+        workers = dict((campaign.pk, list(campaign.workers.order_by('pk').values_list('email', flat=True)))
+            for campaign, weight in mix)
+        used = dict((campaign.pk, 0) for campaign, weight in mix)
+        total = sum(weight for campaign, weight in mix)
+        volunteers = []
+        for i in range(count):
+            choice = rng.uniform(0, total)
+            for campaign, weight in mix:
+                choice -= weight
+                if choice <= 0:
+                    break
+            if used[campaign.pk] >= len(workers[campaign.pk]):
+                raise CommandError('Campaign {0} has only {1} workers.  Run generatedata with more --workers.'.format(
+                    campaign.pk, len(workers[campaign.pk])))
+            volunteers.append((workers[campaign.pk][used[campaign.pk]], SYNTHETIC_PASSWORD, [campaign.pk]))
+            used[campaign.pk] += 1
+        return volunteers
+
+    def handle(self, *args, **options):
+        mix = self.getMix(options['campaign'])
+        if not mix:
+            raise CommandError('There is no synthetic campaign.  Run "python manage.py generatedata" first.')
+        volunteers = self.getVolunteers(mix, options['volunteers'], options['seed'])
+        self.stdout.write('Simulating {0} volunteers for {1} seconds.'.format(len(volunteers),
+            options['ramp_up'] + options['duration']))
+        report = runLoadTest(options['url'], volunteers, options['duration'], options['think_time'],
+            options['ramp_up'], options['ir_rate'], options['flag_rate'], options['seed'])
+
+        self.stdout.write('{0:<12}{1:>8}{2:>8}{3:>9}{4:>9}{5:>9}{6:>9}{7:>9}'.format('Request', 'Count', 'Per s',
+            'Errors', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms'))
+        for kind in REQUEST_KINDS:
+            totals = report['requests'][kind]
+            self.stdout.write('{0:<12}{1[count]:>8}{1[per_second]:>8.1f}{2:>8.1%} {1[p50_ms]:>8} {1[p95_ms]:>8} '
+                '{1[p99_ms]:>8} {1[max_ms]:>8}'.format(kind, totals, totals['error_rate']))
+        self.stdout.write('{requests_per_second} requests per second.  {voters_served} voters served, '
+            '{duplicate_voters_served} of them already served ({duplicate_rate:.1%}).  {irs} IRs and {flags} '
+            'flags.'.format(**report))
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
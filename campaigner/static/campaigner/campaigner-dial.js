@@ -7,6 +7,11 @@ the author's qualifications.  No other uses are permitted.
 This code assumes that HTML5 web storage is available.
 ***/
 
+var LOW_WATER_MARK = 5;         // Request the next batch of voters when this many remain
+var MAX_EXCLUDED_IDS = 100;     // The server's limit on the "exclude_ids" GET parameter
+var VOTERS_MIN_RETRY = 2000;    // Milliseconds before the first retry of a failed request for voters
+var VOTERS_MAX_RETRY = 300000;  // Longest wait between retries (5 minutes)
+
 function getCampaignIDs() {
     /***
     Return an array of IDs of campaigns for which the user wants to contact voters.  The
@@ -29,7 +34,7 @@ function getCampaignIDs() {
     return IDs;
 }
 
-function Voters(voter_api_url, ir_api_url, remaining_element, name_element, location_element, phone_number_element, campaign_ids) {
+function Voters(voter_api_url, outbox, remaining_element, name_element, location_element, phone_number_element, campaign_ids) {
     /*** Object Prototype
     Manage a list of voters the user has contacted or will contact.
     ***/
@@ -69,6 +74,10 @@ function Voters(voter_api_url, ir_api_url, remaining_element, name_element, loca
             console.log('No valid phone number for voter at index ' + this.current_index + '.');
             document.getElementById(this.phone_number_element).innerHTML = "No valid phone number";
         }
+
+        if (this.voters.length <= LOW_WATER_MARK) {
+            this.prefetch();
+        }
     };
 
     this.drop = function() {
@@ -78,11 +87,15 @@ function Voters(voter_api_url, ir_api_url, remaining_element, name_element, loca
         the array, delete it, and get more voters.
         ***/
         if (this.voters.length == 1) {
-            // Delete the last voter, and try to get more
+            // Delete the last voter, and switch to the prefetched batch or try to get more
             this.voters = undefined;
             localStorage.removeItem('voters');
-            this.restoreDefaults();
-            this.getVoters();
+            if (!this.useNextVoters()) {
+                this.restoreDefaults();
+                if (!this.prefetching) {    // Otherwise the batch in flight is displayed when it arrives
+                    this.getVoters();
+                }
+            }
             return;
         }
         if (this.current_index == (this.voters.length - 1)) {
@@ -105,13 +118,13 @@ function Voters(voter_api_url, ir_api_url, remaining_element, name_element, loca
         var voter = this.voters[this.current_index]; // The voter at the current index
         if (voter.active_number == 1) {
             voter.number1_flagged = true;
-            this.flags.push({
+            this.outbox.add('flag', voter.id, {
                 "resource_uri": voter.resource_uri,
                 "phone_number1": "flagged",
             });
         } else if (voter.active_number == 2) {
             voter.number2_flagged = true;
-            this.flags.push({
+            this.outbox.add('flag', voter.id, {
                 "resource_uri": voter.resource_uri,
                 "phone_number2": "flagged",
             });
@@ -135,14 +148,6 @@ function Voters(voter_api_url, ir_api_url, remaining_element, name_element, loca
         return null;
     };
 
-    this.getFlags = function() {
-        /*** Load or create the 'flags' list, and return it. ***/
-        if (localStorage.flags) {
-            return JSON.parse(localStorage.flags);
-        }
-        return [];
-    };
-
     this.getPhoneNumber = function() {
         /***
         For the voter at the current index, return a phone number not flagged, or return Null.
@@ -163,11 +168,29 @@ function Voters(voter_api_url, ir_api_url, remaining_element, name_element, loca
         return phone_number;
     };
 
+    this.getHeldIds = function(queued_ids) {
+        /***
+        Return an array of the IDs of voters the server should not serve again yet: the voters in this
+        batch and the prefetched batch, and 'queued_ids', the voters with IRs or flags in the outbox.
+        ***/
+        var ids = [];
+        var batches = [this.voters || []];
+        if (localStorage.next_voters) {
+            batches.push(JSON.parse(localStorage.next_voters));
+        }
+        for (var batch = 0; batch < batches.length; batch++) {
+            for (var index = 0; index < batches[batch].length; index++) {
+                ids.push(batches[batch][index].id);
+            }
+        }
+        return ids.concat(queued_ids).slice(-MAX_EXCLUDED_IDS);
+    };
+
     this.getVoters = function() {
         /***
         Assign an array of voter objects to the 'voters' attribute.  Make API calls as
-        necessary.  API calls can include GET, to retrieve new voter data, and POST to
-        submit intelligence reports (IRs).
+        necessary.  API calls can include GET, to retrieve new voter data, and the uploads
+        of the outbox.
         ***/
         this.current_index = 0;
 
@@ -179,44 +202,110 @@ function Voters(voter_api_url, ir_api_url, remaining_element, name_element, loca
             return;
         }
 
-        if (localStorage.irs) {
-            // Upload IR data before getting new voter contact information
-            this.patchIRs();
+        // Next, look for a batch prefetched before the last batch ran out
+        if (this.useNextVoters()) {
+            return;
         }
 
-        // Upload data about flagged phone numbers before getting new voter contact information
-        this.patchFlags();
-
         // Can't make a valid API call without campaign IDs
         if (!this.campaign_ids || !this.campaign_ids.length) {
             return;
         }
-        
+
         // Didn't find unexpired, uncontacted, contactable voters in local storage.  Make API calls
         // as necessary.
-        var request = new XMLHttpRequest();
-        // http://stackoverflow.com/questions/133973/how-does-this-keyword-work-within-a-javascript-object-literal
         var that = this;
+        this.requestVoters(function(voters) {
+            that.voters = voters;
+            localStorage.last_voters_download = new Date();  // Saves the current date-time as a string
+            that.save();    // TODO - delete when "onunload" is reliable
+            that.display();
+        }, function(succeeded) {
+            if (!succeeded) {
+                that.retryGetVoters();
+            }
+        });
+    };
+
+    this.prefetch = function() {
+        /***
+        Request the next batch of voters while the user works through the last few of this batch, and
+        keep it in local storage until this batch runs out.  The server excludes the voters this client
+        still holds.  Make at most one request at a time, and none if a batch is already waiting or the
+        server had no more voters during this visit to the page.
+        ***/
+        if (this.prefetching || this.no_more_voters || !this.campaign_ids || !this.campaign_ids.length) {
+            return;
+        }
+        if (localStorage.next_voters && localStorage.next_voters_campaigns == String(this.campaign_ids)) {
+            return;
+        }
+        this.prefetching = true;
+        var that = this;
+        this.requestVoters(function(voters) {
+            if (voters.length) {
+                localStorage.next_voters = JSON.stringify(voters);
+                localStorage.next_voters_campaigns = String(that.campaign_ids);
+                localStorage.next_voters_download = new Date();
+                if (!that.voters) {
+                    // This batch ran out before the response arrived
+                    that.useNextVoters();
+                }
+            } else {
+                that.no_more_voters = true;
+            }
+        }, function(succeeded) {
+            that.prefetching = false;
+            if (!succeeded && !that.voters) {
+                // This batch ran out, and nothing else will request the next one
+                that.retryGetVoters();
+            }
+        });
+    };
+
+    this.requestVoters = function(success, complete) {
+        /***
+        Upload the outbox, then GET a batch of voters, excluding the voters this client holds.  Call
+        'success' with the array of voters if the request succeeds, and then call 'complete', if given,
+        in any case, with true if the request succeeded.
+        ***/
+        var that = this;
+        this.outbox.flush().then(function() {
+            return that.outbox.getVoterIds();
+        }).then(function(queued_ids) {
+            that.getVoterBatch(that.getHeldIds(queued_ids), success, complete);
+        });
+    };
+
+    this.getVoterBatch = function(held_ids, success, complete) {
+        /*** GET a batch of voters, excluding 'held_ids'.  See requestVoters. ***/
+        var that = this;
+        var request = new XMLHttpRequest();
         request.onreadystatechange = function() {
             if (request.readyState == 4) {
                 console.log('Response received for voters request.  Status code: ' + request.status);
                 if (request.status == 200) {
                     // The 'objects' attribute of the server's JSON response is an array of voter
-                    that.voters = JSON.parse(request.responseText).objects;
+                    var voters = JSON.parse(request.responseText).objects;
 
                     // Add additional attributes to the server's response.
-                    for (var index = 0; index < that.voters.length; index++) {
-                        that.voters[index].number1_flagged = false;
-                        that.voters[index].number2_flagged = false;
+                    for (var index = 0; index < voters.length; index++) {
+                        voters[index].number1_flagged = false;
+                        voters[index].number2_flagged = false;
                     }
-
-                    localStorage.last_voters_download = new Date();  // Saves the current date-time as a string
-                    that.save();    // TODO - delete when "onunload" is reliable
-                    that.display();
+                    that.failures = 0;
+                    success(voters);
+                }
+                if (complete) {
+                    complete(request.status == 200);
                 }
             }
         };
-        request.open('GET', this.voter_api_url + '?campaign_id=' + this.campaign_ids, true);
+        var url = this.voter_api_url + '?campaign_id=' + this.campaign_ids;
+        if (held_ids.length) {
+            url += '&exclude_ids=' + held_ids;
+        }
+        request.open('GET', url, true);
         request.setRequestHeader('Accept', 'application/json');
         console.log('Requesting voters from the server.');
         request.send();
@@ -254,53 +343,6 @@ function Voters(voter_api_url, ir_api_url, remaining_element, name_element, loca
         this.display();
     };
 
-    this.patchFlags = function() {
-        /***
-        Asyncronously PATCH flags to the server.  A 202 response indicates that the server accepted the request
-        but gives no additional information.  In this event, set this.flags to an empty list.
-        ***/
-        if (!this.flags || !this.flags.length) {
-            return;
-        }
-        var request = new XMLHttpRequest();
-        // http://stackoverflow.com/questions/133973/how-does-this-keyword-work-within-a-javascript-object-literal
-        var that = this;
-        request.onreadystatechange = function() {
-            if (request.readyState == 4) {
-                console.log('Response received for flags patch request.  Status code: ' + request.status);
-                if (request.status == 202) {
-                    that.flags = [];
-                }
-            }
-        };
-        request.open('PATCH', this.voter_api_url, true);
-        request.setRequestHeader('Content-Type', 'application/json');
-        console.log('PATCHing flags to the server.');
-        request.send(JSON.stringify({"objects":this.flags}));
-    };
-
-    this.patchIRs = function() {
-        /***
-        Asyncronously PATCH IRs to the server.  A 202 response indicates that the server accepted the request
-        but gives no additional information.  In this event, remove the IRs from local storage.
-        
-        This method assumes that IRs are present in local storage.
-        ***/
-        var request = new XMLHttpRequest();
-        request.onreadystatechange = function() {
-            if (request.readyState == 4) {
-                console.log('Response received for IRs patch request.  Status code: ' + request.status);
-                if (request.status == 202) {
-                    localStorage.removeItem('irs');
-                }
-            }
-        };
-        request.open('PATCH', this.ir_api_url, true);
-        request.setRequestHeader('Content-Type', 'application/json');
-        console.log('PATCHing IRs to the server.');
-        request.send(localStorage.irs);
-    };
-
     this.restoreDefaults = function() {
         document.getElementById(this.remaining_element).innerHTML = "0";
         document.getElementById(this.name_element).innerHTML = "Name: No data";
@@ -308,29 +350,68 @@ function Voters(voter_api_url, ir_api_url, remaining_element, name_element, loca
         document.getElementById(this.phone_number_element).innerHTML = "No phone number";
     };
 
+    this.retryGetVoters = function() {
+        /***
+        After a failed request for voters while this batch is empty, call getVoters again with exponential
+        backoff, like the outbox.  A request that fails while the volunteer still has voters is not retried;
+        the next call to display() prefetches again.
+        ***/
+        this.failures++;
+        var delay = Math.min(VOTERS_MAX_RETRY, VOTERS_MIN_RETRY * Math.pow(2, this.failures - 1));
+        delay = delay / 2 + Math.random() * delay / 2;
+        console.log('Request for voters failed.  Retrying in ' + Math.round(delay / 1000) + ' seconds.');
+        window.clearTimeout(this.retry_timer);
+        var that = this;
+        this.retry_timer = window.setTimeout(function() {
+            if (!that.voters) {
+                that.getVoters();
+            }
+        }, delay);
+    };
+
     this.save = function() {
         /***
-        Write this.voters and, if applicable, this.flags, to localStorage.  The containing html page
-        should call this method on unload.
+        Write this.voters to localStorage.  The containing html page should call this method on unload.
         ***/
         if (this.voters && this.voters.length) {  // Boolean([]) is true; don't save an empty array
             localStorage.voters = JSON.stringify(this.voters);
         }
-        if (this.flags && this.flags.length) {  // Boolean([]) is true; don't save an empty array
-            localStorage.flags = JSON.stringify(this.flags);
+    };
+
+    this.useNextVoters = function() {
+        /***
+        Replace the 'voters' attribute with the prefetched batch, if there is one for the currently selected
+        campaigns that was downloaded less than 48 hours ago, and display it.  Return true if it did.
+        ***/
+        var next_voters = localStorage.next_voters;
+        var is_current = next_voters && localStorage.next_voters_campaigns == String(this.campaign_ids) &&
+            ((new Date() - new Date(localStorage.next_voters_download)) < 172800000);   // 48 hours in milliseconds
+        localStorage.removeItem('next_voters');
+        if (!is_current) {
+            return false;
         }
+        console.log('Using the prefetched batch of voters.');
+        this.voters = JSON.parse(next_voters);
+        this.current_index = 0;
+        localStorage.last_voters_download = localStorage.next_voters_download;
+        this.save();    // TODO - delete when "onunload" is reliable
+        this.display();
+        return true;
     };
 
     // Initialization
     this.voter_api_url = voter_api_url;     // list GET
-    this.ir_api_url = ir_api_url;           // list POST
+    this.outbox = outbox;                   // Uploads IRs and flags; see campaigner-outbox.js
     this.remaining_element = remaining_element;
     this.name_element = name_element;
     this.location_element = location_element;
     this.phone_number_element = phone_number_element;
     this.campaign_ids = campaign_ids;       // The currently selected campaigns
+    this.prefetching = false;               // True while a request for the next batch is in flight
+    this.no_more_voters = false;            // True if the server had no next batch
+    this.failures = 0;                      // Consecutive failed requests for voters
+    this.retry_timer = null;
     this.getVoters();                       // Populate a 'voters' array attribute
-    this.flags = this.getFlags();           // Populate a 'flags' array attribute
 
     // If returning from ir.html, set the current index to match the "drop" GET parameter, and drop that voter
     var drop_parameter = this.getDropValue();
@@ -69,39 +69,58 @@ function Issues(api_url, issues_list) {
         this.issues_counter++;
     };
 
+    this.applyChanges = function(changes) {
+        /***
+        Update the issues with a response of the issue changes endpoint, and save them and their version
+        in local storage.  Keep the issues in alphabetical order, as the server sends them.
+        ***/
+        var replaced = changes.deleted.concat(changes.objects.map(function(issue) { return issue.id; }));
+        var issues = (changes.full ? [] : this.issues || []).filter(function(issue) {
+            return replaced.indexOf(issue.id) == -1;
+        }).concat(changes.objects);
+        issues.sort(function(a, b) { return a.issue.localeCompare(b.issue); });
+        this.issues = issues;
+        localStorage.issues = JSON.stringify(issues);
+        localStorage.issues_version = changes.version;
+    };
+
     this.getIssues = function() {
         /***
-        If local storage contains issues, and if the last syncronization with the server is less than 30 days ago,
-        use the issues in local storage.  Otherwise, make an API call.  The server returns issues in alphabetical
-        order.
+        If local storage contains issues, show them at once.  Then ask the server for the issues changed
+        since the version in local storage.  The server answers 304 if none changed, or with the changed
+        issues and the IDs of issues to remove.  See tcswebapp.deltasync.
         ***/
-        if (localStorage.issues && this.lessThan30Days()) {
-            console.log('Found recent issues in local storage.');
+        var shown = false;
+        var url = this.api_url;
+        if (localStorage.issues) {
+            console.log('Found issues in local storage.');
             this.issues = JSON.parse(localStorage.issues);
             this.addIssue();
-            return;
+            shown = true;
+            if (localStorage.issues_version) {
+                url += '?since=' + localStorage.issues_version;
+            }
         }
-        
-        // Didn't find unexpired issues in local storage.  Make an API call.
+
         var request = new XMLHttpRequest();
         // http://stackoverflow.com/questions/133973/how-does-this-keyword-work-within-a-javascript-object-literal
         var that = this;
         request.onreadystatechange = function() {
             if (request.readyState == 4) {
-                console.log('Response received for issues request.  Status code: ' + request.status);
+                console.log('Response received for issue changes request.  Status code: ' + request.status);
                 if (request.status == 200) {
-                    // The 'objects' attribute of the server's JSON response is an array of issues
-                    // [{"id": 2, "issue": "direct election of President"}, ...]
-                    that.issues = JSON.parse(request.responseText).objects;
-                    localStorage.issues = JSON.stringify(that.issues);
-                    localStorage.last_issues_download = new Date(); // Saves the current date-time as a string
-                    that.addIssue();
+                    // {"version": 12, "full": false, "objects": [{"id": 2, "issue": "direct election of President"}, ...],
+                    // "deleted": [3, 7]}
+                    that.applyChanges(JSON.parse(request.responseText));
+                    if (!shown) {
+                        that.addIssue();
+                    }
                 }
             }
         };
-        request.open('GET', this.api_url, true);
+        request.open('GET', url, true);
         request.setRequestHeader('Accept', 'application/json');
-        console.log('Requesting issues from the server.');
+        console.log('Requesting issue changes from the server.');
         request.send();
     };
 
@@ -139,15 +158,6 @@ function Issues(api_url, issues_list) {
         return preferences;
     };
 
-    this.lessThan30Days = function() {
-        /*** Return True if voters where last requested from the server less than 30 days ago. ***/
-        if (localStorage.last_issues_download) {
-            var last_download = new Date(localStorage.last_issues_download);
-            return ((new Date() - last_download) < 2592000000); // 30 days in milliseconds
-        }
-        return false;
-    };
-
     // Initialization
     this.api_url = api_url;
     this.issues_list = issues_list;
@@ -158,7 +168,7 @@ function Issues(api_url, issues_list) {
     this.getIssues();
 }
 
-function IR(dial_url, voter_name) {
+function IR(dial_url, voter_name, outbox) {
     /*** Object Prototype
     Manage the user's submission of an intelligence report (IR) for a specific voter.
     ***/
@@ -194,20 +204,16 @@ function IR(dial_url, voter_name) {
             alert("Please provide useful information to your campaigns.");
             return;
         }
-        var irs;
-        if (localStorage.irs) {
-            irs = JSON.parse(localStorage.irs);
-        } else {
-            // The attribute "objects" is consistent with the Tastypie implementation for PATCH requests
-            irs = {"objects":[]};
-        }
-        irs.objects.push({
+        var voter_index = this.voter_index;
+        var done = function() { window.location = dial_url + '?drop=' + voter_index; };
+        // dial.html uploads the outbox when it loads
+        outbox.add('ir', this.voter_id, {
             "method": 1,                 // Telephone (voice)
             "voter": this.voter_id,
             "intelligence_report": issue_prefs,
+        }).then(done, function(error) {
+            alert('Your report could not be saved on this device: ' + error);
         });
-        localStorage.irs = JSON.stringify(irs);
-        window.location = dial_url + '?drop=' + this.voter_index;
     };
 
     // Initialization
@@ -0,0 +1,282 @@
+/***
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+The outbox holds intelligence reports (IRs) and flagged phone numbers until the server accepts them,
+so that a volunteer can keep working without a signal.  Records are kept in IndexedDB, or in local
+storage if IndexedDB is not available, and uploaded in batches.
+***/
+
+var OUTBOX_BATCH_SIZE = 200;        // Objects per PATCH request; the server accepts at most 500
+var OUTBOX_MIN_RETRY = 2000;        // Milliseconds before the first retry of a failed upload
+var OUTBOX_MAX_RETRY = 300000;      // Longest wait between retries (5 minutes)
+
+function getCookie(name) {
+    /*** Return the value of the named cookie, or null. ***/
+    var match = new RegExp('(?:^|;\\s*)' + name + '=([^;]*)').exec(document.cookie);
+    return match ? decodeURIComponent(match[1]) : null;
+}
+
+function makeClientKey() {
+    /*** Return a random string that identifies an IR or flag, so that the server can ignore one uploaded twice. ***/
+    return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2, 12);
+}
+
+function IndexedDBStore() {
+    /*** Object Prototype
+    Keep outbox records in the IndexedDB object store "outbox".  Every method returns a Promise.
+    ***/
+
+    this.run = function(mode, action) {
+        /*** Call 'action' with the object store in a new transaction, and resolve when the transaction completes. ***/
+        return this.database.then(function(database) {
+            return new Promise(function(resolve, reject) {
+                var transaction = database.transaction('outbox', mode);
+                var result = action(transaction.objectStore('outbox'));
+                transaction.oncomplete = function() { resolve(result && result.result); };
+                transaction.onerror = function() { reject(transaction.error); };
+                transaction.onabort = function() { reject(transaction.error); };
+            });
+        });
+    };
+
+    this.add = function(records) {
+        return this.run('readwrite', function(store) {
+            for (var index = 0; index < records.length; index++) {
+                store.add(records[index]);
+            }
+        });
+    };
+
+    this.getAll = function() {
+        /*** Resolve with every record in the order added.  Each record has an 'id' attribute. ***/
+        return this.run('readonly', function(store) {
+            var result = {"result": []};
+            store.openCursor().onsuccess = function(event) {
+                var cursor = event.target.result;
+                if (cursor) {
+                    result.result.push(cursor.value);
+                    cursor.continue();
+                }
+            };
+            return result;
+        });
+    };
+
+    this.remove = function(ids) {
+        return this.run('readwrite', function(store) {
+            for (var index = 0; index < ids.length; index++) {
+                store.delete(ids[index]);
+            }
+        });
+    };
+
+    // Initialization
+    this.database = new Promise(function(resolve, reject) {
+        var request = indexedDB.open('campaigner', 1);
+        request.onupgradeneeded = function() {
+            request.result.createObjectStore('outbox', {"keyPath": "id", "autoIncrement": true});
+        };
+        request.onsuccess = function() { resolve(request.result); };
+        request.onerror = function() { reject(request.error); };
+    });
+}
+
+function LocalStorageStore() {
+    /*** Object Prototype
+    Keep outbox records in local storage, with the same methods as IndexedDBStore.
+    ***/
+
+    this.load = function() {
+        return localStorage.outbox ? JSON.parse(localStorage.outbox) : [];
+    };
+
+    this.add = function(records) {
+        var stored = this.load();
+        var next_id = Number(localStorage.outbox_next_id || 1);
+        for (var index = 0; index < records.length; index++) {
+            records[index].id = next_id++;
+            stored.push(records[index]);
+        }
+        localStorage.outbox = JSON.stringify(stored);
+        localStorage.outbox_next_id = next_id;
+        return Promise.resolve();
+    };
+
+    this.getAll = function() {
+        return Promise.resolve(this.load());
+    };
+
+    this.remove = function(ids) {
+        localStorage.outbox = JSON.stringify(this.load().filter(function(record) {
+            return ids.indexOf(record.id) == -1;
+        }));
+        return Promise.resolve();
+    };
+}
+
+function Outbox(ir_api_url, voter_api_url) {
+    /*** Object Prototype
+    Queue IRs and flags, and upload them when there is a connection.  A record has the form
+    {"kind": "ir" or "flag", "voter": voter_id, "object": the object to PATCH}.
+    ***/
+
+    this.add = function(kind, voter_id, object) {
+        /***
+        Queue an object.  Return a Promise that resolves when it is stored.  Try to upload an IR at once,
+        but leave a flag for the next upload, so that each flag does not cost a request of its own.
+        ***/
+        if (!object.client_key) {
+            object.client_key = makeClientKey();
+        }
+        var that = this;
+        return this.store.add([{"kind": kind, "voter": Number(voter_id), "object": object}]).then(function() {
+            if (kind == 'ir') {
+                that.flush();
+            }
+        });
+    };
+
+    this.flush = function() {
+        /***
+        Upload the queued records, IRs first, one batch at a time.  Return a Promise that resolves, and
+        never rejects, when every record is uploaded or an upload fails.  After a failure, try again
+        with exponential backoff.
+        ***/
+        if (this.flushing) {
+            return this.flushing;
+        }
+        window.clearTimeout(this.retry_timer);
+        var that = this;
+        this.flushing = this.store.getAll().then(function(records) {
+            return that.sendAll(records.filter(function(record) { return record.kind == 'ir'; }), that.ir_api_url)
+                .then(function() {
+                    return that.sendAll(records.filter(function(record) { return record.kind == 'flag'; }),
+                        that.voter_api_url);
+                });
+        }).then(function() {
+            that.failures = 0;
+        }, function(error) {
+            // Wait 2, 4, 8, ... seconds, with jitter so that volunteers who regain a signal together do not retry together
+            that.failures++;
+            var delay = Math.min(OUTBOX_MAX_RETRY, OUTBOX_MIN_RETRY * Math.pow(2, that.failures - 1));
+            delay = delay / 2 + Math.random() * delay / 2;
+            console.log('Outbox upload failed (' + error + ').  Retrying in ' + Math.round(delay / 1000) + ' seconds.');
+            that.retry_timer = window.setTimeout(function() { that.flush(); }, delay);
+        }).then(function() {
+            that.flushing = null;
+        });
+        return this.flushing;
+    };
+
+    this.getVoterIds = function() {
+        /*** Return a Promise of an array of the IDs of voters with queued IRs or flags. ***/
+        return this.store.getAll().then(function(records) {
+            return records.map(function(record) { return record.voter; });
+        }, function() {
+            return [];
+        });
+    };
+
+    this.migrate = function() {
+        /*** Move IRs and flags saved in local storage by earlier versions of Campaigner into the outbox. ***/
+        var records = [];
+        if (localStorage.irs) {
+            JSON.parse(localStorage.irs).objects.forEach(function(ir) {
+                ir.client_key = makeClientKey();
+                records.push({"kind": "ir", "voter": Number(ir.voter), "object": ir});
+            });
+        }
+        if (localStorage.flags) {
+            JSON.parse(localStorage.flags).forEach(function(flag) {
+                flag.client_key = makeClientKey();
+                records.push({"kind": "flag", "voter": Number(/(\d+)\/?$/.exec(flag.resource_uri)[1]), "object": flag});
+            });
+        }
+        if (!records.length) {
+            return Promise.resolve();
+        }
+        return this.store.add(records).then(function() {
+            localStorage.removeItem('irs');
+            localStorage.removeItem('flags');
+        });
+    };
+
+    this.patch = function(url, objects) {
+        /*** PATCH objects.  Return a Promise of the response status, which rejects if there is no response. ***/
+        return new Promise(function(resolve, reject) {
+            var request = new XMLHttpRequest();
+            request.onreadystatechange = function() {
+                if (request.readyState == 4) {
+                    console.log('Response received for outbox patch request.  Status code: ' + request.status);
+                    if (request.status) {
+                        resolve(request.status);
+                    } else {
+                        reject('no response');
+                    }
+                }
+            };
+            request.open('PATCH', url, true);
+            request.setRequestHeader('Content-Type', 'application/json');
+            request.setRequestHeader('X-CSRFToken', getCookie('csrftoken') || '');
+            request.send(JSON.stringify({"objects": objects}));
+        });
+    };
+
+    this.send = function(records, url) {
+        /***
+        Upload records in one request, and remove them from the outbox if the server accepts them.  The
+        server rejects the whole batch if one record is invalid, so split a rejected batch to find and
+        discard the invalid records.  Any other error rejects the returned Promise.
+        ***/
+        var that = this;
+        return this.patch(url, records.map(function(record) { return record.object; })).then(function(status) {
+            if (status == 202) {
+                return that.store.remove(records.map(function(record) { return record.id; }));
+            }
+            if (status == 400 && records.length > 1) {
+                var half = Math.ceil(records.length / 2);
+                return that.send(records.slice(0, half), url).then(function() {
+                    return that.send(records.slice(half), url);
+                });
+            }
+            if (status == 400) {
+                console.log('The server rejected a queued ' + records[0].kind + ' for voter ' + records[0].voter +
+                    '.  Discarding it.');
+                return that.store.remove([records[0].id]);
+            }
+            throw 'status ' + status;   // Not logged in, throttled, or a server error; try again later
+        });
+    };
+
+    this.sendAll = function(records, url) {
+        /*** Upload records in batches of OUTBOX_BATCH_SIZE, one at a time. ***/
+        var that = this;
+        var sent = Promise.resolve();
+        for (var start = 0; start < records.length; start += OUTBOX_BATCH_SIZE) {
+            sent = sent.then(this.send.bind(this, records.slice(start, start + OUTBOX_BATCH_SIZE), url));
+        }
+        return sent;
+    };
+
+    // Initialization
+    this.ir_api_url = ir_api_url;           // list PATCH
+    this.voter_api_url = voter_api_url;     // list PATCH
+    this.store = window.indexedDB ? new IndexedDBStore() : new LocalStorageStore();
+    this.flushing = null;                   // The Promise of the upload in progress
+    this.failures = 0;                      // Consecutive failed uploads
+    this.retry_timer = null;
+    var that = this;
+    // Some browsers refuse IndexedDB in private windows
+    Promise.resolve(this.store.database).catch(function() {
+        console.log('IndexedDB is not available.  Keeping the outbox in local storage.');
+        that.store = new LocalStorageStore();
+    }).then(function() {
+        return that.migrate();
+    }).then(function() {
+        that.flush();
+    });
+    window.addEventListener('online', function() { that.flush(); });
+}
@@ -0,0 +1,67 @@
+/***
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+The Campaigner service worker, rendered by campaigner.views.campaignerServiceWorker.  It caches the
+Campaigner pages and static files when it is installed and serves them from the cache, so that
+Campaigner starts without waiting for the network.  API requests always go to the network;
+campaigner-outbox.js queues the uploads that fail.
+***/
+
+var CACHE_NAME = 'campaigner-{{ version }}';
+var PRECACHE_URLS = {{ precache_urls|safe }};
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(caches.open(CACHE_NAME).then(function(cache) {
+        return cache.addAll(PRECACHE_URLS);
+    }).then(function() {
+        return self.skipWaiting();
+    }));
+});
+
+self.addEventListener('activate', function(event) {
+    // Discard the caches of earlier versions
+    event.waitUntil(caches.keys().then(function(names) {
+        return Promise.all(names.filter(function(name) {
+            return name.indexOf('campaigner-') == 0 && name != CACHE_NAME;
+        }).map(function(name) {
+            return caches.delete(name);
+        }));
+    }).then(function() {
+        return self.clients.claim();
+    }));
+});
+
+self.addEventListener('fetch', function(event) {
+    var request = event.request;
+    var url = new URL(request.url);
+    var same_origin = url.origin == self.location.origin;
+    if (request.method != 'GET' || (same_origin && url.pathname.indexOf('/api/') == 0)) {
+        return;
+    }
+    event.respondWith(caches.open(CACHE_NAME).then(function(cache) {
+        if (same_origin) {
+            // The shell changes only with a new service worker.  Ignore "?drop=" and "?id=" in page urls.
+            return cache.match(request, {"ignoreSearch": true}).then(function(cached) {
+                return cached || fetch(request);
+            });
+        }
+        // Bootstrap and jQuery: serve the cached copy, and refresh it in the background
+        return cache.match(request).then(function(cached) {
+            var fetched = fetch(request).then(function(response) {
+                if (response.ok || response.type == 'opaque') {
+                    cache.put(request, response.clone());
+                }
+                return response;
+            }, function(error) {
+                if (cached) {
+                    return cached;
+                }
+                throw error;
+            });
+            return cached || fetched;
+        });
+    }));
+});
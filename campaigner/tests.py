@@ -0,0 +1,138 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from campaign.models import Campaign
+from campaigner.loadtest import Recorder, percentile, runLoadTest
+from distutils.spawn import find_executable
+from django.core.urlresolvers import reverse
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from tcswebapp.synthetic import SYNTHETIC_PASSWORD, generateData
+from unittest import skipUnless
+from voter.models import VoterContact
+import json
+import os
+import subprocess
+
+# Runs campaigner-dial.js, passed as the first argument, with fake browser objects.  A volunteer drops
+# the last voter of a batch while the prefetch of the next batch is in flight, and the prefetch fails.
+DIAL_RETRY_SCRIPT = """
+var fs = require('fs');
+var vm = require('vm');
+var requests = [], timers = [], element = {};
+function Request() {
+    requests.push(this);
+    this.open = function(method, url) { this.url = url; };
+    this.setRequestHeader = function() {};
+    this.send = function() {};
+}
+function respond(request, status, objects) {
+    request.readyState = 4;
+    request.status = status;
+    request.responseText = JSON.stringify({"objects": objects});
+    request.onreadystatechange();
+}
+function makeVoter(id) {
+    return {"id": id, "first_name": "Voter", "last_name": String(id), "gender": "", "phone_number1": "5025550100",
+        "phone_number2": "", "address": {"city": "Louisville", "state": "KY"}, "resource_uri": "/api/v1/voter/" + id + "/"};
+}
+var context = vm.createContext({
+    "alert": function() {},
+    "console": {"log": function() {}},
+    "document": {"getElementById": function() { return element; }},
+    "localStorage": {"removeItem": function(key) { delete this[key]; }},
+    "window": {"location": {"search": ""}, "clearTimeout": function() {},
+        "setTimeout": function(callback, delay) { timers.push({"callback": callback, "delay": delay}); }},
+    "XMLHttpRequest": Request
+});
+vm.runInContext(fs.readFileSync(process.argv[1], 'utf8'), context);
+context.localStorage.voters = JSON.stringify([makeVoter(1)]);
+context.localStorage.last_voters_download = new Date();
+var outbox = {"flush": function() { return Promise.resolve(); }, "getVoterIds": function() { return Promise.resolve([]); }};
+var voters = new context.Voters('/api/v1/voter/', outbox, 'remaining', 'name', 'location', 'phone_number', [1]);
+setImmediate(function() {
+    voters.drop();
+    respond(requests[0], 0, []);
+    var result = {"requests": requests.length, "delays": timers.map(function(timer) { return timer.delay; })};
+    timers[0].callback();
+    setImmediate(function() {
+        respond(requests[1], 200, [makeVoter(2), makeVoter(3)]);
+        result.voters = voters.voters.map(function(voter) { return voter.id; });
+        process.stdout.write(JSON.stringify(result));
+    });
+});
+"""
+
+class ServiceWorkerTests(TestCase):
+    """Tests for campaigner.views.campaignerServiceWorker."""
+
+    def testServiceWorker(self):
+        """The service worker should precache the Campaigner pages and be revalidated on every visit."""
+        response = self.client.get(reverse('campaigner_service_worker'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/javascript')
+        self.assertIn('no-cache', response['Cache-Control'])
+        for name in ('campaigner_dial', 'campaigner_campaigns', 'campaigner_IR'):
+            self.assertIn('"{0}"'.format(reverse(name)), response.content)
+        self.assertIn('campaigner-outbox.js', response.content)
+        self.assertEqual(reverse('campaigner_service_worker'), reverse('campaigner_dial') + 'service-worker.js')
+
+        # Every page registers it
+        response = self.client.get(reverse('campaigner_IR'))
+        self.assertContains(response, 'navigator.serviceWorker.register("{0}")'.format(
+            reverse('campaigner_service_worker')))
+
+@skipUnless(find_executable('node'), "Node.js is not installed")
+class DialScriptTests(SimpleTestCase):
+    """Tests for campaigner-dial.js, run with Node.js."""
+
+    def testRetryFailedPrefetch(self):
+        """A prefetch that fails after the batch runs out should be retried after a backoff delay."""
+        script = os.path.join(os.path.dirname(__file__), 'static', 'campaigner', 'campaigner-dial.js')
+        result = json.loads(subprocess.check_output(['node', '-e', DIAL_RETRY_SCRIPT, script]))
+        self.assertEqual(result['requests'], 1)     # Nothing was requested after the failure ...
+        self.assertEqual(len(result['delays']), 1)  # ... but a retry was scheduled
+        self.assertTrue(1000 <= result['delays'][0] <= 2000)
+        self.assertEqual(result['voters'], [2, 3])
+
+class RecorderTests(TestCase):
+    """Tests for campaigner.loadtest.Recorder."""
+
+    def testReport(self):
+        """Errors, percentiles, and voters served more than once should be reported."""
+        recorder = Recorder()
+        for i in range(1, 101):
+            recorder.recordRequest('voter_get', i / 1000.0, 200 if i <= 95 else 500)
+        recorder.recordRequest('ir_patch', 0.5, 'URLError')
+        recorder.recordServed([1, 2, 3])
+        recorder.recordServed([3, 4])
+        report = recorder.getReport(10.0, 2)
+        self.assertEqual(report['requests']['voter_get']['p50_ms'], 50)
+        self.assertEqual(report['requests']['voter_get']['p99_ms'], 99)
+        self.assertEqual(report['requests']['voter_get']['error_rate'], 0.05)
+        self.assertEqual(report['requests']['ir_patch']['error_rate'], 1.0)
+        self.assertEqual(report['requests']['login']['p50_ms'], None)
+        self.assertEqual((report['voters_served'], report['duplicate_voters_served']), (5, 1))
+        self.assertEqual(percentile([], 0.5), None)
+
+@override_settings(API_THROTTLE_RATES={'voter': (1000, 1), 'votercontact': (1000, 1)})
+class LoadTestTests(LiveServerTestCase):
+    """Run the load-test harness against a live server."""
+
+    def testLoadTest(self):
+        """Simulated volunteers should log in, get voters, and PATCH their IRs."""
+        generateData(num_campaigns=1, workers_per_campaign=2, num_voters=200, contact_rate=0)
+        campaign = Campaign.objects.get()
+        volunteers = [(email, SYNTHETIC_PASSWORD, [campaign.pk]) for email in campaign.workers.values_list('email',
+            flat=True)]
+        report = runLoadTest(self.live_server_url, volunteers, duration=1.5, think_time=0.01, ir_rate=1.0, flag_rate=0)
+        self.assertEqual(report['requests']['login']['statuses'], {'200': 2})
+        self.assertGreater(report['requests']['voter_get']['count'], 2)
+        self.assertEqual(report['requests']['voter_get']['error_rate'], 0)
+        self.assertGreater(report['voters_served'], 0)
+        self.assertGreater(report['requests']['ir_patch']['statuses'].get('202', 0), 0)
+        self.assertGreater(VoterContact.objects.count(), 0)
@@ -12,4 +12,5 @@ urlpatterns = [
     url(r'^$', views.campaignerDial, name='campaigner_dial'),
     url(r'^campaigns/$', views.campaignerCampaigns, name='campaigner_campaigns'),
     url(r'^IR/$', views.campaignerIR, name='campaigner_IR'),
+    url(r'^service-worker\.js$', views.campaignerServiceWorker, name='campaigner_service_worker'),
 ]
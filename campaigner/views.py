@@ -5,7 +5,23 @@ All rights reserved.  You are welcome to inspect this code for your education or
 the author's qualifications.  No other uses are permitted.
 """
 
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.urlresolvers import reverse
 from django.shortcuts import render
+from django.template.loader import get_template
+from django.templatetags.static import static
+from django.views.decorators.cache import cache_control
+import hashlib
+import json
+
+# The pages and files the service worker caches, so that Campaigner starts without a connection
+SHELL_PAGES = ('campaigner_dial', 'campaigner_campaigns', 'campaigner_IR')
+SHELL_TEMPLATES = ('campaigner/dial.html', 'campaigner/campaigns.html', 'campaigner/ir.html',
+    'campaigner/base-campaigner.html', 'tcswebapp/base.html', 'campaigner/service-worker.js')
+SHELL_STATIC_FILES = ('campaigner/campaigner-campaigns.js', 'campaigner/campaigner-dial.js', 'campaigner/campaigner-ir.js',
+    'campaigner/campaigner-outbox.js', 'campaigner/background.jpg', 'tcswebapp/tcs.css', 'tcswebapp/tcs-icon.png')
 
 def campaignerCampaigns(request):
     return render(request, 'campaigner/campaigns.html')
@@ -16,3 +32,34 @@ def campaignerDial(request):
 def campaignerIR(request):
     """ir.html expects an "id" url parameter.  This is checked client side using JavaScript."""
     return render(request, 'campaigner/ir.html')
+
+def getShellVersion():
+    """
+    Return a hash of the templates and static files of the Campaigner shell.  The service worker
+    includes it, so browsers install a new service worker, and replace their cached copy of the
+    shell, whenever one of these files changes.
+    """
+    md5 = hashlib.md5()
+    for name in SHELL_TEMPLATES:
+        md5.update(get_template(name).template.source.encode('utf-8'))
+    for name in SHELL_STATIC_FILES:
+        with open(finders.find(name), 'rb') as f:
+            md5.update(f.read())
+    return md5.hexdigest()[:12]
+
+@cache_control(no_cache=True)
+def campaignerServiceWorker(request):
+    """
+    The service worker is served from /campaigner/ rather than from the static files so that its scope
+    is the Campaigner pages.  Browsers should check it for a new version on every visit.
+    """
+    urls = [reverse(name) for name in SHELL_PAGES] + [static(name) for name in SHELL_STATIC_FILES]
+    variant_url = getattr(staticfiles_storage, 'variantUrl', None)
+    if variant_url:
+        # Resized images built by collectstatic; see tcswebapp.staticassets
+        urls += filter(None, [variant_url(name, width) for name in SHELL_STATIC_FILES
+            for width in getattr(settings, 'STATIC_IMAGE_VARIANTS', {}).get(name, [])])
+    return render(request, 'campaigner/service-worker.js', {
+        'version': getShellVersion(),
+        'precache_urls': json.dumps(urls, indent=4),
+    }, content_type='application/javascript')
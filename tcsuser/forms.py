@@ -56,6 +56,21 @@ class TcsUserCreationForm(forms.ModelForm):
         """Overridden so the password gets hashed."""
         return TcsUser.objects.create_user(self.cleaned_data['email'], self.cleaned_data['password'])
 
+class PassphraseForm(forms.Form):
+    """
+    Use this form to choose a passphrase when accepting an invitation to volunteer.  The rules are
+    those of TcsUserCreationForm.
+    """
+    password = TcsUserCreationForm.base_fields['password']
+    password2 = TcsUserCreationForm.base_fields['password2']
+
+    def clean(self):
+        """password and password2 must match."""
+        cleaned_data = super(PassphraseForm, self).clean()
+        if cleaned_data.get('password') != cleaned_data.get('password2'):
+            self.add_error('password2', forms.ValidationError('Passphrases must match.'))
+        return cleaned_data
+
 class TcsUserProfileForm(forms.ModelForm):
     """Use this form to modify a TcsUserProfile instance."""
     class Meta:
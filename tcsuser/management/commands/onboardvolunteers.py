@@ -0,0 +1,35 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from campaign.models import Campaign
+from django.core.management.base import BaseCommand, CommandError
+from tcsuser.onboarding import onboardVolunteers, parseVolunteers
+
+class Command(BaseCommand):
+    help = ('Register the volunteers in a CSV file as workers of a campaign and queue their activation e-mails.  '
+        'See tcsuser.onboarding.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_id', type=int)
+        parser.add_argument('csv_file')
+        parser.add_argument('--processes', type=int, default=None,
+            help='Processes that hash passwords (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        try:
+            campaign = Campaign.objects.get(pk=options['campaign_id'])
+        except Campaign.DoesNotExist:
+            raise CommandError('No campaign has the id {0}.'.format(options['campaign_id']))
+        try:
+            with open(options['csv_file'], 'rb') as f:
+                volunteers, errors = parseVolunteers(f, str(campaign.address.country))
+        except IOError as e:
+            raise CommandError(str(e))
+        count = onboardVolunteers(campaign, volunteers, options['processes'], errors)
+        for error in errors:
+            self.stderr.write(error)
+        self.stdout.write('Added {0} volunteers; rejected {1} rows.'.format(count, len(errors)))
@@ -0,0 +1,28 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django.core.management.base import BaseCommand
+from tcsuser.outbox import BATCH_SIZE, MAX_ATTEMPTS, sendQueuedEmails
+import time
+
+class Command(BaseCommand):
+    help = 'Send e-mail messages waiting in the outbox.  See tcsuser.outbox.  Run one worker at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Messages per SMTP connection')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--loop', action='store_true', help='Keep checking the outbox until interrupted')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between checks with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = sendQueuedEmails(batch_size=options['batch_size'], max_attempts=options['max_attempts'])
+            if sent or failed or not options['loop']:
+                self.stdout.write('Sent {0} messages.  {1} failed and will be retried.'.format(sent, failed))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
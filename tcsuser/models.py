@@ -77,3 +77,25 @@ class TcsUserProfile(models.Model):
 
     def __unicode__(self):
         return 'Profile for ' + self.name
+
+class OutgoingEmail(models.Model):
+    """
+    An e-mail message waiting to be sent, or already sent.  Requests add rows with
+    tcsuser.outbox.enqueueEmail instead of connecting to an SMTP server, and the sendemails
+    management command sends them in batches.  See tcsuser.outbox.
+    """
+    subject = models.CharField(max_length=200)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.EmailField(max_length=254)
+    created_on = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField()             # Postponed after each failed attempt
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.CharField(max_length=200, blank=True)
+    sent_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = [('sent_on', 'send_after')]
+
+    def __unicode__(self):
+        return '{0} to {1}'.format(self.subject, self.to)
@@ -0,0 +1,201 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Bulk onboarding of volunteers recruited by a campaign, for example at a rally.  A CSV file with a
+header row names the columns email, name, phone_number, gender, street, city, state, country,
+postal_code, and optionally password.  Every valid row becomes an inactive TcsUser with a profile
+and a worker of the campaign.
+
+Hashing a password with PBKDF2 is deliberately slow.  The onboardvolunteers management command
+hashes passwords across a pool of processes, but an upload through the web is handled within the
+request, so it may set at most MAX_WEB_PASSWORDS passwords, hashed one after another.  Volunteers
+without a password get an unusable one, which costs nothing, and an invitation to choose a password.
+
+Users, addresses, profiles, and e-mail messages are created with a few bulk queries instead of a few
+queries per volunteer, and bulk creation skips the post_save listener that queues activation links,
+so the messages are queued here.
+"""
+
+from address.forms import AddressForm
+from address.models import Address
+from csv import DictReader
+from datetime import datetime
+from django import forms
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.signing import TimestampSigner
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, transaction
+from multiprocessing import Pool
+from tcsuser.forms import TcsUserCreationForm, TcsUserProfileForm
+from tcsuser.models import OutgoingEmail, TcsUser, TcsUserProfile
+
+REQUIRED_COLUMNS = ('email', 'name', 'phone_number', 'gender', 'street', 'city', 'state', 'country', 'postal_code')
+MAX_ROWS = 5000
+MAX_WEB_PASSWORDS = 20  # About a second of hashing
+INVITE_SALT = 'tcsuser.invite'  # Keeps invitations and activation links from being accepted for each other
+PARALLEL_THRESHOLD = 8  # Hash fewer passwords than this without starting a pool
+
+def parseVolunteers(f, default_country='', max_passwords=None):
+    """
+    Read and validate a CSV file of volunteers.  Return the tuple (volunteers, errors).  'volunteers'
+    is a list of dictionaries with the keys 'email', 'password' (None if not given), 'profile' (the
+    cleaned data of TcsUserProfileForm), and 'address' (the cleaned data of AddressForm).  'errors' is
+    a list of strings naming the line of each rejected row.  Rows with a password after the first
+    'max_passwords' (default: no limit) are rejected.
+    """
+    reader = DictReader(f)
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        return [], ['Missing columns: {0}'.format(', '.join(missing))]
+    email_field = forms.EmailField()
+    password_field = TcsUserCreationForm.base_fields['password']
+
+    volunteers = []
+    errors = []
+    seen = set()
+    num_passwords = 0
+    for line, row in enumerate(reader, start=2):   # Line 1 is the header
+        if len(volunteers) >= MAX_ROWS:
+            errors.append('Line {0}: Only {1} volunteers can be imported at once.'.format(line, MAX_ROWS))
+            break
+        try:
+            row = dict((key, (value or '').decode('utf-8').strip()) for key, value in row.items() if key)
+        except UnicodeDecodeError:  # For example, a spreadsheet saved as Latin-1
+            errors.append('Line {0}: not UTF-8.  Save the file as CSV UTF-8 and upload it again.'.format(line))
+            continue
+        try:
+            email = TcsUser.objects.normalize_email(email_field.clean(row['email']))
+            password = password_field.clean(row['password']) if row.get('password') else None
+        except forms.ValidationError as e:
+            errors.append('Line {0}: {1}'.format(line, ' '.join(e.messages)))
+            continue
+        profile_form = TcsUserProfileForm(row)
+        address_form = AddressForm(dict(row, country=row['country'].upper() or default_country))
+        if not profile_form.is_valid() or not address_form.is_valid():
+            messages = [error for form in (profile_form, address_form) for field_errors in form.errors.values()
+                for error in field_errors]
+            errors.append('Line {0}: {1}'.format(line, ' '.join(messages)))
+            continue
+        if email in seen:
+            errors.append('Line {0}: {1} appears more than once.'.format(line, email))
+            continue
+        if password is not None and max_passwords is not None and num_passwords >= max_passwords:
+            errors.append('Line {0}: Only {1} passwords can be set at once.  Leave the password blank to invite '
+                '{2} to choose one.'.format(line, max_passwords, email))
+            continue
+        num_passwords += password is not None
+        seen.add(email)
+        volunteers.append({'line': line, 'email': email, 'password': password, 'profile': profile_form.cleaned_data,
+            'address': address_form.cleaned_data})
+
+    # One query finds every e-mail address that is already registered
+    registered = set(TcsUser.objects.filter(email__in=seen).values_list('email', flat=True))
+    for volunteer in volunteers:
+        if volunteer['email'] in registered:
+            errors.append('Line {0}: {1} is already registered.'.format(volunteer['line'], volunteer['email']))
+    return [volunteer for volunteer in volunteers if volunteer['email'] not in registered], errors
+
+def hashPasswords(passwords, processes=None):
+    """
+    Return a list of password hashes for a list of passwords.  None becomes an unusable password.
+    Usable passwords are hashed by a pool of 'processes' processes (default: one per CPU).
+    """
+    usable = [password for password in passwords if password is not None]
+    if len(usable) < PARALLEL_THRESHOLD or processes == 1:
+        hashes = map(make_password, usable)
+    else:
+        pool = Pool(processes)
+        try:
+            hashes = pool.map(make_password, usable)
+        finally:
+            pool.close()
+            pool.join()
+    hashes = iter(hashes)
+    return [next(hashes) if password is not None else make_password(None) for password in passwords]
+
+def getAddressIds(addresses):
+    """
+    Return a list of Address primary keys for a list of AddressForm cleaned data, creating the
+    addresses that do not exist yet, like AddressForm.get_or_create, in three queries.
+    """
+    fields = ('street', 'city', 'state', 'country', 'postal_code')
+    keys = [tuple(unicode(address[field]) for field in fields) for address in addresses]
+
+    def existing():
+        candidates = Address.objects.filter(street__in=set(key[0] for key in keys),
+            postal_code__in=set(key[4] for key in keys)).order_by('pk').values_list('pk', *fields)
+        ids = {}
+        for row in candidates:
+            ids.setdefault(tuple(unicode(value) for value in row[1:]), row[0])
+        return ids
+
+    ids = existing()
+    new = dict((key, address) for key, address in zip(keys, addresses) if key not in ids)
+    if new:
+        Address.objects.bulk_create([Address(**dict((field, address[field]) for field in fields))
+            for address in new.values()])
+        ids = existing()    # bulk_create does not set primary keys on every database
+    return [ids[key] for key in keys]
+
+def getActivationMessage(email, has_password):
+    """Return the tuple (subject, body) of the message inviting a volunteer to activate an account."""
+    # Test server; for development only.  For production, use settings.ALLOWED_HOSTS.
+    if has_password:
+        return 'Activate your account', 'http://localhost:8000' + reverse('tcsuser_activate',
+            args=(TimestampSigner().sign(email),))
+    return ('You are invited to volunteer',
+        'Choose a passphrase to activate your account: http://localhost:8000' + reverse('tcsuser_invite',
+        args=(TimestampSigner(salt=INVITE_SALT).sign(email),)))
+
+def onboardVolunteers(campaign, volunteers, processes=None, errors=None):
+    """
+    Create users, profiles, and addresses for volunteers from parseVolunteers, add them to the workers
+    of 'campaign', and queue their activation or invitation messages.  Return the number of users.
+
+    An e-mail address may be registered by someone else after parseVolunteers checked it.  Then the
+    volunteers whose addresses are now registered are skipped, and an error naming each one's line is
+    appended to the list 'errors', if given.
+    """
+    hashes = hashPasswords([volunteer['password'] for volunteer in volunteers], processes)
+    while volunteers:
+        try:
+            createVolunteers(campaign, volunteers, hashes)
+            return len(volunteers)
+        except IntegrityError:
+            registered = set(TcsUser.objects.filter(email__in=[volunteer['email'] for volunteer in volunteers])
+                .values_list('email', flat=True))
+            if not registered:
+                raise
+        remaining = []
+        for volunteer, password_hash in zip(volunteers, hashes):
+            if volunteer['email'] not in registered:
+                remaining.append((volunteer, password_hash))
+            elif errors is not None:
+                errors.append('Line {0}: {1} is already registered.'.format(volunteer['line'], volunteer['email']))
+        volunteers = [volunteer for volunteer, password_hash in remaining]
+        hashes = [password_hash for volunteer, password_hash in remaining]
+    return 0
+
+def createVolunteers(campaign, volunteers, hashes):
+    """Do the work of onboardVolunteers in one transaction, given the password hashes of the volunteers."""
+    emails = [volunteer['email'] for volunteer in volunteers]
+    with transaction.atomic():
+        address_ids = getAddressIds([volunteer['address'] for volunteer in volunteers])
+        TcsUser.objects.bulk_create([TcsUser(email=email, password=password_hash)
+            for email, password_hash in zip(emails, hashes)])
+        user_ids = dict(TcsUser.objects.filter(email__in=emails).values_list('email', 'pk'))
+        TcsUserProfile.objects.bulk_create([TcsUserProfile(user_id=user_ids[volunteer['email']], address_id=address_id,
+            **dict((field, volunteer['profile'][field]) for field in ('name', 'phone_number', 'gender')))
+            for volunteer, address_id in zip(volunteers, address_ids)])
+        campaign.workers.add(*user_ids.values())
+        messages = []
+        for volunteer in volunteers:
+            subject, body = getActivationMessage(volunteer['email'], volunteer['password'] is not None)
+            messages.append(OutgoingEmail(subject=subject, body=body, to=volunteer['email'],
+                from_email=settings.DEFAULT_FROM_EMAIL, send_after=datetime.now()))
+        OutgoingEmail.objects.bulk_create(messages)
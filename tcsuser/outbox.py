@@ -0,0 +1,90 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+An outbox for e-mail.  Connecting to an SMTP server, negotiating TLS, and authenticating takes
+far longer than handling a request, so requests only add rows to the OutgoingEmail table, in the
+same transaction as the data that caused the e-mail.  A worker, the sendemails management command,
+drains the table over one SMTP connection that is reused for every message in a batch.  A message
+that fails is retried after a delay that doubles with each attempt.
+
+Run one worker at a time.  Two workers could send the same message twice.
+"""
+
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from smtplib import SMTPException, SMTPServerDisconnected
+from socket import error as socket_error
+from tcsuser.models import OutgoingEmail
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 6
+RETRY_DELAY = 30    # Seconds before the first retry.  Later retries wait 60, 120, 240, and 480 seconds.
+
+def enqueueEmail(subject, body, to, from_email=None):
+    """Add a message to the outbox and return the OutgoingEmail instance.  'to' is one address."""
+    return OutgoingEmail.objects.create(subject=subject, body=body, to=to,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL, send_after=datetime.now())
+
+def sendQueuedEmails(batch_size=BATCH_SIZE, max_attempts=MAX_ATTEMPTS):
+    """
+    Send every message that is due, in batches of 'batch_size'.  Each batch reuses one connection
+    to the e-mail backend.  Return the tuple (number sent, number failed).  A message that has failed
+    'max_attempts' times is not tried again.
+    """
+    sent = failed = 0
+    started = datetime.now()
+    last_pk = 0
+    while True:
+        # Messages postponed during this call have send_after > started, so each is tried once per call
+        batch = list(OutgoingEmail.objects.filter(sent_on=None, send_after__lte=started, attempts__lt=max_attempts,
+            pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            return sent, failed
+        last_pk = batch[-1].pk
+        batch_sent, batch_failed = sendBatch(batch)
+        sent += batch_sent
+        failed += batch_failed
+
+def sendBatch(batch):
+    """Send a list of OutgoingEmail instances over one connection.  Return (number sent, number failed)."""
+    connection = get_connection()
+    delivered = []
+    errors = {}     # Error message -> list of OutgoingEmail instances
+    try:
+        connection.open()
+    except (SMTPException, socket_error) as e:
+        errors[str(e) or e.__class__.__name__] = batch
+        batch = []
+    for outgoing in batch:
+        message = EmailMessage(outgoing.subject, outgoing.body, outgoing.from_email, [outgoing.to],
+            connection=connection)
+        try:
+            try:
+                message.send()
+            except SMTPServerDisconnected:
+                # The server may close idle or long-lived connections; reconnect once
+                connection.close()
+                connection.open()
+                message.send()
+            delivered.append(outgoing.pk)
+        except (SMTPException, socket_error) as e:
+            errors.setdefault(str(e) or e.__class__.__name__, []).append(outgoing)
+    try:
+        connection.close()
+    except (SMTPException, socket_error):
+        pass
+
+    OutgoingEmail.objects.filter(pk__in=delivered).update(sent_on=datetime.now(), attempts=F('attempts') + 1)
+    for error, failures in errors.items():
+        # Messages in a batch usually fail together, so group them by error and attempt count
+        for attempts in set(outgoing.attempts for outgoing in failures):
+            OutgoingEmail.objects.filter(pk__in=[outgoing.pk for outgoing in failures if outgoing.attempts == attempts]
+                ).update(attempts=attempts + 1, last_error=error[:200],
+                send_after=datetime.now() + timedelta(seconds=RETRY_DELAY * 2 ** attempts))
+    return len(delivered), sum(len(failures) for failures in errors.values())
@@ -7,14 +7,23 @@ the author's qualifications.  No other uses are permitted.
 
 from address.forms import AddressForm
 from address.models import Address
+from campaign.models import Campaign
 from django.conf import settings
+from django.contrib.auth.hashers import check_password, is_password_usable
 from django.core import mail
 from django.core.signing import TimestampSigner
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 from django.test.client import Client
+from django.test.utils import override_settings
 from tcsuser.forms import TcsUserCreationForm, TcsUserProfileForm
-from tcsuser.models import TcsUser, TcsUserProfile
+from tcsuser.models import OutgoingEmail, TcsUser, TcsUserProfile
+from tcsuser.onboarding import INVITE_SALT, hashPasswords, onboardVolunteers, parseVolunteers
+from tcsuser.outbox import enqueueEmail, sendQueuedEmails
+from StringIO import StringIO
+import asyncore
+import smtpd
+import threading
 
 def setUserData(obj):
     """
@@ -49,7 +58,9 @@ class TcsUserTests(TestCase):
         user = TcsUser.objects.create_user(self.user_data['email'], self.user_data['password'])
         self.assertFalse(user.is_active) # The new registrant is inactivate
         usercode = TimestampSigner().sign(user.email)
-        # User creation should trigger sending an activation e-mail via a listener
+        # User creation should trigger queueing an activation e-mail via a listener
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(sendQueuedEmails(), (1, 0))
         self.checkMail()
 
         # This GET request should activate the new TcsUser instance.
@@ -57,6 +68,160 @@ class TcsUserTests(TestCase):
         user = TcsUser.objects.get(pk=user.id)  # Syncronize the variable with the database
         self.assertTrue(user.is_active)
 
+class RecordingSMTPServer(smtpd.SMTPServer):
+    """A local SMTP server that records the messages it receives and the connections it accepts."""
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.connections = 0
+        self.messages = []
+        self.refuse = set()     # Recipients to refuse
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        if self.refuse.intersection(rcpttos):
+            return '550 No such user'
+        self.messages.append((rcpttos, data))
+
+class OutboxTests(TestCase):
+    """Tests for tcsuser.outbox against a local SMTP server."""
+
+    def setUp(self):
+        self.server = RecordingSMTPServer()
+        thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.05, 'map': asyncore.socket_map})
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.close)
+        settings_override = override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.server.port, EMAIL_HOST_USER='', EMAIL_USE_TLS=False)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def testBatchesAndRetries(self):
+        """Each batch should use one connection, and failed messages should be retried later."""
+        for i in range(5):
+            enqueueEmail('Message {0}'.format(i), 'Hello', 'volunteer{0}@tcs.com'.format(i))
+        self.server.refuse.add('volunteer4@tcs.com')
+        self.assertEqual(sendQueuedEmails(batch_size=2), (4, 1))
+        self.assertEqual(self.server.connections, 3)
+        self.assertEqual(len(self.server.messages), 4)
+        self.assertEqual(OutgoingEmail.objects.filter(sent_on=None).count(), 1)
+
+        # The failed message waits before it is tried again
+        self.assertEqual(sendQueuedEmails(), (0, 0))
+        failed = OutgoingEmail.objects.get(sent_on=None)
+        self.assertEqual(failed.attempts, 1)
+        self.assertIn('No such user', failed.last_error)
+        OutgoingEmail.objects.filter(pk=failed.pk).update(send_after=failed.created_on)
+        self.server.refuse.clear()
+        self.assertEqual(sendQueuedEmails(), (1, 0))
+        self.assertFalse(OutgoingEmail.objects.filter(sent_on=None).exists())
+
+    def testRegistrationDoesNotConnect(self):
+        """Creating a user should only queue the activation e-mail."""
+        TcsUser.objects.create_user('test@tcs.com', 'Pa33word44')
+        self.assertEqual(self.server.connections, 0)
+        self.assertEqual(OutgoingEmail.objects.get().to, 'test@tcs.com')
+
+class OnboardingTests(TestCase):
+    """Tests for tcsuser.onboarding."""
+
+    def setUp(self):
+        setUserData(self)
+        self.owner = TcsUser.objects.create_user(self.user_data['email'], self.user_data['password'])
+        self.address = Address.objects.create(street='217 Tyne Rd', city='Louisville', state='KY', country='US',
+            postal_code='40207')
+        self.campaign = Campaign.objects.create(owner=self.owner, address=self.address, name='Sprout for Mayor')
+        OutgoingEmail.objects.all().delete()
+
+    def getCSV(self):
+        return StringIO('\n'.join([
+            'email,name,phone_number,gender,street,city,state,country,postal_code,password',
+            'one@tcs.com,Volunteer One,123-456-7890,F,217 Tyne Road,louisville,KY,,40207,Pa33word44',
+            'two@tcs.com,Volunteer Two,123-456-7890,M,1 Main Street,Louisville,KY,US,40202,',
+            'one@TCS.com,Duplicate,123-456-7890,F,217 Tyne Road,Louisville,KY,,40207,',
+            'test@tcs.com,Registered,123-456-7890,F,217 Tyne Road,Louisville,KY,,40207,',
+            'three@tcs.com,Weak Password,123-456-7890,F,217 Tyne Road,Louisville,KY,,40207,password',
+            'four@tcs.com,Bad State,123-456-7890,F,217 Tyne Road,Louisville,ZZ,,40207,',
+        ]))
+
+    def testParseVolunteers(self):
+        """Invalid, duplicate, and already registered rows should be rejected with their line numbers."""
+        volunteers, errors = parseVolunteers(self.getCSV(), 'US')
+        self.assertEqual([volunteer['email'] for volunteer in volunteers], ['one@tcs.com', 'two@tcs.com'])
+        self.assertEqual([error.split(':')[0] for error in errors], ['Line 4', 'Line 6', 'Line 7', 'Line 5'])
+        self.assertEqual(volunteers[0]['address']['street'], '217 Tyne Rd')
+        self.assertIsNone(volunteers[1]['password'])
+        self.assertEqual(parseVolunteers(StringIO('email,name\n'))[1][0][:15], 'Missing columns')
+        volunteers, errors = parseVolunteers(self.getCSV(), 'US', max_passwords=0)
+        self.assertEqual([volunteer['password'] for volunteer in volunteers], [None, None])  # Line 4 is kept
+        self.assertEqual(errors[0][:39], 'Line 2: Only 0 passwords can be set at ')
+        latin1 = self.getCSV().getvalue().replace('Volunteer Two', u'Volunt\xe4r Two'.encode('latin-1'))
+        volunteers, errors = parseVolunteers(StringIO(latin1), 'US')
+        self.assertEqual(errors[0], 'Line 3: not UTF-8.  Save the file as CSV UTF-8 and upload it again.')
+        self.assertEqual(len(volunteers), 1)
+
+    def testOnboardVolunteers(self):
+        """Volunteers should become inactive workers with profiles, and each should be sent one message."""
+        volunteers, errors = parseVolunteers(self.getCSV(), 'US')
+        self.assertEqual(onboardVolunteers(self.campaign, volunteers, processes=1), 2)
+        one, two = TcsUser.objects.get(email='one@tcs.com'), TcsUser.objects.get(email='two@tcs.com')
+        self.assertFalse(one.is_active or two.is_active)
+        self.assertTrue(one.check_password('Pa33word44'))
+        self.assertFalse(two.has_usable_password())
+        self.assertEqual(set(self.campaign.workers.all()), set([one, two]))
+        self.assertEqual(one.profile.address, self.address)  # Not duplicated
+        self.assertEqual(Address.objects.count(), 2)
+        self.assertEqual(two.profile.name, 'Volunteer Two')
+        self.assertIn('activate', OutgoingEmail.objects.get(to='one@tcs.com').body)
+        self.assertIn('invite', OutgoingEmail.objects.get(to='two@tcs.com').body)
+
+    def testConcurrentRegistration(self):
+        """A volunteer registered after parseVolunteers checked the file should be reported, not fail the rest."""
+        volunteers, errors = parseVolunteers(self.getCSV(), 'US')
+        TcsUser.objects.create_user('two@tcs.com', 'Pa33word44')
+        self.assertEqual(onboardVolunteers(self.campaign, volunteers, processes=1, errors=errors), 1)
+        self.assertEqual(errors[-1], 'Line 3: two@tcs.com is already registered.')
+        self.assertEqual(list(self.campaign.workers.values_list('email', flat=True)), ['one@tcs.com'])
+        self.assertEqual(OutgoingEmail.objects.filter(to='two@tcs.com').count(), 1)     # Sent by create_user
+
+    def testInvitation(self):
+        """Choosing a passphrase should activate an invited volunteer."""
+        volunteers, errors = parseVolunteers(self.getCSV(), 'US')
+        onboardVolunteers(self.campaign, volunteers, processes=1)
+        # An activation link is not an invitation, and an invitation is not an activation link
+        response = Client().get(reverse('tcsuser_invite', args=(TimestampSigner().sign('two@tcs.com'),)))
+        self.assertEqual(response.content, 'Invalid invitation link.')
+        usercode = TimestampSigner(salt=INVITE_SALT).sign('two@tcs.com')
+        response = Client().get(reverse('tcsuser_activate', args=(usercode,)))
+        self.assertEqual(response.content, 'Invalid activation link.')
+        self.assertFalse(TcsUser.objects.get(email='two@tcs.com').is_active)
+
+        url = reverse('tcsuser_invite', args=(usercode,))
+        response = Client().post(url, {'password': 'short', 'password2': 'short'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(TcsUser.objects.get(email='two@tcs.com').is_active)
+        response = Client().post(url, {'password': 'Pa33word44', 'password2': 'Pa33word44'})
+        self.assertRedirects(response, reverse('login'))
+        user = TcsUser.objects.get(email='two@tcs.com')
+        self.assertTrue(user.is_active)
+        self.assertTrue(user.check_password('Pa33word44'))
+        user.delete()
+        self.assertEqual(Client().get(url).content, 'Invalid invitation link.')
+
+    def testHashPasswords(self):
+        """Passwords hashed by a pool should match the passwords."""
+        passwords = ['Pa33word{0:02}'.format(i) for i in range(8)] + [None]
+        hashes = hashPasswords(passwords, processes=2)
+        self.assertEqual(len(hashes), 9)
+        self.assertTrue(all(check_password(password, password_hash)
+            for password, password_hash in zip(passwords[:8], hashes)))
+        self.assertFalse(is_password_usable(hashes[8]))
+
 class TcsUserCreationFormTests(TestCase):
     """This primarily tests e-mail and password validation."""
 
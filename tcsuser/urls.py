@@ -11,5 +11,6 @@ from . import views
 urlpatterns = [
     url(r'^activate/(\S+)/$', views.tcsuserActivate, name='tcsuser_activate'),
     url(r'^edit/$', views.tcsuserEdit, name='tcsuser_edit'),
+    url(r'^invite/(\S+)/$', views.tcsuserInvite, name='tcsuser_invite'),
     url(r'^register/$', views.tcsuserRegister, name='tcsuser_register'),
 ]
@@ -13,8 +13,9 @@ from django.core.signing import BadSignature, SignatureExpired, TimestampSigner
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render
-from tcsuser.forms import TcsUserCreationForm, TcsUserProfileForm, TermsOfServiceForm
+from tcsuser.forms import PassphraseForm, TcsUserCreationForm, TcsUserProfileForm, TermsOfServiceForm
 from tcsuser.models import TcsUserProfile
+from tcsuser.onboarding import INVITE_SALT
 
 def tcsuserActivate(request, usercode):
     """
@@ -34,6 +35,32 @@ def tcsuserActivate(request, usercode):
     messages.success(request, "Thank you for activating your account.")
     return HttpResponseRedirect(reverse('login'))
 
+def tcsuserInvite(request, usercode):
+    """
+    Let a volunteer onboarded in bulk by a campaign choose a passphrase, which activates the account.
+    "usercode" is an e-mail address signed with a TimestampSigner salted with INVITE_SALT, valid for 7 days.  See
+    tcsuser.onboarding.
+    """
+    try:
+        name = TimestampSigner(salt=INVITE_SALT).unsign(usercode, max_age=604800) # 7 days
+    except SignatureExpired:
+        return HttpResponse("The invitation expired.")
+    except BadSignature:
+        return HttpResponse("Invalid invitation link.")
+    user = get_user_model().objects.filter(email=name).first()
+    if user is None:    # Deleted since the invitation was sent
+        return HttpResponse("Invalid invitation link.")
+    if user.has_usable_password():
+        return HttpResponse("You already accepted the invitation.")
+    form = PassphraseForm(request.POST or None)
+    if form.is_valid():
+        user.set_password(form.cleaned_data['password'])
+        user.is_active = True
+        user.save()
+        messages.success(request, "Thank you for activating your account.")
+        return HttpResponseRedirect(reverse('login'))
+    return render(request, 'tcsuser/invite.html', {'form': form, 'usercode': usercode})
+
 @login_required
 def tcsuserEdit(request):
     """Edit the logged-in user's profile."""
@@ -0,0 +1,108 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Versioned caching of API list responses.  A version is the time at which some data last changed.
+Listeners call bumpVersions when the data behind a cached response changes, and CachedListMixin
+includes the relevant versions in every cache key and ETag.  Stale entries are never read again and
+simply expire.
+
+Templates cache their expensive fragments the same way: a view passes getFragmentVersion(...) to the
+template, which includes it in the {% cache %} tag's key.  Data changed too often to bump a version on
+every change can be marked instead by a cheap value read at render time, such as the newest primary key.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from hashlib import md5
+import time
+
+VERSION_PREFIX = 'version_'
+
+# Versions of the data behind the dashboard pages.  Format each with the primary key of a campaign or user.
+ROSTER_VERSION = 'roster_{0}'               # A campaign's workers and prospects, and their profiles
+CONTACTS_VERSION = 'contacts_{0}'           # The voter contacts related to a campaign
+USER_CONTACTS_VERSION = 'contacts_user_{0}' # The voter contacts a user made
+VOTERS_VERSION = 'voters_{0}'               # A campaign's voter lists and constituents
+
+def getCache():
+    return caches[getattr(settings, 'API_RESPONSE_CACHE', 'default')]
+
+def bumpVersions(*names):
+    """Record that the data identified by each name changed now."""
+    now = time.time()
+    getCache().set_many(dict((VERSION_PREFIX + name, now) for name in names), None)
+
+def getVersions(*names):
+    """
+    Return a list of the versions for the given names.  A version missing from the cache, because
+    it has never been bumped or because it was culled, is set to the current time.  That invalidates
+    any response cached with the old version, which is always safe.
+    """
+    cache = getCache()
+    keys = [VERSION_PREFIX + name for name in names]
+    versions = cache.get_many(keys)
+    now = time.time()
+    for key in keys:
+        if key not in versions:
+            cache.add(key, now, None)
+            versions[key] = cache.get(key, now)
+    return [versions[key] for key in keys]
+
+def getFragmentVersion(*names, **kwargs):
+    """
+    Return a short string that changes whenever any of the named versions is bumped, or any of the values
+    in the keyword argument 'marks' changes.
+    """
+    return md5('|'.join(repr(version) for version in getVersions(*names) + list(kwargs.get('marks', ())))
+        ).hexdigest()[:12]
+
+class CachedListMixin(object):
+    """
+    A mixin for read-only ModelResource list endpoints.  List responses are cached by user-independent
+    variant (for example, country) and by the versions of the data they depend on.  Responses carry
+    ETag and Last-Modified headers, and a conditional GET with a current ETag receives a 304 response
+    without evaluating the queryset or running the serializer.
+
+    Subclasses implement getCacheVariant and getCacheVersionNames.  List it before ModelResource:
+        class IssueResource(CachedListMixin, ModelResource):
+    """
+    response_cache_timeout = 86400  # 1 day in seconds
+
+    def getCacheVariant(self, request):
+        """Return a string identifying everything other than data versions that affects the response."""
+        raise NotImplementedError()
+
+    def getCacheVersionNames(self, request):
+        """Return a list of names of versions on which the response depends."""
+        raise NotImplementedError()
+
+    def get_list(self, request, **kwargs):
+        """Serve the list from the response cache, or answer a conditional GET with 304 Not Modified."""
+        versions = getVersions(*self.getCacheVersionNames(request))
+        key = md5('|'.join([self._meta.resource_name, self.getCacheVariant(request), request.GET.urlencode()] +
+            [repr(version) for version in versions])).hexdigest()
+        etag = quote_etag(key)
+        last_modified = int(max(versions))
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            cache = getCache()
+            cached = cache.get('response_' + key)
+            if cached is None:
+                response = super(CachedListMixin, self).get_list(request, **kwargs)
+                if response.status_code == 200:
+                    cache.set('response_' + key, (response.content, response['Content-Type']), self.response_cache_timeout)
+            else:
+                response = HttpResponse(cached[0], content_type=cached[1])
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        # Clients may store the response but must revalidate it, which costs the server very little
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,239 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+A repeatable benchmark suite for the hot paths of the application.  Run it against data from
+tcswebapp.synthetic with "python manage.py benchmark", which writes the results as JSON so that runs
+on different commits can be compared with --compare.
+
+Every iteration runs in a transaction that is rolled back, so each iteration sees the same data and
+the database is unchanged afterwards.  Requests go through the test client and the full middleware
+stack, with throttling disabled.  Each benchmark records the wall time of every iteration and the
+number of queries of the last one.  Compare runs made with the same DEBUG setting.
+
+The dashboard pages are measured twice: as usual, with their cached fragments, and "cold", after
+emptying the fragment cache, as after the data behind them changes.
+"""
+
+from campaign.models import Campaign
+from datetime import date, datetime
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from tcswebapp.synthetic import SYNTHETIC_DOMAIN
+from timeit import default_timer
+from voter.models import ContactMethod, Voter, VoterContact, VoterList
+import json
+import os
+import subprocess
+import tempfile
+
+class Rollback(Exception):
+    pass
+
+class BenchmarkContext(object):
+    """The campaign, users, and clients shared by the benchmarks."""
+    def __init__(self, campaign_id=None, list_size=200):
+        campaigns = Campaign.objects.filter(is_active=True, owner__email__endswith='@' + SYNTHETIC_DOMAIN)
+        if campaign_id:
+            campaigns = campaigns.filter(pk=campaign_id)
+        self.campaign = campaigns.order_by('pk').first()
+        if self.campaign is None:
+            raise ValueError('There is no synthetic campaign.  Run "python manage.py generatedata" first.')
+        self.owner = self.campaign.owner
+        self.worker = self.campaign.workers.order_by('pk').first() or self.owner
+        self.owner_client = Client()
+        self.owner_client.force_login(self.owner)
+        self.worker_client = Client()
+        self.worker_client.force_login(self.worker)
+        self.method = ContactMethod.objects.order_by('pk').first()
+        self.voter_ids = list(self.campaign.voters.order_by('pk').values_list('pk', flat=True)[:20])
+        self.search_text = self.campaign.name.split()[0]
+        self.list_path = self.writeVoterList(list_size)
+
+    def writeVoterList(self, size):
+        """
+        Write a tab-separated voter list of 'size' rows in the upload format: half of the voters are
+        already constituents of the campaign and half are new.
+        """
+        existing = self.campaign.voters.select_related('address').order_by('pk')[:size // 2]
+        rows = [(voter.first_name, voter.last_name, voter.registrar_id, voter.address.street, voter.address.city,
+            voter.address.state, voter.address.postal_code) for voter in existing]
+        rows += [('New', 'Voter{0}'.format(i), 'NEW{0:010}'.format(i), '{0} Main Str'.format(i + 1), 'Columbus',
+            'OH', '43215') for i in range(size - len(rows))]
+        # Uploaded lists are read from a path relative to the working directory; see VoterList.file_name
+        if not os.path.exists(settings.VOTER_LISTS_ROOT):
+            os.makedirs(settings.VOTER_LISTS_ROOT)
+        f = tempfile.NamedTemporaryFile(dir=settings.VOTER_LISTS_ROOT, prefix='benchmark', suffix='.tsv', delete=False)
+        f.write('first_name\tlast_name\tdob\tgender\taffiliation\tregistration_date\tregistrar_id\tphone_number1\t'
+            'phone_number2\temail\tstreet\tcity\tstate\tcountry\tpostal_code\n')
+        for first_name, last_name, registrar_id, street, city, state, postal_code in rows:
+            f.write('\t'.join([first_name, last_name, '1970-01-01', 'F', '', '2000-01-01', registrar_id, '3175550100',
+                '', '', street, city, state, 'US', postal_code]).encode('utf-8') + '\n')
+        f.close()
+        return os.path.relpath(f.name)
+
+    def close(self):
+        os.remove(self.list_path)
+
+def checkStatus(response, expected):
+    if response.status_code != expected:
+        raise AssertionError('Expected status {0}, received {1}: {2}'.format(expected, response.status_code,
+            response.content[:200]))
+
+def benchProcessVoterList(context):
+    """Upload a voter list, which runs voter.signals.processVoterList."""
+    voter_list = VoterList.objects.create(campaign=context.campaign, dump_date=date.today(), file_name=context.list_path)
+    if not voter_list.is_active:
+        raise AssertionError(voter_list.processed)
+
+def benchVoterApiGet(context):
+    """A worker requests voters to dial."""
+    checkStatus(context.worker_client.get('/api/v1/voter/', {'campaign_id': context.campaign.pk}), 200)
+
+def benchVoterContactPatch(context):
+    """A worker uploads 20 intelligence reports."""
+    objects = [{'method': context.method.pk, 'voter': pk, 'intelligence_report': {'1': 'support'}}
+        for pk in context.voter_ids]
+    checkStatus(context.worker_client.patch('/api/v1/votercontact/', json.dumps({'objects': objects}),
+        content_type='application/json'), 202)
+
+def benchHome(context):
+    """The owner views the dashboard."""
+    checkStatus(context.owner_client.get('/home/'), 200)
+
+def benchCampaignManage(context):
+    """The owner views the campaign's volunteers."""
+    checkStatus(context.owner_client.get('/campaign/{0}/manage/'.format(context.campaign.pk)), 200)
+
+def benchVoterLists(context):
+    """The owner views the campaign's voter lists."""
+    checkStatus(context.owner_client.get('/voter/manage/'), 200)
+
+def clearFragments(function):
+    """Return a benchmark that empties the template fragment cache before calling 'function'."""
+    def benchCold(context):
+        caches['template_fragments'].clear()
+        function(context)
+    return benchCold
+
+def benchCampaignSearch(context):
+    """A prospective volunteer searches campaigns by name."""
+    checkStatus(context.worker_client.post('/campaign/', {'name': context.search_text}), 200)
+
+BENCHMARKS = (
+    ('process_voter_list', benchProcessVoterList),
+    ('voter_api_get', benchVoterApiGet),
+    ('votercontact_patch', benchVoterContactPatch),
+    ('home', benchHome),
+    ('home_cold', clearFragments(benchHome)),
+    ('campaign_manage', benchCampaignManage),
+    ('campaign_manage_cold', clearFragments(benchCampaignManage)),
+    ('voter_lists', benchVoterLists),
+    ('voter_lists_cold', clearFragments(benchVoterLists)),
+    ('campaign_search', benchCampaignSearch),
+)
+
+def summarize(seconds):
+    """Return statistics in milliseconds for a list of durations in seconds."""
+    milliseconds = sorted(second * 1000 for second in seconds)
+    n = len(milliseconds)
+    return {
+        'iterations': n,
+        'min_ms': round(milliseconds[0], 2),
+        'median_ms': round(milliseconds[n // 2] if n % 2 else (milliseconds[n // 2 - 1] + milliseconds[n // 2]) / 2, 2),
+        'mean_ms': round(sum(milliseconds) / n, 2),
+        'p95_ms': round(milliseconds[min(n - 1, int(n * 0.95))], 2),
+        'max_ms': round(milliseconds[-1], 2),
+    }
+
+def runIteration(function, context, capture=False):
+    """Run one iteration in a transaction that is rolled back.  Return (seconds, number of queries)."""
+    queries = None
+    try:
+        with transaction.atomic():
+            if capture:
+                with CaptureQueriesContext(connection) as captured:
+                    start = default_timer()
+                    function(context)
+                    elapsed = default_timer() - start
+                # The query log holds at most 9000 queries; beyond that the count is unknown
+                queries = len(captured) if len(captured) < connection.queries_log.maxlen else None
+            else:
+                start = default_timer()
+                function(context)
+                elapsed = default_timer() - start
+            raise Rollback()
+    except Rollback:
+        pass
+    return elapsed, queries
+
+def runBenchmarks(context, repeat=10, warmup=1, names=None, log=None):
+    """Return a dictionary mapping the name of each benchmark to its statistics.  See summarize."""
+    log = log or (lambda message: None)
+    results = {}
+    with override_settings(ALLOWED_HOSTS=['testserver'], API_THROTTLE_RATES=settings.UNTHROTTLED_RATES,
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'):
+        # Store the versions that key the cached fragments.  Versions first stored within an iteration
+        # would be rolled back, and every iteration would render the fragments again.
+        for function in (benchHome, benchCampaignManage, benchVoterLists):
+            function(context)
+        for name, function in BENCHMARKS:
+            if names and name not in names:
+                continue
+            for i in range(warmup):
+                runIteration(function, context)
+            seconds = [runIteration(function, context)[0] for i in range(repeat - 1)]
+            elapsed, queries = runIteration(function, context, capture=True)
+            results[name] = dict(summarize(seconds + [elapsed]), queries=queries)
+            log('{0:<20}{1[median_ms]:>10.1f} ms median{1[p95_ms]:>10.1f} ms p95{1[queries]:>6} queries'.format(
+                name, results[name]))
+    return results
+
+def getRevision():
+    """Return the current git commit, or None if it cannot be determined."""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+            stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def getScale(campaign):
+    """Return the amount of data behind the benchmarks, so that results are compared at equal scale."""
+    return {
+        'voters': Voter.objects.count(),
+        'campaign_voters': campaign.voters.count(),
+        'campaign_workers': campaign.workers.count(),
+        'campaigns': Campaign.objects.count(),
+        'contacts': VoterContact.objects.count(),
+    }
+
+def compareResults(previous, current):
+    """Return a list of lines comparing the median time and queries of each benchmark in two results."""
+    lines = ['{0:<20}{1:>12}{2:>12}{3:>9}{4:>10}'.format('Benchmark', 'Before ms', 'After ms', 'Change', 'Queries')]
+    for name in sorted(current['benchmarks']):
+        after = current['benchmarks'][name]
+        before = previous.get('benchmarks', {}).get(name)
+        if before is None:
+            lines.append('{0:<20}{1:>12}{2:>12.1f}{3:>9}{4:>10}'.format(name, '-', after['median_ms'], '-',
+                after['queries']))
+            continue
+        change = (after['median_ms'] - before['median_ms']) / before['median_ms'] * 100 if before['median_ms'] else 0
+        lines.append('{0:<20}{1:>12.1f}{2:>12.1f}{3:>+8.0f}%{4:>5} -> {5}'.format(name, before['median_ms'],
+            after['median_ms'], change, before['queries'], after['queries']))
+    return lines
+
+def getReport(context, results):
+    return {
+        'revision': getRevision(),
+        'timestamp': datetime.now().isoformat(),
+        'database': connection.vendor,
+        'debug': settings.DEBUG,   # DEBUG logs every query, which slows the benchmarks
+        'scale': getScale(context.campaign),
+        'benchmarks': results,
+    }
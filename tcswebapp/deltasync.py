@@ -0,0 +1,73 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Delta synchronization of small tables that clients keep a copy of, such as issues.  A client sends
+the version of its copy to <resource>/changes/?since=<version> and receives only the rows changed
+since then, or 304 Not Modified if nothing changed.  Versions are kept by voter.models.SyncedModel.
+
+The response has the form {"version": 12, "full": false, "objects": [...], "deleted": [3, 7]}.
+'objects' are the changed rows the user may read, in the format of the resource's list, and 'deleted'
+are the IDs of changed rows the user may no longer read, such as deactivated issues.  If 'full' is
+true, the client should replace its copy with 'objects'.  That happens when the client sends no
+version, when rows have been deleted since its version, and when its version is unknown to the server.
+"""
+
+from django.conf.urls import url
+from django.utils.cache import patch_cache_control
+from tastypie import http
+from tastypie.exceptions import BadRequest, ImmediateHttpResponse
+from tastypie.utils import trailing_slash
+
+class DeltaSyncMixin(object):
+    """
+    A mixin for read-only ModelResource endpoints of a SyncedModel.  List it before ModelResource:
+        class ContactMethodResource(DeltaSyncMixin, ModelResource):
+
+    The rows a user may read are the resource's object list filtered by its authorization.  Clients
+    call the changes endpoint far more often than the list, so it has its own throttle,
+    'sync_throttle', instead of the resource's.
+    """
+    sync_throttle = None
+
+    def prepend_urls(self):
+        return [url(r'^(?P<resource_name>{0})/changes{1}$'.format(self._meta.resource_name, trailing_slash()),
+            self.wrap_view('getChanges'), name='api_{0}_changes'.format(self._meta.resource_name))]
+
+    def getChanges(self, request, **kwargs):
+        """Answer a request for the rows changed since the GET parameter 'since'."""
+        self.method_check(request, allowed=['get'])
+        self.is_authenticated(request)
+        if self.sync_throttle and self.sync_throttle.should_be_throttled(
+                self._meta.authentication.get_identifier(request)):
+            raise ImmediateHttpResponse(response=http.HttpTooManyRequests())
+        try:
+            since = int(request.GET['since']) if 'since' in request.GET else None
+        except ValueError:
+            raise BadRequest("Invalid since")
+
+        model = self._meta.object_class
+        # Read the version first.  A row saved meanwhile is sent now and again next time, which is harmless.
+        version, reset_version = model.getSyncVersions()
+        if since == version:
+            return http.HttpNotModified()
+        full = since is None or since < reset_version or since > version
+        bundle = self.build_bundle(request=request)
+        readable = self.authorized_read_list(self.get_object_list(request), bundle)
+        if full:
+            objects, deleted = list(readable), []
+        else:
+            objects = list(readable.filter(version__gt=since))
+            deleted = set(model._default_manager.filter(version__gt=since).values_list('pk', flat=True))
+            deleted.difference_update(obj.pk for obj in objects)
+        response = self.create_response(request, {
+            'version': version,
+            'full': full,
+            'objects': [self.full_dehydrate(self.build_bundle(obj=obj, request=request), for_list=True) for obj in objects],
+            'deleted': sorted(deleted),
+        })
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,48 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from tcswebapp.benchmarks import BENCHMARKS, BenchmarkContext, compareResults, getReport, runBenchmarks
+import json
+
+class Command(BaseCommand):
+    help = ('Time the hot paths of the application against synthetic data and write the results as JSON.  '
+        'Run generatedata first.  See tcswebapp.benchmarks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='benchmark-results.json', help='Results file')
+        parser.add_argument('--compare', help='Results file of an earlier run to compare with')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed iterations per benchmark (default 10)')
+        parser.add_argument('--campaign', type=int, help='Synthetic campaign to use (default: the first)')
+        parser.add_argument('--list-size', type=int, default=200, help='Rows in the uploaded voter list (default 200)')
+        parser.add_argument('--only', action='append', choices=[name for name, function in BENCHMARKS],
+            help='Run only this benchmark; may be repeated')
+
+    def handle(self, *args, **options):
+        previous = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    previous = json.load(f)
+            except (IOError, ValueError) as e:
+                raise CommandError(str(e))
+        try:
+            context = BenchmarkContext(options['campaign'], options['list_size'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        try:
+            results = runBenchmarks(context, max(1, options['repeat']), names=options['only'],
+                log=lambda message: self.stdout.write(message))
+            report = getReport(context, results)
+        finally:
+            context.close()
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        self.stdout.write('Wrote {0}.'.format(options['output']))
+        if previous:
+            for line in compareResults(previous, report):
+                self.stdout.write(line)
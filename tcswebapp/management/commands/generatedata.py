@@ -0,0 +1,33 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django.core.management.base import BaseCommand
+from tcswebapp.synthetic import BATCH_SIZE, SYNTHETIC_DOMAIN, SYNTHETIC_PASSWORD, generateData
+from timeit import default_timer
+
+class Command(BaseCommand):
+    help = ('Add synthetic campaigns, workers, voters, and voter contacts at production scale.  See '
+        'tcswebapp.synthetic.  Use a copy of the development database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaigns', type=int, default=10, help='Campaigns (default 10)')
+        parser.add_argument('--workers', type=int, default=20, help='Workers per campaign (default 20)')
+        parser.add_argument('--voters', type=int, default=100000, help='Voters (default 100000)')
+        parser.add_argument('--contact-rate', type=float, default=0.2,
+            help='Fraction of campaign voters with a voter contact (default 0.2)')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Voters per batch')
+
+    def handle(self, *args, **options):
+        start = default_timer()
+        counts = generateData(options['campaigns'], options['workers'], options['voters'], options['contact_rate'],
+            options['seed'], options['batch_size'], log=lambda message: self.stdout.write(message))
+        self.stdout.write('Added {campaigns} campaigns, {users} users, {addresses} addresses, {voters} voters, '
+            '{campaign_voters} campaign voters, and {contacts} voter contacts'.format(**counts) +
+            ' in {0:.1f} seconds.'.format(default_timer() - start))
+        self.stdout.write('Synthetic users have e-mail addresses ending with @{0} and the password {1}.'.format(
+            SYNTHETIC_DOMAIN, SYNTHETIC_PASSWORD))
@@ -0,0 +1,46 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django.core.management.base import BaseCommand
+from tcswebapp.metrics import getMetrics, resetMetrics
+import json
+
+SORT_KEYS = {
+    'total': 'seconds',
+    'mean': 'mean_ms',
+    'p95': 'p95_ms',
+    'queries': 'queries_per_request',
+    'sql': 'sql_seconds',
+    'count': 'count',
+}
+
+class Command(BaseCommand):
+    help = ('Show the latency, query count, SQL time, and serializer time of every endpoint, merged from every '
+        'server process.  See tcswebapp.metrics.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='total',
+            help='Order endpoints by this column, largest first (default total)')
+        parser.add_argument('--json', action='store_true', help='Print the metrics as JSON')
+        parser.add_argument('--reset', action='store_true', help='Discard the metrics after showing them')
+
+    def handle(self, *args, **options):
+        metrics = getMetrics()
+        if options['json']:
+            self.stdout.write(json.dumps(metrics, indent=2, sort_keys=True))
+        elif not metrics:
+            self.stdout.write('No requests have been recorded.')
+        else:
+            self.stdout.write('{0:<40}{1:>8}{2:>7}{3:>9}{4:>9}{5:>9}{6:>9}{7:>9}{8:>9}{9:>9}'.format('Endpoint',
+                'Requests', 'Errors', 'Total s', 'Mean ms', 'p95 ms', 'p99 ms', 'Queries', 'SQL ms', 'Ser. ms'))
+            key = SORT_KEYS[options['sort']]
+            for endpoint, totals in sorted(metrics.items(), key=lambda item: item[1][key], reverse=True):
+                self.stdout.write('{0:<40}{1[count]:>8}{1[errors]:>7}{1[seconds]:>9.1f}{1[mean_ms]:>9.1f}{1[p95_ms]:>9}'
+                    '{1[p99_ms]:>9}{1[queries_per_request]:>9.1f}{1[sql_ms_per_request]:>9.1f}'
+                    '{1[serializer_ms_per_request]:>9.1f}'.format(endpoint[:39], totals))
+        if options['reset']:
+            resetMetrics()
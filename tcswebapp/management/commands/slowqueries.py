@@ -0,0 +1,60 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from tcswebapp.slowqueries import getSlowQueries, resetSlowQueries
+import json
+
+class Command(BaseCommand):
+    help = ('Show the slow queries captured by every server process, grouped by fingerprint, most total time '
+        'first.  Pass a fingerprint to show the SQL, parameters, and plan of its slowest execution.  Set '
+        'SLOW_QUERY_ENABLED to capture queries.  See tcswebapp.slowqueries.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('fingerprint', nargs='?', help='Show this fingerprint in full')
+        parser.add_argument('--limit', type=int, default=20, help='Show this many fingerprints (default 20)')
+        parser.add_argument('--json', action='store_true', help='Print the captures as JSON')
+        parser.add_argument('--reset', action='store_true', help='Discard the captures after showing them')
+
+    def handle(self, *args, **options):
+        captures = getSlowQueries()
+        if options['fingerprint']:
+            captures = [capture for capture in captures if capture['fingerprint'].startswith(options['fingerprint'])]
+            if not captures:
+                raise CommandError('No captured query has the fingerprint {0}.'.format(options['fingerprint']))
+        else:
+            captures = captures[:options['limit']]
+
+        if options['json']:
+            self.stdout.write(json.dumps(captures, indent=2, sort_keys=True))
+        elif options['fingerprint']:
+            for capture in captures:
+                self.showCapture(capture)
+        elif not captures:
+            self.stdout.write('No slow queries have been captured.')
+        else:
+            self.stdout.write('{0:<14}{1:>7}{2:>9}{3:>9}{4:>9}  {5:<32}{6}'.format('Fingerprint', 'Count', 'Total s',
+                'Mean ms', 'Max ms', 'Endpoint', 'Statement'))
+            for capture in captures:
+                endpoint = max(capture['endpoints'].items(), key=lambda item: item[1])[0]
+                self.stdout.write(u'{0[fingerprint]:<14}{0[count]:>7}{0[total_seconds]:>9.1f}{0[mean_ms]:>9.1f}'
+                    '{1:>9.1f}  {2:<32}{3}'.format(capture, capture['max_seconds'] * 1000, endpoint[:31],
+                    capture['statement'][:80]))
+        if options['reset']:
+            resetSlowQueries()
+
+    def showCapture(self, capture):
+        self.stdout.write(u'Fingerprint {0[fingerprint]}: {0[count]} executions, {0[total_seconds]:.2f} s total, '
+            '{0[mean_ms]} ms mean, {1:.1f} ms max'.format(capture, capture['max_seconds'] * 1000))
+        self.stdout.write('Endpoints: ' + ', '.join('{0} ({1})'.format(endpoint, count)
+            for endpoint, count in sorted(capture['endpoints'].items(), key=lambda item: item[1], reverse=True)))
+        self.stdout.write(u'\nSlowest execution on database "{0[database]}":\n{0[sql]}\nParameters: {0[params]}'.format(
+            capture))
+        self.stdout.write('\nPlan:')
+        for line in capture['plan'] or ['(not explained)']:
+            self.stdout.write('    ' + line)
+        self.stdout.write('')
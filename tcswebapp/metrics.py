@@ -0,0 +1,280 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Per-endpoint request metrics: a latency histogram, database query counts, SQL time, and tastypie
+serializer time for every URL name, and for every resource of the API.  MetricsMiddleware times each
+request, TimedCursorWrapper times each query, and TimedSerializer times each (de)serialization.
+TimedCursorWrapper also passes slow queries to tcswebapp.slowqueries.
+
+Each process adds its requests to totals in memory, which costs a dictionary update per request.
+Every METRICS_FLUSH_SECONDS the process copies its totals to the cache named by METRICS_CACHE, which
+must be shared by every server process.  getMetrics merges the copies of all processes.  View them
+at the internal endpoint /internal/metrics/ (with the shared METRICS_TOKEN) or with
+"python manage.py showmetrics".  Totals of a process that stops expire after SNAPSHOT_TIMEOUT.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+from tastypie.serializers import Serializer
+from tcswebapp import slowqueries
+from timeit import default_timer
+import os
+import socket
+import threading
+import time
+
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)  # Upper bounds in milliseconds
+SNAPSHOT_TIMEOUT = 86400    # 1 day in seconds
+INDEX_KEY = 'metrics_index'
+RESET_KEY = 'metrics_reset'
+UNRESOLVED = '<unresolved>'   # Requests that match no URL pattern, so that 404s add only one endpoint
+
+_local = threading.local()      # The RequestStats of the request the thread is handling
+_lock = threading.Lock()
+_totals = {}                    # Endpoint -> totals; see newTotals
+_flushed = [time.time()]        # Time of the last flush
+
+class RequestStats(object):
+    """Database and serializer work done while handling one request."""
+    __slots__ = ('request', 'queries', 'sql_seconds', 'serializer_seconds')
+
+    def __init__(self, request=None):
+        self.request = request
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializer_seconds = 0.0
+
+def getCache():
+    return caches[getattr(settings, 'METRICS_CACHE', 'default')]
+
+def isEnabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+def getProcessKey():
+    # Computed each time because server processes are forked after this module is imported
+    return 'metrics_{0}_{1}'.format(socket.gethostname(), os.getpid())
+
+def newTotals():
+    return {'count': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'queries': 0, 'sql_seconds': 0.0,
+        'serializer_seconds': 0.0, 'histogram': [0] * (len(LATENCY_BUCKETS) + 1)}
+
+def getEndpoint(request):
+    """Return the URL name of the request, followed by the resource name for API requests."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNRESOLVED
+    if 'resource_name' in match.kwargs:
+        return '{0}:{1}'.format(match.view_name, match.kwargs['resource_name'])
+    return match.view_name
+
+def startRequest(request=None):
+    _local.stats = RequestStats(request)
+
+def getCurrentEndpoint():
+    """Return the endpoint of the request the thread is handling, or None."""
+    stats = getattr(_local, 'stats', None)
+    if stats is None or stats.request is None:
+        return None
+    return getEndpoint(stats.request)
+
+def finishRequest(endpoint, seconds, status_code):
+    """Add a finished request to the totals of the process, and flush them if they are due."""
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        return
+    _local.stats = None
+    milliseconds = seconds * 1000
+    bucket = len(LATENCY_BUCKETS)
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if milliseconds <= bound:
+            bucket = i
+            break
+    with _lock:
+        totals = _totals.get(endpoint)
+        if totals is None:
+            totals = _totals[endpoint] = newTotals()
+        totals['count'] += 1
+        totals['errors'] += status_code >= 500
+        totals['seconds'] += seconds
+        totals['max_seconds'] = max(totals['max_seconds'], seconds)
+        totals['queries'] += stats.queries
+        totals['sql_seconds'] += stats.sql_seconds
+        totals['serializer_seconds'] += stats.serializer_seconds
+        totals['histogram'][bucket] += 1
+    if time.time() - _flushed[0] >= getattr(settings, 'METRICS_FLUSH_SECONDS', 10):
+        flush()
+    if slowqueries.isEnabled():
+        slowqueries.flushIfDue()    # Captured since the last flush, which a later capture might not trigger
+
+def recordQuery(seconds):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.queries += 1
+        stats.sql_seconds += seconds
+
+def recordSerializer(seconds):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.serializer_seconds += seconds
+
+def flush():
+    """Copy the totals of the process to the shared cache.  This costs two cache operations."""
+    now = time.time()
+    cache = getCache()
+    key = getProcessKey()
+    shared = cache.get_many([INDEX_KEY, RESET_KEY])
+    with _lock:
+        if shared.get(RESET_KEY, 0) > _flushed[0]:
+            _totals.clear()     # Another process reset the metrics
+        snapshot = dict((endpoint, dict(totals, histogram=list(totals['histogram'])))
+            for endpoint, totals in _totals.items())
+        _flushed[0] = now
+    # Concurrent flushes may drop each other's index entries, but every flush adds its own entry again
+    index = dict((process_key, flushed) for process_key, flushed in shared.get(INDEX_KEY, {}).items()
+        if flushed > now - SNAPSHOT_TIMEOUT)
+    index[key] = now
+    cache.set_many({key: snapshot, INDEX_KEY: index}, SNAPSHOT_TIMEOUT)
+
+def resetMetrics():
+    """Discard the metrics of every process."""
+    cache = getCache()
+    cache.delete_many(list(cache.get(INDEX_KEY, {})) + [INDEX_KEY])
+    cache.set(RESET_KEY, time.time(), SNAPSHOT_TIMEOUT)
+    with _lock:
+        _totals.clear()
+        _flushed[0] = time.time()
+
+def getPercentile(totals, fraction):
+    """
+    Estimate a latency percentile in milliseconds from a histogram: the upper bound of the bucket in
+    which it falls, or the maximum latency if it falls past the last bound.
+    """
+    rank = fraction * totals['count']
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, totals['histogram']):
+        seen += count
+        if seen >= rank and seen > 0:
+            return bound
+    return round(totals['max_seconds'] * 1000, 1)
+
+def getMetrics():
+    """
+    Return a dictionary mapping each endpoint to the merged totals of every process, with the
+    derived keys 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request', 'sql_ms_per_request', and
+    'serializer_ms_per_request'.
+    """
+    cache = getCache()
+    snapshots = cache.get_many(list(cache.get(INDEX_KEY, {}))).values()
+    metrics = {}
+    for snapshot in snapshots:
+        for endpoint, totals in snapshot.items():
+            merged = metrics.setdefault(endpoint, newTotals())
+            for name in ('count', 'errors', 'seconds', 'queries', 'sql_seconds', 'serializer_seconds'):
+                merged[name] += totals[name]
+            merged['max_seconds'] = max(merged['max_seconds'], totals['max_seconds'])
+            merged['histogram'] = [a + b for a, b in zip(merged['histogram'], totals['histogram'])]
+    for totals in metrics.values():
+        count = float(totals['count'])
+        totals['mean_ms'] = round(totals['seconds'] * 1000 / count, 1)
+        totals['p50_ms'] = getPercentile(totals, 0.50)
+        totals['p95_ms'] = getPercentile(totals, 0.95)
+        totals['p99_ms'] = getPercentile(totals, 0.99)
+        totals['queries_per_request'] = round(totals['queries'] / count, 1)
+        totals['sql_ms_per_request'] = round(totals['sql_seconds'] * 1000 / count, 1)
+        totals['serializer_ms_per_request'] = round(totals['serializer_seconds'] * 1000 / count, 1)
+    return metrics
+
+class TimedCursorWrapper(object):
+    """Wrap a database cursor to count and time the queries of the current request."""
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return self.cursor.__exit__(type, value, traceback)
+
+    def execute(self, sql, params=None):
+        start = default_timer()
+        try:
+            result = self.cursor.execute(sql, params)
+        finally:
+            seconds = default_timer() - start
+            recordQuery(seconds)
+        # Only statements that succeeded are captured, so that EXPLAIN runs in a usable transaction
+        if slowqueries.isEnabled() and seconds >= slowqueries.getThreshold():
+            slowqueries.captureQuery(self.cursor.db, sql, params, seconds, getCurrentEndpoint())
+        return result
+
+    def executemany(self, sql, param_list):
+        start = default_timer()
+        try:
+            result = self.cursor.executemany(sql, param_list)
+        finally:
+            seconds = default_timer() - start
+            recordQuery(seconds)
+        if slowqueries.isEnabled() and seconds >= slowqueries.getThreshold():
+            slowqueries.captureQuery(self.cursor.db, sql, None, seconds, getCurrentEndpoint(), many=True)
+        return result
+
+def instrumentConnections():
+    """
+    Make every database connection of the current thread wrap its cursors in TimedCursorWrapper.
+    Django 1.11 has no hook around query execution, so the connection's cursor factories are wrapped.
+    Connections belong to a thread and live for many requests, so each is wrapped only once.
+    """
+    for connection in connections.all():
+        if getattr(connection, 'metrics_instrumented', False):
+            continue
+        make_cursor, make_debug_cursor = connection.make_cursor, connection.make_debug_cursor
+        connection.make_cursor = lambda cursor, make_cursor=make_cursor: TimedCursorWrapper(make_cursor(cursor))
+        connection.make_debug_cursor = lambda cursor, make_debug_cursor=make_debug_cursor: TimedCursorWrapper(
+            make_debug_cursor(cursor))
+        connection.metrics_instrumented = True
+
+class MetricsMiddleware(MiddlewareMixin):
+    """Record the latency, queries, and serializer time of every request.  List it first."""
+    def process_request(self, request):
+        if isEnabled():
+            instrumentConnections()
+            startRequest(request)
+            request.metrics_start = default_timer()
+
+    def process_exception(self, request, exception):
+        if hasattr(request, 'metrics_start'):
+            finishRequest(getEndpoint(request), default_timer() - request.metrics_start, 500)
+            del request.metrics_start
+
+    def process_response(self, request, response):
+        if hasattr(request, 'metrics_start'):
+            finishRequest(getEndpoint(request), default_timer() - request.metrics_start, response.status_code)
+        return response
+
+class TimedSerializer(Serializer):
+    """A tastypie Serializer that records its time in the metrics of the current request."""
+    def serialize(self, bundle, format='application/json', options=None):
+        start = default_timer()
+        try:
+            return super(TimedSerializer, self).serialize(bundle, format, options)
+        finally:
+            recordSerializer(default_timer() - start)
+
+    def deserialize(self, content, format='application/json'):
+        start = default_timer()
+        try:
+            return super(TimedSerializer, self).deserialize(content, format)
+        finally:
+            recordSerializer(default_timer() - start)
@@ -0,0 +1,21 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django.db import models
+
+class ThrottleBucket(models.Model):
+    """
+    The token bucket of one user for one API resource.  See tcswebapp.throttle.TokenBucketThrottle,
+    which spends tokens with a single conditional UPDATE so that concurrent requests cannot spend the
+    same token.
+    """
+    key = models.CharField(max_length=250, unique=True)    # TokenBucketThrottle.convert_identifier_to_key
+    tokens = models.FloatField()
+    updated = models.FloatField()                           # Seconds since the epoch
+
+    def __unicode__(self):
+        return '{0}: {1:.2f} tokens'.format(self.key, self.tokens)
@@ -0,0 +1,135 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Keyset pagination for tastypie list endpoints.  Tastypie's Paginator pages by offset, so the database
+reads and discards every row before the requested page, and deep pages get slower and slower.  With
+KeysetPaginator, a page is requested with an opaque cursor, 'after', that encodes the sort key and
+primary key of the last object on the previous page.  The next page is the objects ordered after that
+key, which the database finds with an index, so every page costs the same.
+
+The response's meta has the form {"limit": 20, "after": "<cursor>", "next": "<url>"}.  'next' is the
+url of the next page, or null on the last page.  There is no total count, since counting costs as much
+as reading every page.  Objects are ordered by the queryset's ordering (for example, a resource's
+"order_by" parameter) with the primary key appended to break ties.  Sort fields must not be null,
+because NULL compares neither before nor after a cursor.
+"""
+
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, time
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.http import urlencode
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
+import json
+
+def getOrdering(queryset):
+    """
+    Return a list of tuples (field name, descending) by which to page 'queryset', ending with the
+    primary key, or None if the queryset is ordered by something other than fields.
+    """
+    ordering = queryset.query.order_by or (queryset.model._meta.ordering if queryset.query.default_ordering else [])
+    keys = []
+    for name in ordering:
+        if not isinstance(name, basestring) or name == '?':
+            return None     # An expression or random order
+        descending = name.startswith('-')
+        name = name.lstrip('-+')
+        keys.append(('pk' if name == queryset.model._meta.pk.name else name, descending))
+    if not any(name == 'pk' for name, descending in keys):
+        keys.append(('pk', keys[-1][1] if keys else False))
+    return keys
+
+def getKey(obj, keys):
+    """Return a list of the values of 'keys' for an object, following related fields such as 'office__title'."""
+    values = []
+    for name, descending in keys:
+        value = obj
+        for attribute in name.split('__'):
+            value = getattr(value, attribute)
+        values.append(value)
+    return values
+
+def getKeysetFilter(keys, values):
+    """
+    Return a Q object that selects the rows ordered after 'values'.  For keys (a, b, pk) ascending,
+    that is: a > x, or a = x and b > y, or a = x and b = y and pk > z.
+    """
+    after = Q()
+    equal = {}
+    for (name, descending), value in zip(keys, values):
+        after |= Q(**dict(equal, **{'{0}__{1}'.format(name, 'lt' if descending else 'gt'): value}))
+        equal[name] = value
+    return after
+
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder truncates datetimes and times to milliseconds, so a cursor would compare before
+    the object it was made from.  Encode them with every microsecond.
+    """
+    def default(self, o):
+        if isinstance(o, (datetime, time)):
+            return o.isoformat()
+        return super(CursorEncoder, self).default(o)
+
+def encodeCursor(keys, values):
+    """Return an opaque string identifying the position of an object in the ordering 'keys'."""
+    return urlsafe_b64encode(json.dumps([[name for name, descending in keys], values], cls=CursorEncoder))
+
+def decodeCursor(cursor, keys):
+    """Return the values encoded by encodeCursor.  Raise BadRequest if the cursor is not for 'keys'."""
+    try:
+        names, values = json.loads(urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise BadRequest("Invalid cursor")
+    if names != [name for name, descending in keys] or len(values) != len(keys):
+        raise BadRequest("The cursor does not match the ordering")
+    return values
+
+class KeysetPaginator(Paginator):
+    """
+    A tastypie Paginator that pages by keyset instead of offset.  Set it on a ModelResource:
+        class Meta:
+            paginator_class = KeysetPaginator
+
+    A list that is not a queryset, or is ordered by an expression or randomly, is paged by offset.
+    """
+    def page(self):
+        keys = getOrdering(self.objects) if hasattr(self.objects, 'query') else None
+        if keys is None:
+            return super(KeysetPaginator, self).page()
+        if self.get_offset():
+            raise BadRequest("Use the cursor 'after' instead of 'offset' to page this list")
+        limit = self.get_limit()
+        objects = self.objects.order_by(*[('-' if descending else '') + name for name, descending in keys])
+        if self.request_data.get('after'):
+            try:
+                objects = objects.filter(getKeysetFilter(keys, decodeCursor(self.request_data['after'], keys)))
+            except (TypeError, ValueError, ValidationError):
+                raise BadRequest("Invalid cursor")
+        if limit:
+            # One more object than the page shows whether there is a next page
+            objects = list(objects[:limit + 1])
+            after = encodeCursor(keys, getKey(objects[limit - 1], keys)) if len(objects) > limit else None
+            objects = objects[:limit]
+        else:
+            objects, after = list(objects), None
+        return {
+            self.collection_name: objects,
+            'meta': {'limit': limit, 'after': after, 'next': self.getNext(limit, after)},
+        }
+
+    def getNext(self, limit, after):
+        """Return the url of the page after the cursor 'after', or None if there is no next page."""
+        if after is None or self.resource_uri is None:
+            return None
+        params = self.request_data.copy()
+        params.pop('offset', None)
+        params['limit'] = limit
+        params['after'] = after
+        return '{0}?{1}'.format(self.resource_uri, params.urlencode() if hasattr(params, 'urlencode') else urlencode(params))
@@ -0,0 +1,67 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Query budgets for tests.  A budget caps the number of database queries a view or API call may issue,
+so that a change that adds queries, or a query per row, fails the test suite instead of reaching
+production.  Each budget is checked at two data sizes: a view that issues a query per campaign,
+worker, or voter passes a budget with a little data but fails it with more.
+"""
+
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from tcsuser.models import TcsUser, TcsUserProfile
+
+def countQueries(function):
+    """Call 'function' and return the tuple (result, captured) with the queries it issued."""
+    with CaptureQueriesContext(connection) as captured:
+        result = function()
+    return result, captured
+
+class QueryBudgetMixin(object):
+    """
+    A mixin for TestCase that adds assertQueryBudget, and createUser for the functions that grow the
+    data.  The test case sets 'address' before calling createUser.
+    """
+
+    def createUser(self, email):
+        """Return a new active user with a profile at self.address and the password 'Pa33word44'."""
+        user = TcsUser.objects.create_user(email, 'Pa33word44')
+        user.is_active = True
+        user.save()
+        TcsUserProfile.objects.create(user=user, name=email, address=self.address, phone_number='5025550100',
+            gender='F')
+        return user
+
+    def assertQueryBudget(self, budget, function, grow, per_row=0):
+        """
+        Call 'function', which should make one request, then call 'grow', which should add data and
+        return the number of rows it added, then call 'function' again.  Fail if the first call issues
+        more than 'budget' queries or the second more than budget + per_row * rows.  'per_row' is zero
+        unless the request itself grows, such as a PATCH of more objects.  Return both responses.
+        """
+        # The metrics middleware flushes to the cache on a timer, not with every request
+        with override_settings(METRICS_ENABLED=False):
+            small, small_queries = countQueries(function)
+            rows = grow()
+            large, large_queries = countQueries(function)
+        for size, captured, limit in (('small', small_queries, budget), ('large', large_queries,
+                budget + per_row * rows)):
+            if len(captured) > limit:
+                self.fail('{0} queries exceed the budget of {1} with {2} data ({3} more rows in the large data):\n'
+                    '{4}'.format(len(captured), limit, size, rows, '\n'.join(
+                    '{0}. {1}'.format(i, query['sql']) for i, query in enumerate(captured.captured_queries, start=1))))
+        return small, large
+
+    def getRendered(self, url):
+        """
+        GET a page with an empty template fragment cache, so that the budget covers rendering every
+        fragment.  Request the page once before the budget is checked, so that the versions keying its
+        fragments are already stored, as they are in production.
+        """
+        caches['template_fragments'].clear()
+        return self.client.get(url)
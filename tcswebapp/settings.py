@@ -38,7 +38,7 @@ INSTALLED_APPS = (
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'address',
-    'campaign',
+    'campaign.apps.CampaignConfig',
     'campaigner',
     'django_countries', # https://pypi.python.org/pypi/django-countries
     'tastypie',
@@ -48,6 +48,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'tcswebapp.metrics.MetricsMiddleware',     # First, so that it times the other middleware
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -60,15 +61,21 @@ ROOT_URLCONF = 'tcswebapp.urls'
 
 WSGI_APPLICATION = 'tcswebapp.wsgi.application'
 
+# Templates are compiled once per process unless DEBUG is set.  Settings modules that change DEBUG
+# must call getTemplateLoaders again; see settings_loadtest.
+def getTemplateLoaders(debug):
+    loaders = ['django.template.loaders.filesystem.Loader', 'django.template.loaders.app_directories.Loader']
+    return loaders if debug else [('django.template.loaders.cached.Loader', loaders)]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'loaders': getTemplateLoaders(DEBUG),
         },
     },
 ]
@@ -83,6 +90,27 @@ DATABASES = {
     }
 }
 
+# Caches
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+# API throttling state and cached API responses must be shared by every server process, so they use the
+# database cache.  Create the table with "python manage.py createcachetable".  In production, use memcached
+# instead.  Rendered template fragments ({% cache %} uses the 'template_fragments' cache) may stay in
+# each process, because their keys include versions from the shared cache; see tcswebapp.apicache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'tcs_shared_cache',
+    },
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template_fragments',
+    },
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.10/topics/i18n/
 
@@ -98,6 +126,12 @@ USE_TZ = False
 STATIC_ROOT = 'staticfiles'
 STATIC_URL = '/static/'
 
+# "python manage.py collectstatic" writes hashed, minified, and gzipped files, which tcswebapp.wsgi
+# serves with far-future cache headers; see tcswebapp.staticassets.  It also writes the resized
+# images listed here, by width in pixels, if Pillow is installed.
+STATICFILES_STORAGE = 'tcswebapp.staticassets.AssetStorage'
+STATIC_IMAGE_VARIANTS = {'campaigner/background.jpg': [960]}
+
 # E-mail settings.  If these are not valid, the user will not be sent an activation link.
 # They do not need to be set for unit testing to work as intended.
 DEFAULT_FROM_EMAIL = ''    # TODO
@@ -113,12 +147,40 @@ AUTH_USER_MODEL = 'tcsuser.TcsUser'
 # Tastypie settings
 TASTYPIE_DEFAULT_FORMATS = ['json']
 
+# API throttling; see tcswebapp.throttle.TokenBucketThrottle.  API_THROTTLE_RATES overrides the rates
+# declared by API resources.  For example, {'voter': (2, 1800)} allows bursts of 2 requests and 1
+# request every 30 minutes thereafter.  The key '*' applies to every resource not listed.  The buckets
+# are database rows; THROTTLE_CACHE only counts the requests that were throttled.
+THROTTLE_CACHE = 'shared'
+API_THROTTLE_RATES = {}
+# The API_THROTTLE_RATES of benchmarks and load tests, whose simulated volunteers work far faster than real ones
+UNTHROTTLED_RATES = {'*': (10 ** 9, 1)}
+
+# Cached API list responses; see tcswebapp.apicache.CachedListMixin.
+API_RESPONSE_CACHE = 'shared'
+
+# Per-endpoint request metrics; see tcswebapp.metrics.  Each process copies its totals to METRICS_CACHE
+# every METRICS_FLUSH_SECONDS.  The internal endpoint /internal/metrics/ answers only requests whose
+# X-Metrics-Token header is METRICS_TOKEN.  It is disabled while METRICS_TOKEN is empty.
+METRICS_ENABLED = True
+METRICS_CACHE = 'shared'
+METRICS_FLUSH_SECONDS = 10
+METRICS_TOKEN = ''
+
+# Capture of statements slower than SLOW_QUERY_MS, with their plans; see tcswebapp.slowqueries.
+# Requires METRICS_ENABLED.  Each process keeps the SLOW_QUERY_CAPACITY most recently seen statements and
+# copies them to METRICS_CACHE every METRICS_FLUSH_SECONDS.
+SLOW_QUERY_ENABLED = False
+SLOW_QUERY_MS = 200
+SLOW_QUERY_CAPACITY = 100
+
 LOGIN_URL = '/'
 LOGIN_REDIRECT_URL = '/home/'
 
 # This custom setting for the Voter application controls where uploaded voter lists are stored.
 # This is a file path, not a URL, so don't include the leading '/'.
 VOTER_LISTS_ROOT = 'voter_lists/'
+STAGED_IMPORT_MIN_BYTES = 500000     # Import larger voter lists through a staging table.  See voter.staging.
 
 # This is for convenient use of the Bootstrap "Danger" alert
 from django.contrib.messages import constants as message_constants
@@ -0,0 +1,21 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Settings for load testing on one machine with campaigner.loadtest.  For example:
+    $ python manage.py runserver --settings=tcswebapp.settings_loadtest
+    $ DJANGO_SETTINGS_MODULE=tcswebapp.settings_loadtest gunicorn --workers 4 tcswebapp.wsgi
+"""
+
+from tcswebapp.settings import *
+
+# Query logging and debug pages would dominate the measurements
+DEBUG = False
+ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+TEMPLATES[0]['OPTIONS']['loaders'] = getTemplateLoaders(DEBUG)
+
+# Simulated volunteers work far faster than real ones, so the API throttles would reject them
+API_THROTTLE_RATES = UNTHROTTLED_RATES
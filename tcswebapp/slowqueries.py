@@ -0,0 +1,212 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Capture of slow database queries.  When SLOW_QUERY_ENABLED is set, every statement that takes at least
+SLOW_QUERY_MS milliseconds is recorded with its SQL, its parameters, the endpoint of the request that
+issued it, and the database's plan for it.  Django 1.11 has no hook around query execution, so the
+cursor wrapper of tcswebapp.metrics calls captureQuery, and capture requires METRICS_ENABLED as well.
+
+Statements are grouped by fingerprint: the SQL with literals, parameters, and IN lists replaced by '?'.
+Each process keeps at most SLOW_QUERY_CAPACITY fingerprints and forgets the one seen least recently
+to make room.  A fingerprint keeps a count, the total and maximum time, the endpoints that issued it,
+and the SQL, parameters, and plan of its slowest execution.  Only a new slowest execution is explained,
+so a statement that is always slow costs one EXPLAIN, not one per execution.
+
+Like the totals of tcswebapp.metrics, the process's fingerprints are copied to the cache named by
+METRICS_CACHE at most every METRICS_FLUSH_SECONDS, by a capture or a finished request, and getSlowQueries
+merges the copies of all processes.  View them with "python manage.py slowqueries".
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+import hashlib
+import os
+import re
+import socket
+import threading
+import time
+
+SNAPSHOT_TIMEOUT = 7 * 86400   # 1 week in seconds
+INDEX_KEY = 'slowqueries_index'
+RESET_KEY = 'slowqueries_reset'
+MAX_SQL_LENGTH = 10000
+MAX_PARAMS_LENGTH = 2000
+EXPLAIN_PREFIXES = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN ', 'mysql': 'EXPLAIN '}
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')    # EXPLAIN without ANALYZE runs none of them
+
+_local = threading.local()
+_lock = threading.Lock()
+_captures = OrderedDict()   # Fingerprint -> capture, least recently seen first; see captureQuery
+_reset = [time.time()]      # Time this process last discarded its captures
+_flushed = [time.time()]    # Time of the last flush
+
+# Literals first, so that the digits of a quoted string are not replaced on their own
+NORMALIZERS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s|%\([^)]+\)s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),  # IN lists of any length
+    (re.compile(r'\s+'), ' '),
+)
+
+def getCache():
+    return caches[getattr(settings, 'METRICS_CACHE', 'default')]
+
+def isEnabled():
+    return getattr(settings, 'SLOW_QUERY_ENABLED', False)
+
+def getThreshold():
+    """Return the threshold in seconds."""
+    return getattr(settings, 'SLOW_QUERY_MS', 200) / 1000.0
+
+def getProcessKey():
+    return 'slowqueries_{0}_{1}'.format(socket.gethostname(), os.getpid())
+
+def normalize(sql):
+    """Return a statement with its literals and parameters replaced by '?'."""
+    for pattern, replacement in NORMALIZERS:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+@contextmanager
+def notCaptured():
+    """Do not capture the queries of this module, such as its reads and writes of a database cache."""
+    capturing = getattr(_local, 'capturing', False)
+    _local.capturing = True
+    try:
+        yield
+    finally:
+        _local.capturing = capturing
+
+def getFingerprint(statement):
+    return hashlib.md5(statement.encode('utf-8') if isinstance(statement, unicode) else statement).hexdigest()[:12]
+
+def getPlan(connection, sql, params):
+    """Run an EXPLAIN statement on a new cursor and return its rows as lines."""
+    cursor = connection.create_cursor()
+    try:
+        cursor.execute(sql, params or ())
+        return [' '.join(unicode(value) for value in row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def explain(connection, sql, params):
+    """
+    Return the database's plan for a statement as a list of lines, or None if it cannot be explained.
+    The plan comes from a new cursor, because the caller has not yet fetched the statement's results.
+    Within a transaction, the plan is read in a savepoint, because on PostgreSQL a failed EXPLAIN
+    would abort the caller's transaction.
+    """
+    prefix = EXPLAIN_PREFIXES.get(connection.vendor)
+    if prefix is None or not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    try:
+        if connection.in_atomic_block:
+            with transaction.atomic(using=connection.alias, savepoint=True):
+                return getPlan(connection, prefix + sql, params)
+        return getPlan(connection, prefix + sql, params)
+    except Exception as e:  # The plan is a diagnostic; never fail the statement that was explained
+        return ['EXPLAIN failed: {0}'.format(e)]
+
+def captureQuery(connection, sql, params, seconds, endpoint=None, many=False):
+    """
+    Record a slow statement.  'connection' is the DatabaseWrapper that ran it; 'endpoint' is the
+    endpoint of the current request (see tcswebapp.metrics.getEndpoint), if any.  Statements
+    executed with executemany ('many') are not explained.
+    """
+    if getattr(_local, 'capturing', False):
+        return
+    with notCaptured():
+        statement = normalize(sql)
+        fingerprint = getFingerprint(statement)
+        now = time.time()
+        with _lock:
+            capture = _captures.get(fingerprint)
+            is_slowest = capture is None or seconds > capture['max_seconds']
+        # Explain outside the lock; another thread may record the same fingerprint meanwhile
+        plan = explain(connection, sql, params) if is_slowest and not many else None
+        with _lock:
+            capture = _captures.pop(fingerprint, None) or {'fingerprint': fingerprint, 'statement': statement,
+                'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'endpoints': {}, 'first_seen': now}
+            capture['count'] += 1
+            capture['total_seconds'] += seconds
+            capture['last_seen'] = now
+            endpoint = endpoint or '<none>'
+            capture['endpoints'][endpoint] = capture['endpoints'].get(endpoint, 0) + 1
+            if seconds > capture['max_seconds']:
+                capture.update(max_seconds=seconds, sql=sql[:MAX_SQL_LENGTH], params=repr(params)[:MAX_PARAMS_LENGTH],
+                    plan=plan, database=connection.alias)
+            _captures[fingerprint] = capture
+            while len(_captures) > getattr(settings, 'SLOW_QUERY_CAPACITY', 100):
+                _captures.popitem(last=False)
+        flushIfDue()
+
+def flushIfDue():
+    """Flush the captures if METRICS_FLUSH_SECONDS have passed since the last flush."""
+    if time.time() - _flushed[0] >= getattr(settings, 'METRICS_FLUSH_SECONDS', 10):
+        flush()
+
+def flush():
+    """Copy the captures of the process to the shared cache.  This costs two cache operations."""
+    now = time.time()
+    cache = getCache()
+    key = getProcessKey()
+    with notCaptured():
+        shared = cache.get_many([INDEX_KEY, RESET_KEY])
+    with _lock:
+        if shared.get(RESET_KEY, 0) > _reset[0]:
+            _captures.clear()   # Another process reset the captures
+            _reset[0] = now
+        snapshot = [dict(capture, endpoints=dict(capture['endpoints'])) for capture in _captures.values()]
+        _flushed[0] = now
+    index = dict((process_key, flushed) for process_key, flushed in shared.get(INDEX_KEY, {}).items()
+        if flushed > now - SNAPSHOT_TIMEOUT)
+    index[key] = now
+    with notCaptured():
+        cache.set_many({key: snapshot, INDEX_KEY: index}, SNAPSHOT_TIMEOUT)
+
+def resetSlowQueries():
+    """Discard the captures of every process."""
+    cache = getCache()
+    with notCaptured():
+        cache.delete_many(list(cache.get(INDEX_KEY, {})) + [INDEX_KEY])
+        cache.set(RESET_KEY, time.time(), SNAPSHOT_TIMEOUT)
+    with _lock:
+        _captures.clear()
+        _reset[0] = time.time()
+
+def getSlowQueries():
+    """
+    Return the captures of every process merged by fingerprint, most total time first.  Each is a
+    dictionary with the keys 'fingerprint', 'statement', 'count', 'total_seconds', 'max_seconds',
+    'mean_ms', 'endpoints', 'first_seen', 'last_seen', and, for the slowest execution, 'sql', 'params',
+    'plan', and 'database'.
+    """
+    cache = getCache()
+    with notCaptured():
+        snapshots = cache.get_many(list(cache.get(INDEX_KEY, {}))).values()
+    merged = {}
+    for snapshot in snapshots:
+        for capture in snapshot:
+            total = merged.get(capture['fingerprint'])
+            if total is None:
+                merged[capture['fingerprint']] = dict(capture, endpoints=dict(capture['endpoints']))
+                continue
+            if capture['max_seconds'] > total['max_seconds']:
+                total.update((name, capture[name]) for name in ('max_seconds', 'sql', 'params', 'plan', 'database'))
+            total['count'] += capture['count']
+            total['total_seconds'] += capture['total_seconds']
+            total['first_seen'] = min(total['first_seen'], capture['first_seen'])
+            total['last_seen'] = max(total['last_seen'], capture['last_seen'])
+            for endpoint, count in capture['endpoints'].items():
+                total['endpoints'][endpoint] = total['endpoints'].get(endpoint, 0) + count
+    for capture in merged.values():
+        capture['mean_ms'] = round(capture['total_seconds'] * 1000 / capture['count'], 1)
+    return sorted(merged.values(), key=lambda capture: capture['total_seconds'], reverse=True)
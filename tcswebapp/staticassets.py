@@ -0,0 +1,271 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+The static asset pipeline.  "python manage.py collectstatic" is the build step: AssetStorage copies
+the static files to STATIC_ROOT under content-hashed names, minifies the JavaScript and CSS, writes a
+gzipped copy beside every file that compresses well, and writes the resized images listed in
+STATIC_IMAGE_VARIANTS if Pillow is installed.  JavaScript and CSS are hashed as minified, so a
+change to a minifier changes the names of the files it changes.  StaticAssets serves STATIC_ROOT
+from the WSGI application, so gunicorn needs no separate file server.  Hashed names never change
+content, so they are served with a far-future Cache-Control header and browsers do not request them
+again.
+"""
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.utils.http import http_date, parse_http_date_safe
+from io import BytesIO
+from wsgiref.util import FileWrapper
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+try:
+    from PIL import Image
+except ImportError:     # Pillow is optional; without it, collectstatic builds no image variants
+    Image = None
+
+FAR_FUTURE_MAX_AGE = 365 * 86400    # 1 year in seconds
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.html', '.svg', '.txt', '.xml')
+MIN_COMPRESSION_SAVINGS = 0.05      # Keep a gzipped copy only if it is at least 5% smaller
+
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_WHITESPACE = re.compile(r'\s+')
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+def minifyJs(source):
+    """
+    Remove indentation, blank lines, and comments that occupy whole lines, keeping the first comment,
+    which is the copyright notice.  Lines stay separate, so semicolon insertion is unaffected, and
+    nothing within a line changes, so string and regular expression literals are safe.  Return the
+    source unchanged if a comment ends before the end of a line.
+    """
+    lines = []
+    comment = None      # The lines of the comment being read
+    kept_notice = False
+    for line in source.splitlines():
+        line = line.strip()
+        if comment is None:
+            if line.startswith('//') or not line:
+                continue
+            if not line.startswith('/*') or ('*/' in line[2:] and not line.endswith('*/')):
+                lines.append(line)
+                continue
+            comment = [line]
+            line = line[2:]
+        else:
+            comment.append(line)
+        if '*/' in line:
+            if not line.endswith('*/'):
+                return source
+            if not kept_notice:
+                lines.extend(comment)
+                kept_notice = True
+            comment = None
+    return '\n'.join(lines) + '\n'
+
+def minifyCss(source):
+    """Remove comments other than the copyright notice, and whitespace that does not separate words."""
+    notice, body = '', source
+    match = CSS_COMMENT.search(source)
+    if match and not source[:match.start()].strip():
+        notice, body = match.group(0) + '\n', source[match.end():]
+    body = CSS_COMMENT.sub('', body)
+    return notice + CSS_PUNCTUATION.sub(r'\1', CSS_WHITESPACE.sub(' ', body)).strip() + '\n'
+
+MINIFIERS = {'.js': minifyJs, '.css': minifyCss}
+
+def getVariantName(name, width):
+    """Return the name of a resized image.  For example, 'campaigner/background-960w.jpg'."""
+    root, extension = os.path.splitext(name)
+    return '{0}-{1}w{2}'.format(root, width, extension)
+
+class AssetStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage that also minifies, compresses, and resizes.  Until collectstatic has
+    run, as in development and in tests, url() returns unhashed names.
+    """
+    def stored_name(self, name):
+        try:
+            return super(AssetStorage, self).stored_name(name)
+        except ValueError:  # The file has not been collected
+            return name
+
+    def file_hash(self, name, content=None):
+        """Hash the content that is served, which for JavaScript and CSS is the minified content."""
+        minifier = MINIFIERS.get(os.path.splitext(name)[1])
+        if minifier is None or content is None:
+            return super(AssetStorage, self).file_hash(name, content)
+        return hashlib.md5(minifier(''.join(content.chunks()))).hexdigest()[:12]
+
+    def post_process(self, paths, dry_run=False, **options):
+        for processed in super(AssetStorage, self).post_process(paths, dry_run, **options):
+            yield processed
+        if dry_run:
+            return
+        for name, width in self.getVariants():
+            hashed_name = self.writeVariant(name, width)
+            if hashed_name:
+                yield getVariantName(name, width), hashed_name, True
+        names = set(self.hashed_files) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if self.exists(name):
+                self.minify(name)
+                self.compress(name)
+
+    def getVariants(self):
+        """Return a list of tuples (name, width) from the setting STATIC_IMAGE_VARIANTS."""
+        variants = getattr(settings, 'STATIC_IMAGE_VARIANTS', {})
+        return [(name, width) for name in sorted(variants) for width in variants[name]]
+
+    def replace(self, name, content):
+        self.delete(name)
+        self._save(name, ContentFile(content))
+
+    def minify(self, name):
+        minifier = MINIFIERS.get(os.path.splitext(name)[1])
+        if minifier:
+            with self.open(name) as f:
+                source = f.read()
+            minified = minifier(source)
+            if minified != source:
+                self.replace(name, minified)
+
+    def compress(self, name):
+        """Write 'name'.gz if it is enough smaller than 'name'.  Compression is deterministic."""
+        if not name.endswith(COMPRESSIBLE_EXTENSIONS):
+            return
+        with self.open(name) as f:
+            content = f.read()
+        buffer = BytesIO()
+        with gzip.GzipFile(filename='', mode='wb', fileobj=buffer, compresslevel=9, mtime=0) as f:
+            f.write(content)
+        if len(buffer.getvalue()) <= len(content) * (1 - MIN_COMPRESSION_SAVINGS):
+            self.replace(name + '.gz', buffer.getvalue())
+        elif self.exists(name + '.gz'):
+            self.delete(name + '.gz')
+
+    def writeVariant(self, name, width):
+        """Write a copy of image 'name' resized to 'width' pixels wide, and add it to the manifest."""
+        if Image is None or not self.exists(name):
+            return None
+        with self.open(name) as f:
+            image = Image.open(f)
+            image.load()
+        if image.size[0] <= width:
+            return None
+        image_format = image.format
+        image = image.resize((width, int(round(image.size[1] * width / float(image.size[0])))), Image.ANTIALIAS)
+        buffer = BytesIO()
+        image.save(buffer, format=image_format, quality=75, optimize=True, progressive=True)
+        variant_name = getVariantName(name, width)
+        self.replace(variant_name, buffer.getvalue())
+        hashed_name = self.hashed_name(variant_name)
+        self.replace(hashed_name, buffer.getvalue())
+        self.hashed_files[self.hash_key(variant_name)] = hashed_name
+        self.save_manifest()
+        return hashed_name
+
+    def variantUrl(self, name, width):
+        """Return the url of a resized image, or None if collectstatic did not build it."""
+        variant_name = getVariantName(name, width)
+        if settings.DEBUG or self.hash_key(variant_name) not in self.hashed_files:
+            return None
+        return self.url(variant_name)
+
+def acceptsGzip(accept_encoding):
+    """
+    Return whether an Accept-Encoding header accepts gzip.  A coding with q=0 is refused, and gzip
+    falls back to the quality of "*" if it is not listed.
+    """
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[params[0].strip().lower()] = quality
+    quality = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0)))
+    return quality > 0
+
+class StaticAsset(object):
+    """A file in STATIC_ROOT, with the headers it is served with."""
+    def __init__(self, path, is_hashed):
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.gzip_path = path + '.gz' if os.path.exists(path + '.gz') else None
+        self.gzip_size = os.path.getsize(self.gzip_path) if self.gzip_path else None
+        self.last_modified = int(os.path.getmtime(path))
+        self.is_hashed = is_hashed
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type == 'application/javascript':
+            self.content_type += '; charset=utf-8'
+
+class StaticAssets(object):
+    """
+    WSGI middleware that serves the files in STATIC_ROOT and passes other requests to 'application'.
+    Hashed files are served with a Cache-Control max-age of one year and "immutable"; other files
+    must be revalidated.  A client that accepts gzip receives the gzipped copy, if there is one.  The
+    files are listed once, when the process starts, so run collectstatic before starting the server.
+    """
+    def __init__(self, application, root=None, prefix=None):
+        self.application = application
+        self.root = root or settings.STATIC_ROOT
+        self.prefix = prefix or settings.STATIC_URL
+        self.assets = self.scan()
+
+    def scan(self):
+        """Return a dictionary mapping url paths to StaticAsset instances."""
+        assets = {}
+        if not self.root or not os.path.isdir(self.root):
+            return assets
+        hashed = set()
+        manifest_path = os.path.join(self.root, ManifestStaticFilesStorage.manifest_name)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                hashed.update(json.load(f).get('paths', {}).values())
+        for directory, directories, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root).replace(os.sep, '/')
+                if not name.endswith('.gz') or not os.path.exists(path[:-3]):
+                    assets[self.prefix + relative] = StaticAsset(path, relative in hashed)
+        return assets
+
+    def __call__(self, environ, start_response):
+        asset = self.assets.get(environ.get('PATH_INFO', ''))
+        method = environ.get('REQUEST_METHOD')
+        if asset is None or method not in ('GET', 'HEAD'):
+            return self.application(environ, start_response)
+        headers = [('Vary', 'Accept-Encoding'), ('Last-Modified', http_date(asset.last_modified))]
+        if asset.is_hashed:
+            headers.append(('Cache-Control', 'public, max-age={0}, immutable'.format(FAR_FUTURE_MAX_AGE)))
+        else:
+            headers.append(('Cache-Control', 'public, no-cache'))
+            if_modified_since = parse_http_date_safe(environ.get('HTTP_IF_MODIFIED_SINCE', ''))
+            if if_modified_since and if_modified_since >= asset.last_modified:
+                start_response('304 Not Modified', headers)
+                return []
+        path, size = asset.path, asset.size
+        if asset.gzip_path and acceptsGzip(environ.get('HTTP_ACCEPT_ENCODING', '')):
+            path, size = asset.gzip_path, asset.gzip_size
+            headers.append(('Content-Encoding', 'gzip'))
+        headers += [('Content-Type', asset.content_type), ('Content-Length', str(size))]
+        start_response('200 OK', headers)
+        if method == 'HEAD':
+            return []
+        # gunicorn's file_wrapper uses sendfile
+        return environ.get('wsgi.file_wrapper', FileWrapper)(open(path, 'rb'), 65536)
@@ -0,0 +1,217 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Synthetic data at production scale, for benchmarks and load tests.  generateData adds campaigns in
+a few cities, their owners and workers, voters grouped into geocoded households, their links to
+every campaign in their city, and a history of voter contacts.  Each campaign has one voter list.
+
+Rows are inserted in batches with primary keys assigned here, because bulk_create does not return
+primary keys on every database.  Voters and the rows that depend on them are inserted with raw
+executemany calls; see insertRows.  Neither way calls post_save listeners, so their work (the
+campaign search index, last_contacted, geohashes) is done here directly.  Every synthetic user's
+e-mail address ends with SYNTHETIC_DOMAIN and every password is SYNTHETIC_PASSWORD.
+
+Generate data in a copy of the development database; there is no command to remove it.
+"""
+
+from address import geohash
+from address.models import Address
+from campaign.models import Campaign, CampaignsToVoters, Office, PoliticalParty
+from campaign.search import updateSearchIndex
+from datetime import date, datetime, timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from tcsuser.models import TcsUser, TcsUserProfile
+from tcswebapp.apicache import bumpVersions
+from voter.models import ContactMethod, Issue, Voter, VoterContact, VoterList, reconcileVoterLists
+import json
+import random
+
+SYNTHETIC_DOMAIN = 'synthetic.tcs.com'
+SYNTHETIC_PASSWORD = 'Pa33word44'
+BATCH_SIZE = 10000
+
+# (city, state, first three digits of postal codes, latitude, longitude)
+CITIES = (
+    ('Columbus', 'OH', '432', 39.96, -83.00),
+    ('Indianapolis', 'IN', '462', 39.77, -86.16),
+    ('Louisville', 'KY', '402', 38.25, -85.76),
+    ('Chicago', 'IL', '606', 41.88, -87.63),
+    ('Cleveland', 'OH', '441', 41.50, -81.69),
+    ('Cincinnati', 'OH', '452', 39.10, -84.51),
+    ('Detroit', 'MI', '482', 42.33, -83.05),
+    ('Pittsburgh', 'PA', '152', 40.44, -80.00),
+)
+CITY_RADIUS = 0.15      # Degrees of latitude and longitude over which a city's households are spread
+FEMALE_NAMES = ('Mary', 'Patricia', 'Jennifer', 'Linda', 'Elizabeth', 'Barbara', 'Susan', 'Jessica', 'Sarah',
+    'Karen', 'Nancy', 'Lisa', 'Betty', 'Margaret', 'Sandra', 'Ashley', 'Emily', 'Donna', 'Michelle', 'Carol')
+MALE_NAMES = ('James', 'John', 'Robert', 'Michael', 'William', 'David', 'Richard', 'Joseph', 'Thomas', 'Charles',
+    'Christopher', 'Daniel', 'Matthew', 'Anthony', 'Mark', 'Donald', 'Steven', 'Paul', 'Andrew', 'Joshua')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Rodriguez',
+    'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Lee', 'Thompson', 'White', 'Harris', 'Clark', 'Lewis', 'Robinson', 'Walker', 'Young', 'Allen', 'King')
+STREETS = ('Main Str', 'Oak Ave', 'Maple Ave', 'Cedar Str', 'Elm Str', 'Washington Ave', 'Lake Rd', 'Hill Rd',
+    'Park Ave', 'Pine Str', 'Walnut Str', 'Spring Str', 'Church Str', 'High Str', 'Mill Rd', 'River Rd')
+CAMPAIGN_NAMES = ('{0} for Mayor', '{0} for Congress', '{0} for Senate', '{0} for City Council', '{0} for Governor',
+    '{0} for School Board', 'Friends of {0}', 'Elect {0}')
+
+def insertRows(model, columns, rows):
+    """
+    Insert rows, each a tuple of values for 'columns', into the table of 'model' with one executemany.
+    For millions of rows this is several times faster than bulk_create, which builds a model instance
+    and compiles SQL for every row.  No field defaults or pre_save methods apply.
+    """
+    if not rows:
+        return
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {0} ({1}) VALUES ({2})'.format(quote(model._meta.db_table),
+        ', '.join(quote(column) for column in columns), ', '.join(['%s'] * len(columns)))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+def nextPk(model):
+    return (model.objects.aggregate(Max('pk'))['pk__max'] or 0) + 1
+
+def randomName(rng):
+    """Return the tuple (first name, last name, gender)."""
+    gender = rng.choice('MF')
+    return rng.choice(MALE_NAMES if gender == 'M' else FEMALE_NAMES), rng.choice(LAST_NAMES), gender
+
+def randomPhoneNumber(rng):
+    return '{0}555{1:04}'.format(rng.randint(201, 989), rng.randint(0, 9999))
+
+def randomAddress(rng, pk, city, now):
+    name, state, postal_prefix, latitude, longitude = city
+    return Address(pk=pk, street='{0} {1}'.format(rng.randint(1, 9999), rng.choice(STREETS)), city=name, state=state,
+        country='US', postal_code='{0}{1:02}'.format(postal_prefix, rng.randint(1, 99)),
+        latitude=latitude + rng.uniform(-CITY_RADIUS, CITY_RADIUS),
+        longitude=longitude + rng.uniform(-CITY_RADIUS, CITY_RADIUS), geocoded_on=now)
+
+def generateData(num_campaigns=10, workers_per_campaign=20, num_voters=100000, contact_rate=0.2, seed=0,
+        batch_size=BATCH_SIZE, log=None):
+    """
+    Add synthetic data and return a dictionary counting the rows added by kind.  Campaigns are spread
+    over CITIES, and every voter is a constituent of every campaign in the voter's city.  A fraction
+    'contact_rate' of the links between campaigns and voters have a VoterContact in the past two
+    years.  'log' is an optional function called with progress messages.
+    """
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    now = datetime.now()
+    password = make_password(SYNTHETIC_PASSWORD)    # Hashing is slow, so every user shares one hash
+    methods = list(ContactMethod.objects.values_list('pk', flat=True)) or [ContactMethod.objects.create(method='Phone').pk]
+    issues = list(Issue.objects.filter(is_active=True).values_list('pk', flat=True)[:10])
+    parties = list(PoliticalParty.objects.filter(country='US').values_list('pk', flat=True))
+    offices = list(Office.objects.filter(country='US').values_list('pk', flat=True))
+    counts = dict.fromkeys(('campaigns', 'users', 'addresses', 'voters', 'campaign_voters', 'contacts'), 0)
+
+    with transaction.atomic():
+        # Campaigns, owners, and workers.  Each user has a profile and an address.
+        address_pk, user_pk, campaign_pk = nextPk(Address), nextPk(TcsUser), nextPk(Campaign)
+        first_campaign_pk = campaign_pk
+        addresses, users, profiles, campaigns, workers = [], [], [], [], {}
+        for i in range(num_campaigns):
+            city = CITIES[i % len(CITIES)]
+            members = []
+            for j in range(workers_per_campaign + 1):   # The first is the owner
+                first_name, last_name, gender = randomName(rng)
+                addresses.append(randomAddress(rng, address_pk, city, now))
+                users.append(TcsUser(pk=user_pk, email='{0}.{1}.{2}@{3}'.format(first_name, last_name, user_pk,
+                    SYNTHETIC_DOMAIN).lower(), password=password, is_active=True))
+                profiles.append(TcsUserProfile(user_id=user_pk, name='{0} {1}'.format(first_name, last_name),
+                    phone_number=randomPhoneNumber(rng), gender=gender, address_id=address_pk))
+                members.append(user_pk)
+                address_pk += 1
+                user_pk += 1
+            campaigns.append(Campaign(pk=campaign_pk, owner_id=members[0], address_id=profiles[-len(members)].address_id,
+                name=rng.choice(CAMPAIGN_NAMES).format(rng.choice(LAST_NAMES)), phone_number=randomPhoneNumber(rng),
+                is_active=True, office_id=rng.choice(offices) if offices else None,
+                party_id=rng.choice(parties) if parties else None))
+            workers[campaign_pk] = members[1:] or members[:1]   # Owners contact voters when there are no workers
+            campaign_pk += 1
+        Address.objects.bulk_create(addresses)
+        TcsUser.objects.bulk_create(users)
+        TcsUserProfile.objects.bulk_create(profiles)
+        Campaign.objects.bulk_create(campaigns)
+        Campaign.workers.through.objects.bulk_create([Campaign.workers.through(campaign_id=campaign.pk, tcsuser_id=worker)
+            for campaign in campaigns for worker in workers[campaign.pk] if worker != campaign.owner_id])
+        VoterList.objects.bulk_create([VoterList(campaign_id=campaign.pk, dump_date=date.today(),
+            file_name='synthetic.tsv', processed='Synthetic data.') for campaign in campaigns])
+        updateSearchIndex(range(first_campaign_pk, campaign_pk))
+        counts['campaigns'] = len(campaigns)
+        counts['users'] = len(users)
+        counts['addresses'] = len(addresses)
+
+    voter_lists = dict(VoterList.objects.filter(campaign__pk__gte=first_campaign_pk).values_list('campaign_id', 'pk'))
+    campaigns_by_city = {}
+    for i, campaign in enumerate(campaigns):
+        campaigns_by_city.setdefault(i % len(CITIES), []).append(campaign.pk)
+    cities = sorted(campaigns_by_city)
+    bumpVersions('campaigns')
+
+    # Voters in households of 1 to 4, linked to every campaign in their city, with contact history
+    voter_pk, contact_pk = nextPk(Voter), nextPk(VoterContact)
+    created = 0
+    while created < num_voters:
+        addresses, voters, relations, contacts, contact_campaigns = [], [], [], [], []
+        while len(voters) < batch_size and created < num_voters:
+            city_index = rng.choice(cities)
+            address = randomAddress(rng, address_pk, CITIES[city_index], now)
+            addresses.append((address_pk, address.street, address.city, address.state, 'US', address.postal_code, now,
+                address.latitude, address.longitude, now))
+            cell = geohash.encode(address.latitude, address.longitude)
+            last_name = rng.choice(LAST_NAMES)
+            for i in range(min(rng.choice((1, 1, 2, 2, 2, 3, 4)), num_voters - created)):
+                first_name, unused, gender = randomName(rng)
+                voters.append((voter_pk, first_name, last_name,
+                    date(rng.randint(1935, 2000), rng.randint(1, 12), rng.randint(1, 28)), gender,
+                    rng.choice(parties) if parties and rng.random() < 0.7 else None, True,
+                    date(rng.randint(1960, 2018), rng.randint(1, 12), rng.randint(1, 28)),
+                    'SYN{0:010}'.format(voter_pk), date.today(), address_pk,
+                    randomPhoneNumber(rng) if rng.random() < 0.9 else '',
+                    randomPhoneNumber(rng) if rng.random() < 0.2 else '', '', 0, 0, 0))
+                for campaign_id in campaigns_by_city[city_index]:
+                    last_contacted = None
+                    if rng.random() < contact_rate:
+                        contacted = now - timedelta(days=rng.randint(0, 730))
+                        last_contacted = contacted.date()
+                        contacts.append((contact_pk, voter_pk, contacted, rng.choice(workers[campaign_id]),
+                            rng.choice(methods), json.dumps(dict((str(issue), rng.choice(('support', 'oppose')))
+                            for issue in rng.sample(issues, min(len(issues), 3)))), ''))
+                        contact_campaigns.append((contact_pk, campaign_id))
+                        contact_pk += 1
+                    relations.append((campaign_id, voter_pk, voter_lists[campaign_id], last_contacted, None, True, cell))
+                voter_pk += 1
+                created += 1
+            address_pk += 1
+
+        with transaction.atomic():
+            insertRows(Address, ('id', 'street', 'city', 'state', 'country', 'postal_code', 'datetime', 'latitude',
+                'longitude', 'geocoded_on'), addresses)
+            insertRows(Voter, ('id', 'first_name', 'last_name', 'dob', 'gender', 'affiliation_id', 'is_active',
+                'registration_date', 'registrar_id', 'dump_date', 'address_id', 'phone_number1', 'phone_number2',
+                'email', 'wrong_address', 'wrong_phone_number1', 'wrong_phone_number2'), voters)
+            insertRows(CampaignsToVoters, ('campaign_id', 'voter_id', 'voter_list_id', 'last_contacted', 'last_served',
+                'is_active', 'geohash'), relations)
+            insertRows(VoterContact, ('id', 'voter_id', 'contact_datetime', 'user_id', 'method_id',
+                'intelligence_report', 'client_key'), contacts)
+            insertRows(VoterContact.campaigns.through, ('votercontact_id', 'campaign_id'), contact_campaigns)
+        counts['addresses'] += len(addresses)
+        counts['voters'] += len(voters)
+        counts['campaign_voters'] += len(relations)
+        counts['contacts'] += len(contacts)
+        log('Added {0} of {1} voters.'.format(created, num_voters))
+
+    # Rows were inserted with explicit primary keys, which does not advance PostgreSQL sequences
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Address, TcsUser, Campaign, Voter, VoterContact]):
+            cursor.execute(sql)
+    # The rows bypassed the signals that keep the lists' counters
+    reconcileVoterLists(VoterList.objects.filter(pk__in=voter_lists.values()))
+    return counts
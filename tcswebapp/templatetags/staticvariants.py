@@ -0,0 +1,21 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+
+register = template.Library()
+
+@register.simple_tag
+def static_variant(name, width):
+    """
+    Return the url of the copy of image 'name' resized to 'width' pixels, or '' if collectstatic did not
+    build one.  See tcswebapp.staticassets.  For example:
+        {% static_variant 'campaigner/background.jpg' 960 as small_background %}
+    """
+    variant_url = getattr(staticfiles_storage, 'variantUrl', None)
+    return (variant_url and variant_url(name, width)) or ''
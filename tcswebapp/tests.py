@@ -0,0 +1,399 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from address.models import Address
+from campaign.models import Campaign, CampaignsToVoters, Office
+from datetime import date, datetime
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.templatetags.static import static
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from gzip import GzipFile
+from StringIO import StringIO
+from tcsuser.models import TcsUser
+from tcswebapp.benchmarks import BENCHMARKS, compareResults
+from tcswebapp.metrics import LATENCY_BUCKETS, getMetrics, getPercentile, newTotals, resetMetrics
+from tcswebapp.pagination import KeysetPaginator
+from tcswebapp import slowqueries
+from tcswebapp.querybudget import QueryBudgetMixin
+from tcswebapp.slowqueries import explain, getFingerprint, getSlowQueries, normalize, resetSlowQueries
+from tcswebapp.staticassets import StaticAssets, acceptsGzip, minifyCss, minifyJs
+from tcswebapp.synthetic import SYNTHETIC_DOMAIN, SYNTHETIC_PASSWORD, generateData
+from tcswebapp.throttle import TokenBucketThrottle
+from voter.models import ContactMethod, Voter, VoterContact
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+class StaticAssetsTests(TestCase):
+    """Tests for tcswebapp.staticassets."""
+
+    def setUp(self):
+        super(StaticAssetsTests, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def request(self, application, path, **environ):
+        """Return the tuple (status, headers, body) of a WSGI request."""
+        response = {}
+        def startResponse(status, headers):
+            response.update(status=status, headers=dict(headers))
+        environ.update(PATH_INFO=path, REQUEST_METHOD=environ.get('REQUEST_METHOD', 'GET'))
+        body = ''.join(application(environ, startResponse))
+        return response['status'], response['headers'], body
+
+    def testMinify(self):
+        """Minifying should keep the copyright notice and code, and change nothing within a line."""
+        source = '/***\nNotice\n***/\n\nfunction f() {\n    /*** Doc ***/\n    // Comment\n    return "/* a */" + 1;  // b\n}\n'
+        self.assertEqual(minifyJs(source), '/***\nNotice\n***/\nfunction f() {\nreturn "/* a */" + 1;  // b\n}\n')
+        self.assertEqual(minifyJs('x = 1; /* a */ y = 2;\n/* b */ z = 3;\n'), 'x = 1; /* a */ y = 2;\n/* b */ z = 3;\n')
+        self.assertEqual(minifyCss('/* Notice */\n/* This */\nul.a > li,\ntd  div\n{\n    color: red;\n}\n'),
+            '/* Notice */\nul.a>li,td div{color: red;}\n')
+
+    def testAcceptsGzip(self):
+        """Accept-Encoding q-values should be honored, so q=0 refuses gzip."""
+        for header in ('gzip', 'deflate, GZIP', 'gzip;q=0.5', 'gzip; q=1.0, identity', '*', 'x-gzip'):
+            self.assertTrue(acceptsGzip(header), header)
+        for header in ('', 'deflate', 'gzip;q=0', 'gzip; q=0.000, *', '*;q=0', 'br, *;q=0', 'gzipped'):
+            self.assertFalse(acceptsGzip(header), header)
+
+    def testCollectAndServe(self):
+        """collectstatic should write hashed, minified, and gzipped files, served with far-future headers."""
+        with override_settings(STATIC_ROOT=self.root):
+            self.assertEqual(static('campaigner/campaigner-dial.js'), '/static/campaigner/campaigner-dial.js')
+            call_command('collectstatic', interactive=False, verbosity=0)
+            hashed_url = static('campaigner/campaigner-dial.js')
+        self.assertRegexpMatches(hashed_url, r'^/static/campaigner/campaigner-dial\.[0-9a-f]{12}\.js$')
+        with open(os.path.join(self.root, hashed_url[len('/static/'):])) as f:
+            minified = f.read()
+        self.assertTrue(minified.startswith('/***\n(C) David J. Kalbfleisch'))
+        self.assertNotIn('\n    ', minified)
+        self.assertEqual(hashed_url.split('.')[-2], hashlib.md5(minified).hexdigest()[:12])   # The hash of the bytes served
+        with GzipFile(os.path.join(self.root, hashed_url[len('/static/'):] + '.gz')) as f:
+            self.assertEqual(f.read(), minified)
+
+        def application(environ, start_response):
+            start_response('404 Not Found', [])
+            return ['Not a static file']
+        assets = StaticAssets(application, self.root, '/static/')
+        status, headers, body = self.request(assets, hashed_url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual((status, headers['Content-Encoding']), ('200 OK', 'gzip'))
+        self.assertIn('immutable', headers['Cache-Control'])
+        self.assertRegexpMatches(headers['Content-Type'], r'^(application|text)/javascript; charset=utf-8$')
+        self.assertEqual(len(body), int(headers['Content-Length']))
+        status, headers, body = self.request(assets, hashed_url)
+        self.assertEqual((body, 'Content-Encoding' in headers), (minified, False))
+        status, headers, body = self.request(assets, hashed_url, HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertEqual((body, 'Content-Encoding' in headers), (minified, False))
+
+        # Unhashed names must be revalidated
+        status, headers, body = self.request(assets, '/static/campaigner/campaigner-dial.js')
+        self.assertEqual(headers['Cache-Control'], 'public, no-cache')
+        status, headers, body = self.request(assets, '/static/campaigner/campaigner-dial.js',
+            HTTP_IF_MODIFIED_SINCE=headers['Last-Modified'])
+        self.assertEqual((status, body), ('304 Not Modified', ''))
+
+        status, headers, body = self.request(assets, '/static/campaigner/missing.js')
+        self.assertEqual((status, body), ('404 Not Found', 'Not a static file'))
+        status, headers, body = self.request(assets, hashed_url, REQUEST_METHOD='POST')
+        self.assertEqual(status, '404 Not Found')
+
+class TokenBucketThrottleTests(TestCase):
+    """Tests for tcswebapp.throttle.TokenBucketThrottle."""
+
+    def testBurstAndRefill(self):
+        """A full bucket should allow 'capacity' requests and then one request per refill period."""
+        now = [1000000.0]
+        throttle = TokenBucketThrottle('test', capacity=2, refill_seconds=1, clock=lambda: now[0])
+        self.assertFalse(throttle.should_be_throttled('test@tcs.com'))
+        self.assertFalse(throttle.should_be_throttled('test@tcs.com'))
+        self.assertTrue(throttle.should_be_throttled('test@tcs.com'))
+        self.assertEqual(throttle.getRejectedCount(), 1)
+
+        # Other users and other resources have their own buckets
+        self.assertFalse(throttle.should_be_throttled('Neazy@tcs.com'))
+        self.assertFalse(TokenBucketThrottle('other', capacity=1).should_be_throttled('test@tcs.com'))
+
+        now[0] += 1.5   # Earns one token and half of another
+        self.assertFalse(throttle.should_be_throttled('test@tcs.com'))
+        self.assertTrue(throttle.should_be_throttled('test@tcs.com'))
+        self.assertEqual(throttle.getRejectedCount(), 2)
+
+    def testRetryAfter(self):
+        """A throttled request should be told how many seconds to wait for the next token."""
+        throttle = TokenBucketThrottle('test', capacity=1, refill_seconds=1800)
+        self.assertFalse(throttle.should_be_throttled('test@tcs.com'))
+        wait = throttle.should_be_throttled('test@tcs.com')
+        self.assertTrue(1790 < wait <= 1800)
+
+    def testOneQuery(self):
+        """After the bucket is created, each request should spend its token with a single UPDATE."""
+        throttle = TokenBucketThrottle('test', capacity=3, refill_seconds=1800)
+        self.assertFalse(throttle.should_be_throttled('test@tcs.com'))
+        with CaptureQueriesContext(connection) as context:
+            self.assertFalse(throttle.should_be_throttled('test@tcs.com'))
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertTrue(context.captured_queries[0]['sql'].startswith('UPDATE'))
+
+    @override_settings(API_THROTTLE_RATES={'test': (3, 1800)})
+    def testRateSetting(self):
+        """The setting API_THROTTLE_RATES should override the rate declared by a resource."""
+        throttle = TokenBucketThrottle('test', capacity=1, refill_seconds=1800)
+        for i in range(3):
+            self.assertFalse(throttle.should_be_throttled('test@tcs.com'))
+        self.assertTrue(throttle.should_be_throttled('test@tcs.com'))
+
+        # '*' applies to every scope not listed, such as the scopes of all resources in UNTHROTTLED_RATES
+        with override_settings(API_THROTTLE_RATES=dict(settings.UNTHROTTLED_RATES, test=(3, 1800))):
+            self.assertTrue(throttle.should_be_throttled('test@tcs.com'))
+            other = TokenBucketThrottle('other', capacity=1, refill_seconds=1800)
+            for i in range(100):
+                self.assertFalse(other.should_be_throttled('test@tcs.com'))
+
+class KeysetPaginatorTests(TestCase):
+    """Tests for tcswebapp.pagination.KeysetPaginator."""
+    fixtures = ['addresses.json']
+
+    def testDatetimeOrdering(self):
+        """Datetimes that differ by microseconds should be paged in order, each once."""
+        for i, microsecond in enumerate((100, 900, 500, 100)):
+            owner = TcsUser.objects.create_user('owner{0}@tcs.com'.format(i), 'Pa33word44')
+            campaign = Campaign.objects.create(owner=owner, address=Address.objects.first(), name='Sprout for POTUS')
+            Campaign.objects.filter(pk=campaign.pk).update(created_on=datetime(2016, 11, 8, 12, 0, 0, microsecond))
+        campaigns = Campaign.objects.order_by('-created_on')
+        seen = []
+        after = None
+        while True:
+            page = KeysetPaginator({'limit': 1, 'after': after}, campaigns, resource_uri='/api/v1/campaign/').page()
+            seen.extend(campaign.pk for campaign in page['objects'])
+            after = page['meta']['after']
+            if after is None:
+                break
+        self.assertEqual(seen, list(campaigns.order_by('-created_on', '-pk').values_list('pk', flat=True)))
+
+class HomeQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Query budget for the view home."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json', 'voterdialingtesting.json']
+
+    def setUp(self):
+        """Log in a user who owns a campaign."""
+        super(HomeQueryBudgetTests, self).setUp()
+        self.address = Address.objects.first()
+        self.method = ContactMethod.objects.create(method='Telephone (voice)')
+        self.user = self.createUser('test@tcs.com')
+        self.campaign = Campaign.objects.create(owner=self.user, address=self.address, name='Sprout for POTUS',
+            is_active=True)
+        self.addCampaigns(2)
+        self.client.login(email='test@tcs.com', password='Pa33word44')
+
+    def addCampaigns(self, number):
+        """
+        Add 'number' campaigns for which the user works and has contacted a voter, and as many to which
+        the user has offered to volunteer.  Each adds a worker and a prospect to the user's campaign.
+        """
+        office = Office.objects.get(country='US', level='F', title='President')
+        start = Campaign.objects.count()
+        for i in range(start, start + number):
+            campaign = Campaign.objects.create(owner=self.createUser('owner{0}@tcs.com'.format(i)),
+                address=self.address, name='Campaign {0}'.format(i), is_active=True)
+            campaign.addWorker(self.user)
+            contact = VoterContact.objects.create(voter=Voter.objects.first(), user=self.user, method=self.method)
+            contact.campaigns.add(campaign)
+            Campaign.objects.create(owner=self.createUser('prospect{0}@tcs.com'.format(i)), address=self.address,
+                name='Prospect {0}'.format(i), is_active=True, office=office).addProspect(self.user)
+            self.campaign.addWorker(self.createUser('worker{0}@tcs.com'.format(i)))
+            self.campaign.addProspect(self.createUser('volunteer{0}@tcs.com'.format(i)))
+        return number * 6
+
+    def testHome(self):
+        self.client.get(reverse('home'))
+        # 8 of the queries read the versions and the newest contacts keying the cached fragments
+        small, large = self.assertQueryBudget(19, lambda: self.getRendered(reverse('home')),
+            lambda: self.addCampaigns(20))
+        self.assertEqual([count for campaign, count in large.context['campaign_counts']], [1] * 22)
+        self.assertContains(large, 'Pending (22)')
+
+    def testHomeCache(self):
+        """The cached tables should be rendered again when the user's campaigns or contact counts change."""
+        url = reverse('home')
+        self.assertContains(self.client.get(url), 'Volunteering (2)')
+        supported = self.user.works_for.order_by('pk').first()
+        contact = VoterContact.objects.create(voter=Voter.objects.first(), user=self.user, method=self.method)
+        contact.campaigns.add(supported)
+        self.assertContains(self.client.get(url), '<td>2</td>')
+        self.client.get(reverse('campaign_leave', args=(supported.pk,)))
+        self.assertContains(self.client.get(url), 'Volunteering (1)')
+        self.client.get(reverse('campaign_leave', args=(self.user.prospect_for.first().pk,)))
+        self.assertContains(self.client.get(url), 'Pending (1)')
+        self.assertContains(self.client.get(url), '<span class="badge">2</span>')   # The campaign's prospects
+
+@override_settings(METRICS_FLUSH_SECONDS=0)
+class MetricsTests(TestCase):
+    """Tests for tcswebapp.metrics."""
+
+    def setUp(self):
+        TcsUser.objects.create_user('test@tcs.com', 'Pa33word44')
+        TcsUser.objects.filter(email='test@tcs.com').update(is_active=True)
+        self.client.login(email='test@tcs.com', password='Pa33word44')
+        resetMetrics()
+
+    def testRequestMetrics(self):
+        """Requests should be recorded by URL name and API resource, with their queries and serializer time."""
+        for i in range(3):
+            self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+        self.assertEqual(self.client.get('/api/v1/campaign/').status_code, 200)
+        self.client.get('/no/such/page/')
+
+        metrics = getMetrics()
+        self.assertEqual(metrics['home']['count'], 3)
+        self.assertEqual(sum(metrics['home']['histogram']), 3)
+        self.assertGreater(metrics['home']['queries'], 0)
+        self.assertGreater(metrics['home']['sql_seconds'], 0)
+        self.assertEqual(metrics['home']['serializer_seconds'], 0)
+        self.assertGreater(metrics['api_dispatch_list:campaign']['serializer_seconds'], 0)
+        self.assertEqual(metrics['<unresolved>']['count'], 1)
+
+        resetMetrics()
+        self.assertEqual(getMetrics(), {})
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def testEndpointAndCommand(self):
+        """The internal endpoint, given the token, and showmetrics should report the same endpoints."""
+        self.client.get(reverse('home'))
+        response = self.client.get(reverse('metrics'), HTTP_X_METRICS_TOKEN='s3cret')
+        self.assertEqual(json.loads(response.content)['home']['count'], 1)
+        # The client address does not matter, since a local proxy forwards every request from 127.0.0.1
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_X_METRICS_TOKEN='guess').status_code, 404)
+        with override_settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(reverse('metrics'), HTTP_X_METRICS_TOKEN='').status_code, 404)
+
+        out = StringIO()
+        call_command('showmetrics', stdout=out)
+        self.assertIn('home', out.getvalue())
+        self.assertIn('metrics', out.getvalue())
+
+    def testPercentile(self):
+        """Percentiles should be the bound of their bucket, or the maximum past the last bound."""
+        totals = newTotals()
+        totals['count'] = 100
+        totals['histogram'][0] = 90                             # <= 5 ms
+        totals['histogram'][LATENCY_BUCKETS.index(100)] = 9     # <= 100 ms
+        totals['histogram'][-1] = 1
+        totals['max_seconds'] = 7.5
+        self.assertEqual(getPercentile(totals, 0.5), 5)
+        self.assertEqual(getPercentile(totals, 0.95), 100)
+        self.assertEqual(getPercentile(totals, 0.995), 7500)
+
+@override_settings(SLOW_QUERY_ENABLED=True, SLOW_QUERY_MS=0, METRICS_FLUSH_SECONDS=0)
+class SlowQueryTests(TestCase):
+    """Tests for tcswebapp.slowqueries.  A threshold of 0 ms captures every query."""
+
+    def setUp(self):
+        TcsUser.objects.create_user('test@tcs.com', 'Pa33word44')
+        TcsUser.objects.filter(email='test@tcs.com').update(is_active=True)
+        self.client.login(email='test@tcs.com', password='Pa33word44')
+        resetSlowQueries()
+
+    def testNormalize(self):
+        """Statements that differ only in literals, parameters, or the length of IN lists should share a fingerprint."""
+        statements = [
+            "SELECT * FROM voter_voter WHERE id IN (%s, %s, %s) AND last_name = %s",
+            "SELECT *  FROM voter_voter WHERE id IN (1, 2) AND last_name = 'O''Brien'",
+            "SELECT * FROM voter_voter\nWHERE id IN (7) AND last_name = 'Smith 2'",
+        ]
+        self.assertEqual(normalize(statements[0]), 'SELECT * FROM voter_voter WHERE id IN (?) AND last_name = ?')
+        self.assertEqual(len(set(getFingerprint(normalize(statement)) for statement in statements)), 1)
+        self.assertNotEqual(getFingerprint(normalize('SELECT * FROM address_address WHERE id IN (1)')),
+            getFingerprint(normalize(statements[1])))
+
+    def testCapture(self):
+        """Slow queries should be grouped with their endpoints and plans, and shown by the command."""
+        for i in range(2):
+            caches['template_fragments'].clear()
+            self.assertEqual(self.client.get(reverse('home')).status_code, 200)
+        captures = getSlowQueries()
+        works_for = [capture for capture in captures if 'campaign_campaign_workers' in capture['statement']
+            and capture['statement'].startswith('SELECT')]
+        self.assertEqual(len(works_for), 1)
+        self.assertEqual(works_for[0]['count'], 2)
+        self.assertEqual(works_for[0]['endpoints'], {'home': 2})
+        self.assertTrue(works_for[0]['plan'])
+        self.assertIn('tcsuser_id', works_for[0]['sql'])
+
+        out = StringIO()
+        call_command('slowqueries', works_for[0]['fingerprint'], stdout=out)
+        self.assertIn('home (2)', out.getvalue())
+        self.assertIn('Plan:', out.getvalue())
+        out = StringIO()
+        call_command('slowqueries', '--reset', stdout=out)
+        self.assertIn(works_for[0]['fingerprint'], out.getvalue())
+        self.assertEqual(getSlowQueries(), [])
+
+    def testExplainFailure(self):
+        """A failed EXPLAIN should be rolled back to a savepoint, leaving the caller's transaction usable."""
+        with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(explain(connection, 'SELECT * FROM no_such_table', ())[0][:14], 'EXPLAIN failed')
+            self.assertTrue(TcsUser.objects.exists())
+        self.assertTrue(any(query['sql'].startswith('ROLLBACK TO SAVEPOINT') for query in queries.captured_queries))
+
+    @override_settings(METRICS_FLUSH_SECONDS=3600)
+    def testFlushInterval(self):
+        """Captures should be copied to the shared cache only when a flush is due."""
+        slowqueries.flush()
+        self.client.get(reverse('home'))
+        self.assertEqual(getSlowQueries(), [])
+        slowqueries.flush()
+        self.assertTrue(getSlowQueries())
+
+    @override_settings(SLOW_QUERY_CAPACITY=2)
+    def testCapacity(self):
+        """Each process should keep only the most recently seen statements."""
+        self.client.get(reverse('home'))
+        self.assertEqual(len(getSlowQueries()), 2)
+
+class SyntheticDataTests(TestCase):
+    """Tests for tcswebapp.synthetic and tcswebapp.benchmarks."""
+
+    def testGenerateData(self):
+        """Synthetic data should be consistent and usable by the application."""
+        counts = generateData(num_campaigns=3, workers_per_campaign=2, num_voters=500, contact_rate=0.5, batch_size=200)
+        self.assertEqual(counts['voters'], 500)
+        self.assertEqual(Voter.objects.count(), 500)
+        self.assertEqual(CampaignsToVoters.objects.count(), counts['campaign_voters'])
+        self.assertEqual(VoterContact.objects.count(), counts['contacts'])
+        self.assertEqual(CampaignsToVoters.objects.exclude(last_contacted=None).count(), counts['contacts'])
+        self.assertFalse(CampaignsToVoters.objects.filter(geohash='').exists())
+        campaign = Campaign.objects.order_by('pk').first()
+        self.assertEqual(campaign.workers.count(), 2)
+        self.assertTrue(campaign.owner.email.endswith('@' + SYNTHETIC_DOMAIN))
+        self.assertTrue(self.client.login(email=campaign.owner.email, password=SYNTHETIC_PASSWORD))
+
+        # Primary keys continue after the synthetic rows
+        self.assertGreater(Voter.objects.create(first_name='New', last_name='Voter', dump_date=date.today(),
+            address=campaign.address).pk, 500)
+
+    def testBenchmarkCommand(self):
+        """Every benchmark should run and be written to the results file."""
+        generateData(num_campaigns=2, workers_per_campaign=1, num_voters=100)
+        output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+        output.close()
+        self.addCleanup(os.remove, output.name)
+        call_command('benchmark', output=output.name, repeat=2, list_size=10, stdout=StringIO())
+        with open(output.name) as f:
+            report = json.load(f)
+        self.assertEqual(sorted(report['benchmarks']), sorted(name for name, function in BENCHMARKS))
+        self.assertEqual(report['scale']['voters'], 100)
+        self.assertEqual(report['benchmarks']['campaign_manage']['iterations'], 2)
+        self.assertEqual(Voter.objects.count(), 100)     # Every iteration was rolled back
+        self.assertEqual(len(compareResults(report, report)), len(BENCHMARKS) + 1)
@@ -0,0 +1,108 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Least
+from tastypie.throttle import BaseThrottle
+from tcswebapp.models import ThrottleBucket
+import math
+import time
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Throttle API requests with a token bucket per user and resource.  Each bucket holds up to
+    'capacity' tokens and earns one token every 'refill_seconds'.  A request spends one token,
+    and a request that finds the bucket empty is throttled.
+
+    Unlike tastypie.throttle.CacheThrottle, which keeps a growing list of access times, each
+    bucket is a single ThrottleBucket row holding the tokens left and the time they were counted.
+    A request spends a token with one conditional UPDATE that adds the tokens earned since then and
+    subtracts one only if the result is at least one.  The database applies the UPDATE atomically,
+    so concurrent requests in any number of server processes cannot spend the same token.
+
+    The setting API_THROTTLE_RATES can override the capacity and refill period of a resource.
+    It maps 'scope', or '*' for every scope not listed, to a tuple (capacity, refill_seconds).
+
+    http://django-tastypie.readthedocs.org/en/latest/throttling.html
+    """
+    def __init__(self, scope, capacity=1, refill_seconds=3600, clock=time.time):
+        """'clock' returns the current time in seconds; tests pass a fake one."""
+        super(TokenBucketThrottle, self).__init__(throttle_at=capacity, timeframe=refill_seconds)
+        self.scope = scope
+        self.clock = clock
+
+    def accessed(self, identifier, **kwargs):
+        """The token is spent in should_be_throttled, so there is nothing to record here."""
+        pass
+
+    def convert_identifier_to_key(self, identifier):
+        """Return a key unique to the identifier and the resource."""
+        return '{0}_{1}'.format(self.scope, super(TokenBucketThrottle, self).convert_identifier_to_key(identifier))
+
+    def getCache(self):
+        """Return the cache that counts throttled requests.  It is named by the setting THROTTLE_CACHE."""
+        return caches[getattr(settings, 'THROTTLE_CACHE', 'default')]
+
+    def getRate(self):
+        """Return the tuple (capacity, refill_seconds) for the resource."""
+        rates = getattr(settings, 'API_THROTTLE_RATES', {})
+        return rates.get(self.scope, rates.get('*', (self.throttle_at, self.timeframe)))
+
+    def getRejectedCount(self):
+        """Return the number of requests to the resource that have been throttled."""
+        return self.getCache().get(self.getRejectedKey(), 0)
+
+    def getRejectedKey(self):
+        return '{0}_throttle_rejected'.format(self.scope)
+
+    def should_be_throttled(self, identifier, **kwargs):
+        """
+        Add the tokens earned since the bucket was last updated, and try to spend one.  Return False
+        if the request may proceed.  Otherwise, return the number of seconds until a token is earned.
+        """
+        capacity, refill_seconds = self.getRate()
+        key = self.convert_identifier_to_key(identifier)
+        now = self.clock()
+        if self.spendToken(key, capacity, refill_seconds, now):
+            return False
+        try:
+            with transaction.atomic():
+                ThrottleBucket.objects.create(key=key, tokens=capacity - 1, updated=now)
+            return False
+        except IntegrityError:
+            pass    # The bucket exists; it is empty, or a concurrent request has just created it
+        if self.spendToken(key, capacity, refill_seconds, now):
+            return False
+        self.recordRejection()
+        bucket = ThrottleBucket.objects.get(key=key)
+        tokens = min(capacity, bucket.tokens + (now - bucket.updated) / float(refill_seconds))
+        return max(1, int(math.ceil((1 - tokens) * refill_seconds)))
+
+    def spendToken(self, key, capacity, refill_seconds, now):
+        """
+        Spend a token from the bucket 'key' if it has earned one by 'now'.  Return False if the bucket
+        is empty or does not exist.  The condition tokens + (now - updated) / refill_seconds >= 1 is
+        written as updated <= now - refill_seconds * (1 - tokens).
+        """
+        refill_seconds = float(refill_seconds)
+        return ThrottleBucket.objects.filter(key=key,
+            updated__lte=now - refill_seconds + F('tokens') * refill_seconds).update(
+            tokens=Least(float(capacity), F('tokens') + (now - F('updated')) / refill_seconds) - 1,
+            updated=now) > 0
+
+    def recordRejection(self):
+        """Increment the count of throttled requests to the resource."""
+        cache = self.getCache()
+        key = self.getRejectedKey()
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None) # The key was culled between add() and incr()
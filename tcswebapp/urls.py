@@ -5,20 +5,22 @@ All rights reserved.  You are welcome to inspect this code for your education or
 the author's qualifications.  No other uses are permitted.
 """
 
-from campaign.api import CampaignResource
+from campaign.api import CampaignResource, WalkListResource
 from django.conf.urls import include, url
 from django.contrib.auth import views as auth_views
 from tastypie.api import Api
-from voter.api import IssueResource, VoterResource, VoterContactResource
+from voter.api import ContactMethodResource, IssueResource, VoterResource, VoterContactResource
 from . import views
 
 # This application uses the TastyPie add-on to implement a RESTful API.  For a list of
 # endpoints, visit <domain root>/api/v1/.
 v1_api = Api(api_name='v1')
 v1_api.register(CampaignResource())
+v1_api.register(ContactMethodResource())
 v1_api.register(IssueResource())
 v1_api.register(VoterResource())
 v1_api.register(VoterContactResource())
+v1_api.register(WalkListResource())
 
 urlpatterns = [
     # These urls use built-in authentication views for logging in and out.
@@ -28,6 +30,9 @@ urlpatterns = [
     # This is the main dashboard for logged-in users.
     url(r'^home/$', views.home, name='home'),
 
+    # Request metrics for operators; see tcswebapp.metrics.
+    url(r'^internal/metrics/$', views.metrics, name='metrics'),
+
     # Include urls for applications.
     url(r'^api/', include(v1_api.urls)),
     url(r'^campaign/', include('campaign.urls')),
@@ -5,8 +5,16 @@ All rights reserved.  You are welcome to inspect this code for your education or
 the author's qualifications.  No other uses are permitted.
 """
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.db.models import Count
+from django.http import Http404, JsonResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+from tcswebapp.apicache import CONTACTS_VERSION, ROSTER_VERSION, USER_CONTACTS_VERSION, VOTERS_VERSION, getFragmentVersion
+from tcswebapp.metrics import flush, getMetrics
+from voter.models import VoterContact, getContactsMark
 
 @login_required
 def home(request):
@@ -14,7 +22,40 @@ def home(request):
     This is the main dashboard.  The template displays a list of campaigns the user supports,
     and this view queries to determine the number of voters the user has contacted on behalf of
     each campaign.
+
+    The template caches its tables, keyed by the versions of the data in them, so the queries are
+    lazy and run only when a table is rendered again.
+    """
+    user = request.user
+    campaign = getattr(user, 'campaign', None)
+    campaigns_supported = SimpleLazyObject(lambda: list(user.works_for.all()))
+
+    def getCampaignCounts():
+        # Count the user's contacts for every campaign in one query
+        counts = dict(VoterContact.objects.filter(user=user, campaigns__in=campaigns_supported).order_by()
+            .values_list('campaigns').annotate(count=Count('pk')))
+        return [(supported, counts.get(supported.pk, 0)) for supported in campaigns_supported]
+
+    return render(request, 'tcswebapp/home.html', {
+        'campaigns_supported': campaigns_supported,
+        'campaign_counts': SimpleLazyObject(getCampaignCounts),
+        'prospect_for': SimpleLazyObject(lambda: list(user.prospect_for.select_related('office'))),
+        'user_version': getFragmentVersion('campaigns', 'campaigns_user_{0}'.format(user.pk),
+            USER_CONTACTS_VERSION.format(user.pk), marks=[getContactsMark(user_id=user.pk)]),
+        'campaign_version': campaign and getFragmentVersion(ROSTER_VERSION.format(campaign.pk),
+            CONTACTS_VERSION.format(campaign.pk), VOTERS_VERSION.format(campaign.pk),
+            marks=[getContactsMark(campaign_id=campaign.pk)]),
+    })
+
+def metrics(request):
+    """
+    Return the request metrics of every endpoint as JSON.  Only requests that send METRICS_TOKEN in
+    the X-Metrics-Token header may see them; everyone else receives 404.  The client address is not
+    trusted, because behind a proxy on the same host every request comes from 127.0.0.1.  See
+    tcswebapp.metrics.
     """
-    campaigns_supported = request.user.works_for.all()
-    campaign_counts = [(campaign, campaign.voterContactCount(request.user)) for campaign in campaigns_supported]
-    return render(request, 'tcswebapp/home.html', {'campaigns_supported': campaigns_supported, 'campaign_counts': campaign_counts})
+    token = request.META.get('HTTP_X_METRICS_TOKEN', '')
+    if not settings.METRICS_TOKEN or not constant_time_compare(token, settings.METRICS_TOKEN):
+        raise Http404()
+    flush()     # Include this process's latest requests
+    return JsonResponse(getMetrics())
@@ -21,4 +21,5 @@ import os
 # Development settings only.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "tcswebapp.settings")
 from django.core.wsgi import get_wsgi_application
-application = get_wsgi_application()
+from tcswebapp.staticassets import StaticAssets
+application = StaticAssets(get_wsgi_application())   # Serves the files collected to STATIC_ROOT
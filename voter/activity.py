@@ -0,0 +1,94 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Bulk activation and deactivation of voter lists.  Saving each VoterList separately issues an UPDATE
+of the list's rows of CampaignsToVoters for every list, and a list can have hundreds of thousands of
+rows, so a request that toggles many lists could hold locks for minutes.  setListActivity instead
+checks the lists with one query and flips them with one UPDATE.  The rows of small lists are updated
+with one more UPDATE in the same request.  The rows of large lists are left to a worker, the
+applylistactivity management command, which updates them in short batches and records its progress
+in VoterListActivityJob, so that the voter lists page can show it.
+
+Run one worker at a time.
+"""
+
+from campaign.models import CampaignsToVoters
+from datetime import datetime
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.db.models import BooleanField, Case, F, IntegerField, Value, When
+from tcswebapp.apicache import VOTERS_VERSION, bumpVersions
+from voter.models import VoterList, VoterListActivityJob
+
+BACKGROUND_THRESHOLD = 20000    # Lists with more voters are updated by the worker
+BATCH_SIZE = 5000               # Rows of CampaignsToVoters per UPDATE in the worker
+
+def setListActivity(campaign, activity, background_threshold=BACKGROUND_THRESHOLD):
+    """
+    Set the 'is_active' values of voter lists.  'activity' maps the primary keys of lists to their new
+    values.  Raise PermissionDenied, and change nothing, unless 'campaign' owns every list.  Return the
+    list of VoterListActivityJob instances added for lists of more than 'background_threshold' voters.
+    They are added with bulk_create, so their primary keys may not be set.
+    """
+    lists = dict((pk, (campaign_id, is_active, voter_count)) for pk, campaign_id, is_active, voter_count in
+        VoterList.objects.filter(pk__in=activity).values_list('pk', 'campaign', 'is_active', 'voter_count'))
+    if len(lists) != len(activity) or any(campaign_id != campaign.pk for campaign_id, is_active, voter_count in
+            lists.values()):
+        raise PermissionDenied("You must manage the campaign that owns a voter list.")
+    changed = [pk for pk, (campaign_id, is_active, voter_count) in lists.items() if is_active != activity[pk]]
+    if not changed:
+        return []
+    activated = [pk for pk in changed if activity[pk]]
+    large = [pk for pk in changed if lists[pk][2] > background_threshold]
+    small = [pk for pk in changed if pk not in large]
+    with transaction.atomic():
+        # A job still running for a list is superseded.  Deleting it waits for the worker's current batch.
+        VoterListActivityJob.objects.filter(voter_list__in=changed, finished_on=None).delete()
+        VoterList.objects.filter(pk__in=changed).update(
+            is_active=Case(When(pk__in=activated, then=Value(True)), default=Value(False), output_field=BooleanField()),
+            active_count=Case(When(pk__in=[pk for pk in small if activity[pk]], then=F('voter_count')),
+                When(pk__in=small, then=Value(0)), default=F('active_count'), output_field=IntegerField()))
+        if small:
+            CampaignsToVoters.objects.filter(voter_list__in=small).update(is_active=Case(
+                When(voter_list__in=activated, then=Value(True)), default=Value(False), output_field=BooleanField()))
+        jobs = [VoterListActivityJob(voter_list_id=pk, is_active=activity[pk], total=lists[pk][2]) for pk in large]
+        VoterListActivityJob.objects.bulk_create(jobs)
+    bumpVersions(VOTERS_VERSION.format(campaign.pk))
+    return jobs
+
+def applyListActivity(batch_size=BATCH_SIZE):
+    """
+    Apply every unfinished VoterListActivityJob, updating at most 'batch_size' rows of CampaignsToVoters
+    per transaction.  Return the number of rows updated.
+    """
+    updated = 0
+    for job in VoterListActivityJob.objects.filter(finished_on=None).select_related('voter_list').order_by('pk'):
+        updated += applyJob(job, batch_size)
+    return updated
+
+def applyJob(job, batch_size):
+    """Apply one VoterListActivityJob in batches, and return the number of rows updated."""
+    updated = 0
+    last_pk = 0
+    rows = CampaignsToVoters.objects.filter(voter_list=job.voter_list_id).exclude(is_active=job.is_active).order_by('pk')
+    while True:
+        with transaction.atomic():
+            # Lock the job first.  If setListActivity superseded it, stop.
+            if not VoterListActivityJob.objects.select_for_update().filter(pk=job.pk, finished_on=None).exists():
+                return updated
+            pks = list(rows.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                VoterListActivityJob.objects.filter(pk=job.pk).update(finished_on=datetime.now())
+                break
+            last_pk = pks[-1]
+            count = CampaignsToVoters.objects.filter(pk__in=pks).update(is_active=job.is_active)
+            VoterListActivityJob.objects.filter(pk=job.pk).update(done=F('done') + count)
+            VoterList.addToCounts('active_count', {job.voter_list_id: count if job.is_active else -count})
+        updated += count
+        bumpVersions(VOTERS_VERSION.format(job.voter_list.campaign_id))     # Show the progress
+    bumpVersions(VOTERS_VERSION.format(job.voter_list.campaign_id))
+    return updated
@@ -0,0 +1,134 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Bulk exports of a campaign's constituents and intelligence reports.  Rows are read in chunks ordered
+by primary key, and each chunk starts after the last key of the previous chunk.  Unlike OFFSET, this
+costs the same for every chunk, and unlike iterating over a whole QuerySet, it never holds more than
+one chunk in memory.  The generators here produce encoded lines suitable for StreamingHttpResponse or
+for writing to a file.
+"""
+
+from campaign.models import CampaignsToVoters
+from csv import writer
+from django.core.serializers.json import DjangoJSONEncoder
+from voter.models import VoterContact
+import json
+import zlib
+
+CHUNK_SIZE = 2000
+
+# Export column names mapped to QuerySet.values() lookups
+CONSTITUENT_FIELDS = (
+    ('voter_id', 'voter_id'),
+    ('registrar_id', 'voter__registrar_id'),
+    ('first_name', 'voter__first_name'),
+    ('last_name', 'voter__last_name'),
+    ('dob', 'voter__dob'),
+    ('gender', 'voter__gender'),
+    ('affiliation', 'voter__affiliation__title'),
+    ('registration_date', 'voter__registration_date'),
+    ('street', 'voter__address__street'),
+    ('city', 'voter__address__city'),
+    ('state', 'voter__address__state'),
+    ('country', 'voter__address__country'),
+    ('postal_code', 'voter__address__postal_code'),
+    ('phone_number1', 'voter__phone_number1'),
+    ('phone_number2', 'voter__phone_number2'),
+    ('email', 'voter__email'),
+    ('voter_is_active', 'voter__is_active'),
+    ('voter_list_id', 'voter_list_id'),
+    ('is_active', 'is_active'),
+    ('last_contacted', 'last_contacted'),
+    ('last_served', 'last_served'),
+)
+
+CONTACT_FIELDS = (
+    ('id', 'id'),
+    ('voter_id', 'voter_id'),
+    ('contact_datetime', 'contact_datetime'),
+    ('user', 'user__email'),
+    ('method', 'method__method'),
+    ('intelligence_report', 'intelligence_report'),
+)
+
+EXPORTS = {
+    # kind: (function returning a QuerySet for a campaign, fields)
+    'voters': (lambda campaign: CampaignsToVoters.objects.filter(campaign=campaign), CONSTITUENT_FIELDS),
+    'contacts': (lambda campaign: VoterContact.objects.filter(campaigns=campaign), CONTACT_FIELDS),
+}
+
+def iterRows(queryset, fields, chunk_size=CHUNK_SIZE):
+    """Yield a tuple of values, in the order of 'fields', for each row of 'queryset'."""
+    lookups = [lookup for name, lookup in fields]
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk.values_list('pk', *lookups)[:chunk_size])
+        for row in chunk:
+            yield row[1:]
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1][0]
+
+class _Echo(object):
+    """A file-like object for csv.writer that returns each line instead of storing it."""
+    def write(self, value):
+        return value
+
+def toCsv(rows, fields):
+    """Yield UTF-8 encoded CSV lines, starting with a header line."""
+    csv_writer = writer(_Echo())
+    yield csv_writer.writerow([name for name, lookup in fields])
+    for row in rows:
+        yield csv_writer.writerow([_csvValue(value) for value in row])
+
+def _csvValue(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+def toNdjson(rows, fields):
+    """Yield UTF-8 encoded newline-delimited JSON objects."""
+    names = [name for name, lookup in fields]
+    for row in rows:
+        yield json.dumps(dict(zip(names, row)), cls=DjangoJSONEncoder, sort_keys=True) + '\n'
+
+FORMATS = {
+    # output format: (function, content type)
+    'csv': (toCsv, 'text/csv'),
+    'ndjson': (toNdjson, 'application/x-ndjson'),
+}
+
+def gzipStream(lines, buffer_size=65536):
+    """Compress a stream of byte strings into gzip format, yielding compressed blocks."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # 16 + MAX_WBITS writes a gzip header
+    buffered = []
+    size = 0
+    for line in lines:
+        buffered.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            block = compressor.compress(''.join(buffered))
+            buffered, size = [], 0
+            if block:
+                yield block
+    yield compressor.compress(''.join(buffered)) + compressor.flush()
+
+def exportCampaign(campaign, kind, output_format, gzip=False, chunk_size=CHUNK_SIZE):
+    """
+    Return a generator of byte strings for the export 'kind' ('voters' or 'contacts') of 'campaign' in
+    'output_format' ('csv' or 'ndjson'), optionally gzipped.
+    """
+    get_queryset, fields = EXPORTS[kind]
+    lines = FORMATS[output_format][0](iterRows(get_queryset(campaign), fields, chunk_size), fields)
+    return gzipStream(lines) if gzip else lines
@@ -6,8 +6,11 @@ the author's qualifications.  No other uses are permitted.
 """
 
 from django import forms
+from django.forms.formsets import ManagementForm
 from voter.models import Voter, VoterList
 
+MAX_LISTS_PER_REQUEST = 1000
+
 class VoterForm(forms.ModelForm):
     """Use this form to validate prospective Voter instances."""
     class Meta:
@@ -40,6 +43,15 @@ class VoterListForm(forms.ModelForm):
         model = VoterList
         exclude = ('is_active', 'processed')
 
+    def __init__(self, *args, **kwargs):
+        """'campaign' is the campaign uploading the list.  Only its lists can be updated."""
+        campaign = kwargs.pop('campaign', None)
+        super(VoterListForm, self).__init__(*args, **kwargs)
+        self.fields['previous'].queryset = VoterList.objects.filter(campaign=campaign).order_by('-upload_datetime')
+        self.fields['previous'].empty_label = 'No, add its voters'
+        self.fields['previous'].label_from_instance = lambda voter_list: '{0} ({1})'.format(
+            voter_list.getShortFileName(), voter_list.dump_date)
+
     def clean_file_name(self):
         """The uploaded file must be less than 2MB, and it must be plain text, TSV, or CSV."""
         if self.cleaned_data['file_name'].size > 2000000:   # 2 megabytes
@@ -47,3 +59,24 @@ class VoterListForm(forms.ModelForm):
         if self.cleaned_data['file_name'].content_type not in ('text/plain', 'text/csv'):
             raise forms.ValidationError('Voter lists must be plain text, TSV, or CSV files.')
         return self.cleaned_data['file_name']
+
+def getListActivity(data, prefix='form'):
+    """
+    Return a dictionary mapping the primary keys of voter lists to 'is_active' values from the POST
+    data of the VoterList formset in voter/lists.html.  Unlike the formset, this loads no lists.  Raise
+    ValidationError if the data is malformed.
+    """
+    management_form = ManagementForm(data, prefix=prefix)
+    if not management_form.is_valid():
+        raise forms.ValidationError('The voter list form is incomplete.')
+    total = management_form.cleaned_data['TOTAL_FORMS']
+    if total > MAX_LISTS_PER_REQUEST:
+        raise forms.ValidationError('You may change at most {0} voter lists at once.'.format(MAX_LISTS_PER_REQUEST))
+    id_field, is_active_field = forms.IntegerField(), forms.BooleanField(required=False)
+    checkbox = forms.CheckboxInput()
+    activity = {}
+    for index in range(total):
+        name = '{0}-{1}-'.format(prefix, index)
+        activity[id_field.clean(data.get(name + 'id'))] = is_active_field.clean(
+            checkbox.value_from_datadict(data, None, name + 'is_active'))
+    return activity
@@ -0,0 +1,372 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+Importing uploaded voter lists.  voter.signals.processVoterList reads a new VoterList with ListReader
+and passes the rows to importVoterList, which adds the voters it has not seen, or to importDelta, if
+the list is a newer dump of an earlier list of the campaign (VoterList.previous).
+
+importDelta compares the two lists by canonical voter key (see getVoterKey).  Both sides are sorted
+by key and merged in one pass, which sorts each voter into one of four outcomes:
+    added - Only in the new list.  The voter is related to the campaign, as by importVoterList.
+    updated - In both lists, with changed data, such as a new phone number or address.  The shared
+        Voter row is updated, unless another campaign has uploaded a newer dump of the voter.
+    unchanged - In both lists, with the same data.
+    retired - Only in the earlier list.  The voter is shared with other campaigns, so the voter is
+        retired by deactivating the campaign's row of CampaignsToVoters, not the Voter.
+Rows of voters in both lists move to the new list, so that they keep their contact history, and the
+earlier list keeps only the retired rows and is deactivated.  Each outcome is applied in bulk.  A new
+phone number can change whether a shared voter is dialable, so the lists of other campaigns that hold
+updated voters are counted again (see voter.models.reconcileVoterLists).
+"""
+
+from address import geohash
+from address.forms import AddressForm
+from campaign.models import CampaignsToVoters, PoliticalParty
+from csv import DictReader
+from dateutil.parser import parse
+from django.db import connection, transaction
+from django.db.models import Case, CharField, Value, When
+from voter.forms import VoterForm
+from voter.models import Voter, VoterList, VoterListActivityJob, countVoterList, reconcileVoterLists
+
+# Fields compared by importDelta.  Registrar IDs are part of the key, and affiliations and addresses are
+# compared separately.
+VOTER_FIELDS = ('first_name', 'last_name', 'dob', 'gender', 'registration_date', 'phone_number1', 'phone_number2',
+    'email')
+DIALABLE_FIELDS = frozenset(['phone_number1', 'phone_number2', 'wrong_phone_number1', 'wrong_phone_number2'])
+ADDRESS_FIELDS = ('street', 'city', 'state', 'country', 'postal_code')
+
+class ListReader(object):
+    """
+    Read a voter list file, and yield a tuple (voter form, address form) of valid forms for each valid
+    row.  Count the lines read and the rows in a bad format.  Political parties are looked up once per
+    distinct affiliation.
+    """
+    def __init__(self, f, voter_list):
+        self.reader = DictReader(f, delimiter='\t') # Assumes the first row contains column names.
+        self.dump_date = voter_list.dump_date
+        self.default_country = str(voter_list.campaign.address.country) # The relevant campaign's home country
+        self.line_count = 0
+        self.num_bad_format = 0
+        self.affiliations = {}      # Affiliation text -> PoliticalParty or None
+
+    def __iter__(self):
+        for voter in self.reader:
+            self.line_count += 1
+            # Must catch KeyError and ValueError.
+            try:
+                voter_form, address_form, affiliation = self.getForms(voter)
+            except (KeyError, ValueError):
+                self.num_bad_format += 1    # Missing required data
+                continue                    # Move on to the next line in the input file.
+            if voter_form.is_valid() and address_form.is_valid():
+                # The party was looked up once, instead of being validated by a query per row
+                voter_form.cleaned_data['affiliation'] = affiliation
+                voter_form.instance.affiliation = affiliation
+                yield voter_form, address_form
+            else:
+                self.num_bad_format += 1    # No required data missing, but the provided data is invalid.
+
+    def getAffiliation(self, affiliation):
+        """
+        Voter political affiliations are a ForeignKey in the Voter model, but the user uploads text.
+        Return the political party operating in the campaign's country, or None.
+        """
+        if affiliation not in self.affiliations:
+            try:
+                self.affiliations[affiliation] = PoliticalParty.objects.get(
+                    country=self.default_country,
+                    title__icontains=affiliation
+                )
+            except (PoliticalParty.DoesNotExist, PoliticalParty.MultipleObjectsReturned):
+                self.affiliations[affiliation] = None   # Ignore the ambiguous party information.
+        return self.affiliations[affiliation]
+
+    def getForms(self, voter):
+        """
+        Return unvalidated forms for a row and the voter's PoliticalParty or None.  Raise KeyError or
+        ValueError if the row is malformed.
+        """
+        # Convert date strings to datetime.Date instances.  Failure to convert raises ValueError.
+        if voter['registration_date']:
+            voter['registration_date'] = parse(voter['registration_date']).date()
+
+        if voter['dob']:
+            voter['dob'] = parse(voter['dob']).date()
+
+        affiliation = voter['affiliation'].strip()
+        affiliation = self.getAffiliation(affiliation) if affiliation != '' else None
+
+        voter_form = VoterForm({
+            'first_name': voter['first_name'],
+            'last_name': voter['last_name'],
+            'dob': voter['dob'],
+            'gender': voter['gender'],
+            'affiliation': None,                    # Set by __iter__ after validation
+            'registration_date': voter['registration_date'],
+            'registrar_id': voter['registrar_id'],
+            'dump_date': self.dump_date,
+            'phone_number1': voter['phone_number1'],
+            'phone_number2': voter['phone_number2'],
+            'email': voter['email'],
+        })
+
+        # Use the default country if necessary.
+        if voter['country'] == '':
+            voter['country'] = self.default_country
+
+        address_form = AddressForm({
+            'street': voter['street'],
+            'city': voter['city'],
+            'state': voter['state'],
+            'country': voter['country'],
+            'postal_code': voter['postal_code'],
+        })
+        return voter_form, address_form, affiliation
+
+def getOrCreateVoter(voter_form, address_form):
+    """Return the Voter matching valid forms, adding the voter if necessary."""
+    # Is this voter already in the database?  Look for active voters with the same registrar_id,
+    # street address, country, and state.
+    # TODO - Registrar IDs are stored as-is and matched case-insensitively.
+    # Should I just lower/upper-case and match exact?  Should case matter?
+    v = Voter.objects.filter(is_active=True, registrar_id__iexact=voter_form.cleaned_data['registrar_id'],
+        address__street=address_form.cleaned_data['street'],
+        address__country=address_form.cleaned_data['country'],
+        address__state=address_form.cleaned_data['state']).select_related('address').first()
+    if not v:
+        # The voter is not in the database or is not active.  Add him or her.
+        voter_form.instance.address = address_form.get_or_create()
+        v = voter_form.save()
+    return v
+
+def getGeohash(address):
+    """Return the geohash of an address, or '' if it has not been geocoded."""
+    location = address.latitude, address.longitude
+    return geohash.encode(*location) if None not in location else ''
+
+def makeRelation(voter_list, v):
+    """Return an unsaved CampaignsToVoters instance relating a voter to the list's campaign."""
+    # Addresses may be shared and already geocoded
+    return CampaignsToVoters(campaign=voter_list.campaign, voter=v, voter_list=voter_list,
+        geohash=getGeohash(v.address))
+
+def relocateVoters(voters):
+    """
+    Set the geohash of every campaign's rows of CampaignsToVoters for voters whose addresses changed,
+    with one UPDATE per batch, like updateRows.  Rows of voters at addresses not yet geocoded are cleared
+    for indexVoterLocations.
+    """
+    if not voters:
+        return
+    # Each voter costs two parameters in the CASE expression and one in the WHERE clause
+    batch_size = max(1, connection.ops.bulk_batch_size([None] * 3, voters))
+    for batch in getBatches(voters, batch_size):
+        CampaignsToVoters.objects.filter(voter__in=[v.pk for v in batch]).update(geohash=Case(
+            *[When(voter=v.pk, then=Value(getGeohash(v.address))) for v in batch], output_field=CharField()))
+
+def importVoterList(voter_list, reader):
+    """
+    For each valid row from a ListReader, add the voter to the Voter table if necessary, and relate
+    the voter to the list's campaign.  Return a dictionary of outcome counts.
+    """
+    num_successes = 0
+    num_duplicates = 0
+    num_dialable = 0
+    new_voter_relations = [] # A list of new CampaignsToVoters instances to add in bulk after processing the list
+
+    # Two scenarios can raise an IntegrityError by duplicating a (campaign, voter) combination in the
+    # database table Campaign.campaignstovoters:
+    #   1) Duplicate voters are present in the new list.
+    #   2) The same campaign has already submitted a voter in another list.
+    # Having multiple m2m relations associated with different lists is desirable, but the framework
+    # does not support this.  Simply ignore voters already present from another list or this one.
+    campaign_voters = set(CampaignsToVoters.objects.filter(campaign=voter_list.campaign).values_list('voter',
+        flat=True))
+    for voter_form, address_form in reader:
+        v = getOrCreateVoter(voter_form, address_form)
+        if v.pk not in campaign_voters:
+            campaign_voters.add(v.pk)
+            new_voter_relations.append(makeRelation(voter_list, v))
+            num_successes += 1
+            num_dialable += v.isDialable()
+        else:
+            num_duplicates += 1
+
+    # Update the many-to-many relationship.
+    CampaignsToVoters.objects.bulk_create(new_voter_relations)
+    return {'lines': reader.line_count, 'added': num_successes, 'duplicates': num_duplicates,
+        'bad_format': reader.num_bad_format, 'voter_count': num_successes, 'dialable_count': num_dialable}
+
+def getVoterKey(country, state, registrar_id, first_name, last_name, dob, street):
+    """
+    Return the canonical key of a voter: the country, state, and registrar ID, which registrars keep
+    when voters move or change their names.  Voters without registrar IDs are keyed by name, date of
+    birth, and street.  Keys of both kinds sort together.
+    """
+    registrar_id = registrar_id.strip().upper()
+    if registrar_id:
+        return (unicode(country), state.upper(), registrar_id)
+    return (unicode(country), state.upper(), u'', last_name.upper(), first_name.upper(),
+        dob.isoformat() if dob else u'', street.upper())
+
+def mergeByKey(old, new):
+    """
+    Merge two iterables of tuples (key, value) sorted by key.  Yield a tuple (key, old value, new value)
+    for each key, with None for a value missing from one side.  Keys must be unique in 'new'.  A key
+    repeated in 'old' is matched once, and its other values are yielded as missing from 'new'.
+    """
+    old, new = iter(old), iter(new)
+    old_item, new_item = next(old, None), next(new, None)
+    while old_item is not None or new_item is not None:
+        if new_item is None or (old_item is not None and old_item[0] < new_item[0]):
+            yield old_item[0], old_item[1], None
+            old_item = next(old, None)
+        elif old_item is None or new_item[0] < old_item[0]:
+            yield new_item[0], None, new_item[1]
+            new_item = next(new, None)
+        else:
+            yield old_item[0], old_item[1], new_item[1]
+            old_item, new_item = next(old, None), next(new, None)
+
+def getBatches(items, size):
+    """Yield successive slices of a list."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def updateRows(model, objects, fields):
+    """
+    Save 'fields' of model instances with one UPDATE per batch, using a CASE expression per field.
+    Batches are as large as the database allows.
+    """
+    if not objects or not fields:
+        return
+    model_fields = [model._meta.get_field(name) for name in fields]
+    # Each object costs two parameters per field, and one in the WHERE clause
+    batch_size = max(1, connection.ops.bulk_batch_size([None] * (2 * len(fields) + 1), objects))
+    for batch in getBatches(objects, batch_size):
+        model._default_manager.filter(pk__in=[obj.pk for obj in batch]).update(**dict((field.name, Case(
+            *[When(pk=obj.pk, then=Value(getattr(obj, field.attname))) for obj in batch],
+            output_field=field.target_field if field.is_relation else field)) for field in model_fields))
+
+def updateVoter(v, voter_form, address_form, dump_date):
+    """
+    Copy the data of valid forms into a Voter.  Return the names of the fields changed.  A new phone
+    number or address clears the counts of reports that it is wrong.
+    """
+    changed = []
+    for name in VOTER_FIELDS:
+        if getattr(v, name) != voter_form.cleaned_data[name]:
+            setattr(v, name, voter_form.cleaned_data[name])
+            changed.append(name)
+    affiliation = voter_form.cleaned_data['affiliation']
+    if v.affiliation_id != (affiliation.pk if affiliation else None):
+        v.affiliation_id = affiliation.pk if affiliation else None
+        changed.append('affiliation')
+    for number in ('phone_number1', 'phone_number2'):
+        if number in changed and getattr(v, 'wrong_' + number):
+            setattr(v, 'wrong_' + number, 0)
+            changed.append('wrong_' + number)
+    if any(unicode(getattr(v.address, name)) != unicode(address_form.cleaned_data[name]) for name in ADDRESS_FIELDS):
+        v.address = address_form.get_or_create()
+        changed.append('address')
+        if v.wrong_address:
+            v.wrong_address = 0
+            changed.append('wrong_address')
+    if changed:
+        v.dump_date = dump_date
+        changed.append('dump_date')
+    return changed
+
+def importDelta(voter_list, reader, batch_size=500):
+    """
+    Compare the valid rows from a ListReader with the voters of voter_list.previous, and add, update,
+    and retire voters as described above.  Return a dictionary of outcome counts.
+    """
+    previous = voter_list.previous
+    counts = {'lines': 0, 'added': 0, 'updated': 0, 'unchanged': 0, 'retired': 0, 'duplicates': 0}
+
+    # The new list, keyed.  A later row with the key of an earlier row is a duplicate.
+    new_rows = {}
+    for voter_form, address_form in reader:
+        data, address = voter_form.cleaned_data, address_form.cleaned_data
+        key = getVoterKey(address['country'], address['state'], data['registrar_id'], data['first_name'],
+            data['last_name'], data['dob'], address['street'])
+        if key in new_rows:
+            counts['duplicates'] += 1
+        else:
+            new_rows[key] = (voter_form, address_form)
+    counts['lines'], counts['bad_format'] = reader.line_count, reader.num_bad_format
+
+    # The earlier list, keyed: (key, (CampaignsToVoters primary key, voter primary key))
+    old_rows = CampaignsToVoters.objects.filter(voter_list=previous).values_list('pk', 'voter',
+        'voter__address__country', 'voter__address__state', 'voter__registrar_id', 'voter__first_name',
+        'voter__last_name', 'voter__dob', 'voter__address__street')
+    old_rows = sorted((getVoterKey(*row[2:]), row[:2]) for row in old_rows.iterator())
+
+    added, matched, retired = [], [], []
+    for key, old, new in mergeByKey(old_rows, sorted(new_rows.iteritems())):
+        if new is None:
+            retired.append(old[0])
+        elif old is None:
+            added.append(new)
+        else:
+            matched.append((old, new))
+    del new_rows, old_rows
+
+    shared_lists = set()    # Lists of other campaigns with voters who may have become dialable or undialable
+    with transaction.atomic():
+        # Voters in both lists: update the shared Voter rows, and move the campaign's rows to the new list
+        for batch in getBatches(matched, batch_size):
+            voters = Voter.objects.select_related('address').in_bulk([voter_id for (pk, voter_id), forms in batch])
+            changed, moved, redialed, fields = [], [], [], set()
+            for (pk, voter_id), (voter_form, address_form) in batch:
+                v = voters[voter_id]
+                names = updateVoter(v, voter_form, address_form, voter_list.dump_date) \
+                    if v.dump_date <= voter_list.dump_date else []  # Another campaign has a newer dump
+                if names:
+                    changed.append(v)
+                    fields.update(names)
+                if 'address' in names:
+                    moved.append(v)
+                if DIALABLE_FIELDS.intersection(names):
+                    redialed.append(v.pk)
+            updateRows(Voter, changed, sorted(fields))
+            relocateVoters(moved)
+            if redialed:
+                shared_lists.update(CampaignsToVoters.objects.filter(voter__in=redialed).exclude(
+                    campaign=voter_list.campaign).order_by().values_list('voter_list', flat=True).distinct())
+            CampaignsToVoters.objects.filter(pk__in=[pk for (pk, voter_id), forms in batch]).update(
+                voter_list=voter_list, is_active=True)
+            counts['updated'] += len(changed)
+            counts['unchanged'] += len(batch) - len(changed)
+
+        # Voters only in the new list
+        campaign_voters = set(CampaignsToVoters.objects.filter(campaign=voter_list.campaign).values_list('voter',
+            flat=True))
+        relations = []
+        for voter_form, address_form in added:
+            v = getOrCreateVoter(voter_form, address_form)
+            if v.pk in campaign_voters:
+                counts['duplicates'] += 1   # The campaign has the voter from another list
+            else:
+                campaign_voters.add(v.pk)
+                relations.append(makeRelation(voter_list, v))
+        CampaignsToVoters.objects.bulk_create(relations, batch_size=batch_size)
+        counts['added'] = len(relations)
+
+        # Voters only in the earlier list
+        for batch in getBatches(retired, batch_size):
+            CampaignsToVoters.objects.filter(pk__in=batch).update(is_active=False)
+        counts['retired'] = len(retired)
+
+        # The earlier list keeps only retired voters.  A job still activating it would revive them.
+        VoterListActivityJob.objects.filter(voter_list=previous, finished_on=None).delete()
+        VoterList.objects.filter(pk=previous.pk).update(is_active=False)
+    reconcileVoterLists(VoterList.objects.filter(pk__in=[previous.pk] + sorted(shared_lists)))
+    counts.update(countVoterList(voter_list))
+    return counts
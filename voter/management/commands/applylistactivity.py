@@ -0,0 +1,27 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from django.core.management.base import BaseCommand
+from voter.activity import BATCH_SIZE, applyListActivity
+import time
+
+class Command(BaseCommand):
+    help = 'Activate and deactivate the voters of large voter lists.  See voter.activity.  Run one worker at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per UPDATE')
+        parser.add_argument('--loop', action='store_true', help='Keep checking for changed lists until interrupted')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between checks with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            updated = applyListActivity(batch_size=options['batch_size'])
+            if updated or not options['loop']:
+                self.stdout.write('Updated {0} voters.'.format(updated))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,61 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from address.models import Address
+from django.core.management.base import BaseCommand
+from django.test.client import RequestFactory
+from timeit import default_timer
+from voter.api import VoterResource
+from voter.models import Voter
+
+class Command(BaseCommand):
+    help = ('Compare the cost per voter of serializing VoterResource list responses with tastypie Bundles '
+        'and with the VoterResource.get_list fast path.  No database access is required.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--voters', type=int, default=20, help='Voters per response (default 20)')
+        parser.add_argument('--repeat', type=int, default=500, help='Responses to serialize (default 500)')
+
+    def handle(self, *args, **options):
+        resource = VoterResource()
+        request = RequestFactory().get('/api/v1/voter/')
+        serializer = resource._meta.serializer
+        list_uri = resource.get_resource_uri()
+        num_voters, repeat = options['voters'], options['repeat']
+
+        # Unsaved instances with their addresses already attached, so the Bundle path does not query
+        voters = []
+        rows = []
+        for pk in range(1, num_voters + 1):
+            address = Address(pk=pk, street='{0} Main Str'.format(pk), city='Columbus', state='OH', country='US',
+                postal_code='43215')
+            voters.append(Voter(pk=pk, first_name='Voter', last_name=str(pk), gender='F', phone_number1='3175550100',
+                phone_number2='', address=address))
+            rows.append({'id': pk, 'first_name': 'Voter', 'last_name': str(pk), 'gender': 'F',
+                'phone_number1': '3175550100', 'phone_number2': '', 'address__city': 'Columbus', 'address__state': 'OH'})
+
+        def bundles():
+            data = [resource.full_dehydrate(resource.build_bundle(obj=voter, request=request), for_list=True) for voter in voters]
+            return serializer.to_json({'objects': data})
+
+        def dicts():
+            return serializer.to_json({'objects': [resource.dehydrateRow(row, list_uri) for row in rows]})
+
+        if bundles() != dicts():
+            self.stderr.write('The two paths produced different JSON.')
+            return
+
+        results = []
+        for name, function in (('Tastypie bundles', bundles), ('Fast path', dicts)):
+            start = default_timer()
+            for i in range(repeat):
+                function()
+            microseconds = (default_timer() - start) * 1000000 / (repeat * num_voters)
+            results.append(microseconds)
+            self.stdout.write('{0:<18}{1:8.1f} microseconds per voter'.format(name, microseconds))
+        self.stdout.write('Speedup: {0:.1f}x, not counting one Address query per voter avoided by the fast path.'.format(
+            results[0] / results[1]))
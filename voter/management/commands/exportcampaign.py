@@ -0,0 +1,36 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from campaign.models import Campaign
+from django.core.management.base import BaseCommand, CommandError
+from voter.export import CHUNK_SIZE, EXPORTS, FORMATS, exportCampaign
+import sys
+
+class Command(BaseCommand):
+    help = "Export a campaign's constituents or intelligence reports.  Memory use does not grow with the campaign's size."
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_id', type=int)
+        parser.add_argument('--kind', choices=sorted(EXPORTS), default='voters')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', dest='output_format')
+        parser.add_argument('--gzip', action='store_true', help='Compress the output')
+        parser.add_argument('--output', help='File to write (default: standard output)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Rows per query')
+
+    def handle(self, *args, **options):
+        try:
+            campaign = Campaign.objects.get(pk=options['campaign_id'])
+        except Campaign.DoesNotExist:
+            raise CommandError('Campaign {0} does not exist.'.format(options['campaign_id']))
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout
+        try:
+            for block in exportCampaign(campaign, options['kind'], options['output_format'], gzip=options['gzip'],
+                    chunk_size=options['chunk_size']):
+                output.write(block)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,29 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+from campaign.models import Campaign
+from django.core.management.base import BaseCommand, CommandError
+from voter.models import VoterList, reconcileVoterLists
+
+class Command(BaseCommand):
+    help = "Count the voters in each voter list again, and correct the stored counters that differ.  Run it nightly."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--campaign', type=int, help='Reconcile only the lists of this campaign')
+
+    def handle(self, *args, **options):
+        voter_lists = VoterList.objects.order_by('pk')
+        if options['campaign'] is not None:
+            if not Campaign.objects.filter(pk=options['campaign']).exists():
+                raise CommandError('Campaign {0} does not exist.'.format(options['campaign']))
+            voter_lists = voter_lists.filter(campaign=options['campaign'])
+        corrected = reconcileVoterLists(voter_lists)
+        for voter_list, differences in corrected:
+            self.stdout.write('Voter list {0} ({1}): {2}'.format(voter_list.pk, voter_list.getShortFileName(),
+                ', '.join('{0} {1} -> {2}'.format(name, stored, counted)
+                for name, (stored, counted) in sorted(differences.items()))))
+        self.stdout.write('Corrected {0} of {1} voter lists.'.format(len(corrected), voter_lists.count()))
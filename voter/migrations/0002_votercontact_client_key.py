@@ -0,0 +1,33 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-19 18:24
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('voter', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='votercontact',
+            name='client_key',
+            field=models.CharField(blank=True, default=b'', editable=False, max_length=40),
+        ),
+        migrations.AlterIndexTogether(
+            name='votercontact',
+            index_together=set([('user', 'client_key')]),
+        ),
+    ]
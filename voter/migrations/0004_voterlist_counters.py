@@ -0,0 +1,63 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-19 18:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, Q, Sum, Value, When
+
+# voter.models.getDialableFilter('voter__') as of this migration
+DIALABLE = (~Q(voter__phone_number1='') & Q(voter__wrong_phone_number1__lte=1)) | \
+    (~Q(voter__phone_number2='') & Q(voter__wrong_phone_number2__lte=1))
+
+def countVoterLists(apps, schema_editor):
+    """Fill the counters of existing voter lists, as voter.models.countVoterList counts them."""
+    CampaignsToVoters = apps.get_model('campaign', 'CampaignsToVoters')
+    VoterList = apps.get_model('voter', 'VoterList')
+    counts = CampaignsToVoters.objects.order_by().values('voter_list').annotate(
+        voter_count=Count('pk'),
+        active_count=Sum(Case(When(is_active=True, then=Value(1)), default=Value(0), output_field=IntegerField())),
+        contacted_count=Sum(Case(When(last_contacted__isnull=False, then=Value(1)), default=Value(0),
+            output_field=IntegerField())),
+        dialable_count=Sum(Case(When(DIALABLE, then=Value(1)), default=Value(0),
+            output_field=IntegerField())))
+    for row in counts.iterator():
+        VoterList.objects.filter(pk=row.pop('voter_list')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter', '0003_sync_versions'),
+        ('campaign', '0002_auto_20160909_1851'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voterlist',
+            name='active_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='voterlist',
+            name='contacted_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='voterlist',
+            name='dialable_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='voterlist',
+            name='voter_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(countVoterLists, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-19 18:57
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter', '0004_voterlist_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoterListActivityJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_active', models.BooleanField()),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('total', models.IntegerField()),
+                ('done', models.IntegerField(default=0)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('voter_list', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_jobs', to='voter.VoterList')),
+            ],
+        ),
+    ]
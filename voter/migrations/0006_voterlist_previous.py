@@ -0,0 +1,33 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-19 19:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('voter', '0005_voterlistactivityjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='voterlist',
+            name='previous',
+            field=models.ForeignKey(blank=True, help_text=b'Voters missing from the new list are retired, and changed voters are updated.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='updates', to='voter.VoterList', verbose_name=b'Does this list update an earlier list?'),
+        ),
+        migrations.AlterField(
+            model_name='voterlist',
+            name='processed',
+            field=models.CharField(default=b'No', editable=False, max_length=200),
+        ),
+    ]
@@ -0,0 +1,40 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+"""
+
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.23 on 2026-10-19 19:41
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('voter', '0006_voterlist_previous'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VoterFlag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(editable=False, max_length=20)),
+                ('flagged_on', models.DateTimeField(auto_now_add=True)),
+                ('client_key', models.CharField(blank=True, default=b'', editable=False, max_length=40)),
+                ('user', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('voter', models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, to='voter.Voter')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='voterflag',
+            index_together=set([('user', 'client_key')]),
+        ),
+    ]
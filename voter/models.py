@@ -6,22 +6,76 @@ the author's qualifications.  No other uses are permitted.
 """
 
 from address.models import Address
-from campaign.models import Campaign, PoliticalParty
+from campaign.models import Campaign, CampaignsToVoters, PoliticalParty
 from datetime import date
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, IntegerField, Max, Q, Sum, Value, When
 from django_countries.fields import CountryField
 from os import makedirs
 import os.path
 
-class ContactMethod(models.Model):
+class SyncVersion(models.Model):
+    """
+    A version counter for a table that clients keep a copy of, such as Issue.  'version' increases by
+    one with every save to the table.  'reset_version' is the version of the last deletion: a client
+    whose copy is older must download the whole table again, because deleted rows leave no trace.
+    See SyncedModel and tcswebapp.deltasync.
+    """
+    name = models.CharField(max_length=30, unique=True)
+    version = models.BigIntegerField(default=0)
+    reset_version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def increment(cls, name, reset=False):
+        """
+        Increment the named counter and return its new value.  Call it in a transaction: the update locks
+        the counter's row until the transaction ends, so versions become visible to clients in order.
+        """
+        values = {'version': F('version') + 1}
+        if reset:
+            values['reset_version'] = F('version') + 1
+        if not cls.objects.filter(name=name).update(**values):
+            cls.objects.get_or_create(name=name)
+            cls.objects.filter(name=name).update(**values)
+        return cls.objects.filter(name=name).values_list('version', flat=True).get()
+
+    @classmethod
+    def getVersions(cls, name):
+        """Return the tuple (version, reset_version) of the named counter."""
+        return cls.objects.filter(name=name).values_list('version', 'reset_version').first() or (0, 0)
+
+class SyncedModel(models.Model):
+    """
+    An abstract model whose rows record the version of the SyncVersion counter 'sync_name' at which
+    they last changed, so that clients can download only the rows changed since their copy.
+    QuerySet.update() bypasses save(); call SyncVersion.increment and set 'version' explicitly.
+    Deletions are handled by voter.signals.resetSyncVersion.
+    """
+    version = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            self.version = SyncVersion.increment(self.sync_name)
+            super(SyncedModel, self).save(*args, **kwargs)
+
+    @classmethod
+    def getSyncVersions(cls):
+        """Return the tuple (version, reset_version) of the model's table."""
+        return SyncVersion.getVersions(cls.sync_name)
+
+class ContactMethod(SyncedModel):
     """Means to contact a voter. (i.e. phone, in-person, e-mail, etc.)"""
+    sync_name = 'contactmethod'
     method = models.CharField(max_length=20)
 
     def __unicode__(self):
         return self.method
 
-class Issue(models.Model):
+class Issue(SyncedModel):
     """
     A table of political issues about which voters might have strong opinions.
     Examples: abortion, 2nd ammendment, unions, etc.  The issue should be phrased in such
@@ -35,6 +89,7 @@ class Issue(models.Model):
     requests.  Deleting rows from the table is not desirable because intelligence reports
     make reference to Issue instances.
     """
+    sync_name = 'issue'
     country = CountryField(blank=True, default='')
     issue = models.CharField(max_length=50)
     is_active = models.BooleanField(default=True)
@@ -69,9 +124,22 @@ class Voter(models.Model):
     wrong_phone_number1 = models.PositiveSmallIntegerField(default=0, editable=False)
     wrong_phone_number2 = models.PositiveSmallIntegerField(default=0, editable=False)
 
+    def isDialable(self):
+        """Return True if the voter has a phone number that has not been flagged more than once.  See getDialableFilter."""
+        return bool((self.phone_number1 and self.wrong_phone_number1 <= 1) or
+            (self.phone_number2 and self.wrong_phone_number2 <= 1))
+
     def __unicode__(self):
         return '{0} {1}'.format(self.first_name, self.last_name)
 
+def getDialableFilter(prefix=''):
+    """
+    Return a Q object selecting voters for whom Voter.isDialable is True, as in
+    campaign.models.Campaign.getVotersToDial.  'prefix' is the path to the voter, such as 'voter__'.
+    """
+    return (~Q(**{prefix + 'phone_number1': ''}) & Q(**{prefix + 'wrong_phone_number1__lte': 1})) | \
+        (~Q(**{prefix + 'phone_number2': ''}) & Q(**{prefix + 'wrong_phone_number2__lte': 1}))
+
 class VoterContact(models.Model):
     """
     A voter contact event.  A TcsUser contacts a Voter on behalf of a Campaign (or more than one).
@@ -85,10 +153,34 @@ class VoterContact(models.Model):
     method = models.ForeignKey(ContactMethod)                                         # How the campaign worker made contact
     intelligence_report = models.TextField(max_length=1000, blank=True, default='""') # 1,000 characters is about 2 paragraphs
     # TODO - IRs might be much longer than 1,000 characters if they are encrypted
+    # Chosen by Campaigner for each IR it queues, so that an upload retried after a lost response is not saved twice
+    client_key = models.CharField(max_length=40, blank=True, default='', editable=False)
+
+    class Meta:
+        index_together = [('user', 'client_key')]
 
     def __unicode__(self):
         return '{0} by {1}'.format(self.voter, self.user)
 
+class VoterFlag(models.Model):
+    """
+    A phone number flagged as wrong by a campaign worker.  Flags are counted in the Voter fields
+    'wrong_phone_number1' and 'wrong_phone_number2'; this record keeps the flag's 'client_key' so
+    that voter.api.VoterResource counts a flag uploaded twice only once.
+    """
+    voter = models.ForeignKey(Voter, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, editable=False)    # The campaign worker who flagged the number
+    field = models.CharField(max_length=20, editable=False)               # 'phone_number1' or 'phone_number2'
+    flagged_on = models.DateTimeField(auto_now_add=True)
+    # Chosen by Campaigner for each flag it queues, like VoterContact.client_key
+    client_key = models.CharField(max_length=40, blank=True, default='', editable=False)
+
+    class Meta:
+        index_together = [('user', 'client_key')]
+
+    def __unicode__(self):
+        return '{0} of {1} by {2}'.format(self.field, self.voter, self.user)
+
 def getUploadPath(instance, filename):
     """https://docs.djangoproject.com/en/1.8/ref/models/fields/#filefield"""
     path = '{0}{1}/'.format(settings.VOTER_LISTS_ROOT, instance.campaign.id)
@@ -101,13 +193,54 @@ class VoterList(models.Model):
     """
     A list of voter data uploaded by a campaign.  The voters in the list are assumed to be
     relevant for that campaign.
+
+    The counters describe the list's rows of CampaignsToVoters, so that they are read without
+    counting the rows:
+        voter_count - The voters the list added to the campaign
+        active_count - Those served to workers (CampaignsToVoters.is_active)
+        contacted_count - Those the campaign has contacted (CampaignsToVoters.last_contacted)
+        dialable_count - Those with a phone number that is not flagged (Voter.isDialable)
+    The importer, updateVoterListActivity, contact uploads, and flagged phone numbers keep them
+    current with addToCounts.  "python manage.py reconcilevoterlists" corrects any drift.
     """
+    COUNTERS = ('voter_count', 'active_count', 'contacted_count', 'dialable_count')
+
     dump_date = models.DateField('When did the voter registration authority give you this data?', help_text='yyyy-mm-dd')
     campaign = models.ForeignKey(Campaign, editable=False)
     upload_datetime = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField('Contact voters in this list?', default=True)
     file_name = models.FileField(upload_to=getUploadPath)
-    processed = models.CharField(max_length=100, default='No', editable=False) # Status of processing the list
+    processed = models.CharField(max_length=200, default='No', editable=False) # Status of processing the list
+    # A newer dump of an earlier list updates that list's voters instead of adding to them.  See voter.importer.
+    previous = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='updates',
+        verbose_name='Does this list update an earlier list?',
+        help_text='Voters missing from the new list are retired, and changed voters are updated.')
+    voter_count = models.IntegerField(default=0, editable=False)
+    active_count = models.IntegerField(default=0, editable=False)
+    contacted_count = models.IntegerField(default=0, editable=False)
+    dialable_count = models.IntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        """
+        Save every field but the counters of an existing list, so that saving a list loaded before a
+        concurrent addToCounts does not undo it.  Pass 'update_fields' to save counters.
+        """
+        if self.pk is not None and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTERS]
+        super(VoterList, self).save(*args, **kwargs)
+
+    @classmethod
+    def addToCounts(cls, counter, amounts):
+        """
+        Add to a counter of several lists in one UPDATE.  'amounts' maps the primary keys of lists to
+        the amounts to add, which may be negative.
+        """
+        amounts = dict((pk, amount) for pk, amount in amounts.items() if amount)
+        if amounts:
+            cls.objects.filter(pk__in=amounts).update(**{counter: F(counter) + Case(
+                *[When(pk=pk, then=Value(amount)) for pk, amount in amounts.items()],
+                default=Value(0), output_field=IntegerField())})
 
     def getShortFileName(self):
         """Return file_name without the path or extension."""
@@ -115,3 +248,83 @@ class VoterList(models.Model):
 
     def __unicode__(self):
         return self.file_name
+
+class VoterListActivityJob(models.Model):
+    """
+    A change to the 'is_active' value of a large VoterList that is waiting to be applied to the
+    list's rows of CampaignsToVoters, or has been.  voter.activity.setListActivity adds jobs, and the
+    applylistactivity management command applies them in batches.  See voter.activity.
+    """
+    voter_list = models.ForeignKey(VoterList, related_name='activity_jobs')
+    is_active = models.BooleanField()
+    created_on = models.DateTimeField(auto_now_add=True)
+    total = models.IntegerField()               # The list's voter_count when the job was added
+    done = models.IntegerField(default=0)       # Rows updated so far
+    finished_on = models.DateTimeField(null=True, blank=True)
+
+    def getProgress(self):
+        """Return the percentage of the list's rows updated."""
+        return min(100, 100 * self.done // self.total) if self.total else 100
+
+    def __unicode__(self):
+        return '{0} {1}'.format('Activate' if self.is_active else 'Deactivate', self.voter_list)
+
+def markContacted(campaign_ids, voter_ids, contact_date):
+    """
+    Set 'last_contacted' of the rows of CampaignsToVoters for the given campaigns and voters, and add
+    the rows contacted for the first time to their lists' contacted_count.
+    """
+    rows = CampaignsToVoters.objects.filter(campaign__in=campaign_ids, voter__in=voter_ids)
+    first_contacts = {}
+    with transaction.atomic():
+        for list_id in rows.filter(last_contacted=None).order_by().values_list('voter_list', flat=True).distinct():
+            # The condition is checked again as each row is updated, so concurrent uploads count a row once
+            first_contacts[list_id] = rows.filter(voter_list=list_id, last_contacted=None).update(
+                last_contacted=contact_date)
+        rows.update(last_contacted=contact_date)
+        VoterList.addToCounts('contacted_count', first_contacts)
+
+def getContactsMark(campaign_id=None, user_id=None):
+    """
+    Return the primary key of the newest relation of a VoterContact to the campaign, or of the newest
+    VoterContact made by the user, or 0.  voter.api.VoterContactResource uploads contacts without bumping
+    CONTACTS_VERSION and USER_CONTACTS_VERSION, which would write to the shared cache on every upload, so
+    cached fragments that count contacts pass this to tcswebapp.apicache.getFragmentVersion as a mark.
+    Deleting a contact still bumps the versions.
+    """
+    if campaign_id is not None:
+        rows = VoterContact.campaigns.through.objects.filter(campaign=campaign_id)
+    else:
+        rows = VoterContact.objects.filter(user=user_id)
+    return rows.aggregate(newest=Max('pk'))['newest'] or 0
+
+def countVoterList(voter_list):
+    """Return a dictionary of the counters of a voter list, counted from CampaignsToVoters."""
+    counts = CampaignsToVoters.objects.filter(voter_list=voter_list).aggregate(
+        voter_count=Count('pk'),
+        active_count=Sum(Case(When(is_active=True, then=Value(1)), default=Value(0), output_field=IntegerField())),
+        contacted_count=Sum(Case(When(last_contacted__isnull=False, then=Value(1)), default=Value(0),
+            output_field=IntegerField())),
+        dialable_count=Sum(Case(When(getDialableFilter('voter__'), then=Value(1)), default=Value(0),
+            output_field=IntegerField())))
+    return dict((name, count or 0) for name, count in counts.items())     # Sum is None over no rows
+
+def reconcileVoterLists(voter_lists=None):
+    """
+    Count the counters of each voter list again and correct those that differ.  Return a list of tuples
+    (voter list, {counter: (stored, counted)}) for the lists corrected.  Each list is locked while it is
+    counted, so that concurrent addToCounts calls wait and are not lost.
+    """
+    corrected = []
+    for pk in (voter_lists if voter_lists is not None else VoterList.objects.all()).values_list('pk', flat=True):
+        with transaction.atomic():
+            voter_list = VoterList.objects.select_for_update().filter(pk=pk).first()
+            if voter_list is None:
+                continue    # Deleted meanwhile
+            counts = countVoterList(voter_list)
+            differences = dict((name, (getattr(voter_list, name), count)) for name, count in counts.items()
+                if getattr(voter_list, name) != count)
+            if differences:
+                VoterList.objects.filter(pk=pk).update(**counts)
+                corrected.append((voter_list, differences))
+    return corrected
@@ -5,15 +5,27 @@ All rights reserved.  You are welcome to inspect this code for your education or
 the author's qualifications.  No other uses are permitted.
 """
 
-from address.forms import AddressForm
-from address.models import Address
-from campaign.models import CampaignsToVoters, PoliticalParty
-from csv import DictReader
-from dateutil.parser import parse
-from django.db.models.signals import post_save
+from campaign.models import CampaignsToVoters
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from voter.forms import VoterForm
-from voter.models import Voter, VoterContact, VoterList
+from tcswebapp.apicache import CONTACTS_VERSION, USER_CONTACTS_VERSION, VOTERS_VERSION, bumpVersions
+from voter.importer import ListReader, importDelta, importVoterList
+from voter.models import ContactMethod, Issue, SyncVersion, VoterContact, VoterList, markContacted
+from voter.staging import canImportStaged, importStaged
+import os
+
+@receiver(post_save, sender=Issue)
+@receiver(post_delete, sender=Issue)
+def bumpIssuesVersion(sender, instance, **kwargs):
+    """Invalidate cached issue API responses.  See voter.api.IssueResource."""
+    bumpVersions('issues')
+
+@receiver(post_delete, sender=ContactMethod)
+@receiver(post_delete, sender=Issue)
+def resetSyncVersion(sender, instance, **kwargs):
+    """Make clients download the table again, since they cannot learn of a deleted row.  See voter.models.SyncedModel."""
+    SyncVersion.increment(sender.sync_name, reset=True)
 
 @receiver(post_save, sender=VoterList)
 def processVoterList(sender, created, instance, **kwargs):
@@ -21,7 +33,8 @@ def processVoterList(sender, created, instance, **kwargs):
     For each valid voter in the uploaded list, add it to the Voter table, and make a many-to-many
     link to the campaign that uploaded the list.  Do not duplicate voters already in the table.
     Consider a voter a duplicate if a voter already exists with the same registrar_id in the same
-    state.
+    state.  If the list updates an earlier list, apply only the differences.  Import large lists through
+    a staging table.  See voter.importer and voter.staging.
     """
     if not created:
         return
@@ -33,125 +46,46 @@ def processVoterList(sender, created, instance, **kwargs):
         instance.save()
         return
 
-    default_country = str(instance.campaign.address.country) # The relevant campaign's home country
-    line_count = 0
-    num_successes = 0
-    num_duplicates = 0
-    num_bad_format = 0
-    new_voter_relations = [] # A list of new CampaignsToVoters instances to add in bulk after processing the list
-    new_indexes = set([])    # Explained below
-
-    reader = DictReader(f, delimiter='\t') # Assumes the first row contains column names.
-    for voter in reader:
-        line_count += 1
-
-        # Must catch KeyError and ValueError.
-        try:
-            # Convert date strings to datetime.Date instances.  Failure to convert raises ValueError.
-            if voter['registration_date']:
-                voter['registration_date'] = parse(voter['registration_date']).date()
-
-            if voter['dob']:
-                voter['dob'] = parse(voter['dob']).date()
-
-            # Voter political affiliations are a ForeignKey in the Voter model, but the user uploads
-            # text.  Attempt to find the correct political party operating in the campaign's country.
-            affiliation = voter['affiliation'].strip()
-            if affiliation != '':
-                try:
-                    affiliation = PoliticalParty.objects.get(
-                        country=default_country,
-                        title__icontains=affiliation
-                    ).pk
-                except (PoliticalParty.DoesNotExist, PoliticalParty.MultipleObjectsReturned):
-                    affiliation = None  # Ignore the ambiguous party information.
-
-            voter_form = VoterForm({
-                'first_name': voter['first_name'],
-                'last_name': voter['last_name'],
-                'dob': voter['dob'],
-                'gender': voter['gender'],
-                'affiliation': affiliation,             # This should be an integer primary key or None.
-                'registration_date': voter['registration_date'],
-                'registrar_id': voter['registrar_id'],
-                'dump_date': instance.dump_date,
-                'phone_number1': voter['phone_number1'],
-                'phone_number2': voter['phone_number2'],
-                'email': voter['email'],
-            })
-
-            # Use the default country if necessary.
-            if voter['country'] == '':
-                voter['country'] = default_country
-
-            address_form = AddressForm({
-                'street': voter['street'],
-                'city': voter['city'],
-                'state': voter['state'],
-                'country': voter['country'],
-                'postal_code': voter['postal_code'],
-            })
-        except (KeyError, ValueError):
-            num_bad_format += 1     # Missing required data
-            continue                # Move on to the next line in the input file.
-
-        if voter_form.is_valid() and address_form.is_valid():
-            # Is this voter already in the database?  Look for active voters with the same registrar_id, 
-            # street address, country, and state.
-            # TODO - Registrar IDs are stored as-is and matched case-insensitively.
-            # Should I just lower/upper-case and match exact?  Should case matter?
-            v = Voter.objects.filter(is_active=True, registrar_id__iexact=voter_form.cleaned_data['registrar_id'],
-                address__street=address_form.cleaned_data['street'],
-                address__country=address_form.cleaned_data['country'],
-                address__state=address_form.cleaned_data['state']).first()
-            if not v:
-                # The voter is not in the database or is not active.  Add him or her.
-                voter_form.instance.address = address_form.get_or_create()
-                v = voter_form.save()
-
-            # Relate the voter to the campaign that uploaded the current list, if applicable.
-            # Two scenarios can raise an IntegrityError by duplicating a (campaign, voter)
-            # combination in the database table Campaign.campaignstovoters:
-            #   1) Duplicate voters are present in the new list.
-            # This raises an error when creating the m2m relations after creating each new
-            # voter.  Mitigate this by keeping track of voter indexes seen in the new list.
-            #   2) The same campaign has already submitted a voter in another list.
-            # Having multiple m2m relations associated with different lists is desirable,
-            # but the framework does not support this.  Simply ignore voters already present
-            # from another list.
-            if v.pk not in new_indexes and not CampaignsToVoters.objects.filter(
-                    campaign=instance.campaign, voter=v).exists():
-                new_indexes.add(v.pk)
-                new_voter_relations.append(CampaignsToVoters(campaign=instance.campaign, voter=v, voter_list=instance))
-                num_successes += 1
-            else:
-                num_duplicates += 1
+    reader = ListReader(f, instance)
+    try:
+        if instance.previous_id:
+            outcome = importDelta(instance, reader)
+        elif os.fstat(f.fileno()).st_size >= settings.STAGED_IMPORT_MIN_BYTES and canImportStaged():
+            outcome = importStaged(instance, reader)
         else:
-            num_bad_format += 1     # No required data missing, but the provided data is invalid.
-
-    f.close()
-
-    # Update the many-to-many relationship.
-    CampaignsToVoters.objects.bulk_create(new_voter_relations)
-
-    # Update the VoterList instance.
-    instance.processed = 'Imported {0} of {1} voters.  {2} duplicates.  {3} bad format.'.format(
-        num_successes, line_count, num_duplicates, num_bad_format)
-    instance.is_active = (num_successes > 0)
-    instance.save()
-
-@receiver(post_save, sender=VoterContact)
-def updateLastContacted(sender, created, instance, **kwargs):
+            outcome = importVoterList(instance, reader)
+    finally:
+        f.close()
+
+    # Update the VoterList instance.  updateVoterListActivity sets active_count.
+    if instance.previous_id:
+        instance.processed = ('Added {added}, updated {updated}, retired {retired}, and kept {unchanged} of {lines} '
+            'voters.  {duplicates} duplicates.  {bad_format} bad format.').format(**outcome)
+    else:
+        instance.processed = 'Imported {added} of {lines} voters.  {duplicates} duplicates.  {bad_format} bad format.'.format(
+            **outcome)
+    instance.is_active = (outcome['voter_count'] > 0)
+    instance.voter_count = outcome['voter_count']
+    instance.contacted_count = outcome.get('contacted_count', 0)  # Voters moved from an earlier list keep their history
+    instance.dialable_count = outcome['dialable_count']
+    instance.save(update_fields=['processed', 'is_active', 'voter_count', 'contacted_count', 'dialable_count'])
+
+@receiver(m2m_changed, sender=VoterContact.campaigns.through)
+def updateLastContacted(sender, instance, action, reverse, pk_set, **kwargs):
     """
     After a user contacts a voter, record the date of the contact event in the campaigns-to-voters
     many-to-many table, campaign.models.CampaignsToVoters.  Note that this updates multiple rows if
-    the voter is referenced in multiple voter lists.
+    the voter is referenced in multiple voter lists.  A contact is saved before it is related to its
+    campaigns, so this listens for the relation.  See voter.models.markContacted.
     """
-    if created:
-        CampaignsToVoters.objects.filter(
-            campaign__in=instance.campaigns.all(),
-            voter=instance.voter
-        ).update(last_contacted=instance.contact_datetime.date())
+    if action != 'post_add':
+        return
+    if reverse:     # 'instance' is a Campaign, and 'pk_set' identifies contacts
+        for voter_id, contact_datetime in VoterContact.objects.filter(pk__in=pk_set).values_list('voter',
+                'contact_datetime'):
+            markContacted([instance.pk], [voter_id], contact_datetime.date())
+    else:
+        markContacted(pk_set, [instance.voter_id], instance.contact_datetime.date())
 
 @receiver(post_save, sender=VoterList)
 def updateVoterListActivity(sender, created, instance, **kwargs):
@@ -159,9 +93,42 @@ def updateVoterListActivity(sender, created, instance, **kwargs):
     When a campaign owner changes the 'is_active' value of a VoterList instance, this listener
     updates the 'is_active' value of the rows in CampaignsToVoters associated with the affected
     lists.  The end goal is that the Voter API list endpoint will only serve to volunteers voters
-    the campaign manager presently wants to contact.
+    the campaign manager presently wants to contact.  Every row now has the list's value, so the
+    list's active_count is either the number updated or zero.
     """
     if not created:
-        CampaignsToVoters.objects.filter(
+        updated = CampaignsToVoters.objects.filter(
             voter_list=instance,
         ).update(is_active=instance.is_active)
+        instance.active_count = updated if instance.is_active else 0
+        VoterList.objects.filter(pk=instance.pk).update(active_count=instance.active_count)
+
+def bumpContactVersions(user_id, campaign_ids):
+    """
+    Invalidate the cached contact counts of a user and of campaigns.  Bulk uploads by
+    voter.api.VoterContactResource don't call this; see voter.models.getContactsMark.
+    """
+    bumpVersions(USER_CONTACTS_VERSION.format(user_id), *[CONTACTS_VERSION.format(pk) for pk in campaign_ids])
+
+@receiver(m2m_changed, sender=VoterContact.campaigns.through)
+def bumpContactCampaignVersions(sender, instance, action, reverse, pk_set, **kwargs):
+    """A contact counts toward a campaign once it is related to the campaign."""
+    if action not in ('post_add', 'post_remove'):
+        return
+    if reverse:     # 'instance' is a Campaign, and 'pk_set' identifies contacts
+        bumpVersions(CONTACTS_VERSION.format(instance.pk), *[USER_CONTACTS_VERSION.format(pk) for pk in
+            VoterContact.objects.filter(pk__in=pk_set).values_list('user', flat=True).distinct()])
+    else:
+        bumpContactVersions(instance.user_id, pk_set)
+
+@receiver(pre_delete, sender=VoterContact)
+def bumpDeletedContactVersions(sender, instance, **kwargs):
+    """Invalidate the counts that include a contact, while its campaigns can still be found."""
+    bumpContactVersions(instance.user_id, instance.campaigns.values_list('pk', flat=True))
+
+# Registered last, so that it runs after processVoterList and updateVoterListActivity
+@receiver(post_save, sender=VoterList)
+@receiver(post_delete, sender=VoterList)
+def bumpVoterListVersion(sender, instance, **kwargs):
+    """Invalidate the cached voter lists and constituent count of the list's campaign."""
+    bumpVersions(VOTERS_VERSION.format(instance.campaign_id))
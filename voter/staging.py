@@ -0,0 +1,172 @@
+"""
+(C) David J. Kalbfleisch 2013
+
+All rights reserved.  You are welcome to inspect this code for your education or to evaluate
+the author's qualifications.  No other uses are permitted.
+
+
+A staged import of large voter lists.  voter.importer.importVoterList looks up, and usually
+creates, an address, a voter, and a campaign relation for each row, which costs several queries per
+row.  importStaged instead writes the validated rows to a temporary staging table with batched INSERTs.
+Matching against Voter and Address, duplicates within the list, and the new Address, Voter, and
+CampaignsToVoters rows are then each handled by one SQL statement over the whole list.
+
+Rows are validated by the same forms as importVoterList (see voter.importer.ListReader), and
+duplicates are resolved the same way, so both produce the same voters and the same outcome counts.
+voter.signals.processVoterList uses importStaged for files of at least the setting
+STAGED_IMPORT_MIN_BYTES when canImportStaged is true.  The SQL needs SQLite 3.33 or later, which added
+UPDATE ... FROM.  Other databases import row by row.
+"""
+
+from address.models import Address
+from campaign.models import CampaignsToVoters, indexVoterLocations
+from datetime import datetime
+from django.db import connection, transaction
+from voter.models import Voter, getDialableFilter
+
+LOAD_BATCH_SIZE = 5000  # Rows per INSERT while loading
+
+# The staging table's columns after 'line', as (name, SQL type, cleaned_data key).  The forms have cleaned the values.
+STAGING_COLUMNS = (
+    ('registrar_id', 'varchar(100)', 'registrar_id'),
+    ('first_name', 'varchar(30)', 'first_name'),
+    ('last_name', 'varchar(30)', 'last_name'),
+    ('dob', 'date', 'dob'),
+    ('gender', 'varchar(1)', 'gender'),
+    ('affiliation_id', 'integer', 'affiliation'),
+    ('registration_date', 'date', 'registration_date'),
+    ('phone_number1', 'varchar(12)', 'phone_number1'),
+    ('phone_number2', 'varchar(12)', 'phone_number2'),
+    ('email', 'varchar(254)', 'email'),
+    ('street', 'varchar(50)', 'street'),
+    ('city', 'varchar(30)', 'city'),
+    ('state', 'varchar(2)', 'state'),
+    ('country', 'varchar(2)', 'country'),
+    ('postal_code', 'varchar(10)', 'postal_code'),
+)
+
+def canImportStaged():
+    """Return True if the database supports importStaged.  Otherwise, use voter.importer.importVoterList."""
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 33, 0)
+
+def getRow(line, voter_form, address_form):
+    """Return a tuple of staging column values for valid forms."""
+    data = dict(voter_form.cleaned_data, **address_form.cleaned_data)
+    if data['affiliation'] is not None:
+        data['affiliation'] = data['affiliation'].pk
+    data['country'] = str(data['country'])
+    return (line,) + tuple(data[key] for name, sql_type, key in STAGING_COLUMNS)
+
+class StagingTable(object):
+    """A staging table for one voter list, created on entering a with statement and dropped on leaving it."""
+    def __init__(self, cursor, voter_list):
+        self.cursor = cursor
+        self.name = connection.ops.quote_name('voter_staging_{0}'.format(voter_list.pk))
+        self.columns = ['line'] + [name for name, sql_type, key in STAGING_COLUMNS]
+
+    def __enter__(self):
+        self.cursor.execute('DROP TABLE IF EXISTS {0}'.format(self.name))
+        self.cursor.execute('CREATE TEMPORARY TABLE {0} (line integer PRIMARY KEY, {1}, voter_id integer, '
+            'address_id integer, is_first boolean)'.format(self.name,
+            ', '.join('{0} {1}'.format(name, sql_type) for name, sql_type, key in STAGING_COLUMNS)))
+        return self
+
+    def __exit__(self, *exc_info):
+        # After an error the transaction is rolled back, which drops the table.  It may also be unusable.
+        if exc_info[0] is None:
+            self.cursor.execute('DROP TABLE IF EXISTS {0}'.format(self.name))
+
+    def load(self, rows):
+        """Add a list of row tuples."""
+        if not rows:
+            return
+        self.cursor.executemany('INSERT INTO {0} ({1}) VALUES ({2})'.format(self.name, ', '.join(self.columns),
+            ', '.join(['%s'] * len(self.columns))), rows)
+
+    def execute(self, sql, params=()):
+        """Execute SQL with the placeholders {staging}, {voter}, {address}, and {relation} filled in."""
+        self.cursor.execute(sql.format(staging=self.name, voter=Voter._meta.db_table, address=Address._meta.db_table,
+            relation=CampaignsToVoters._meta.db_table), params)
+        return self.cursor.rowcount
+
+# The voter matching a row is the first active voter with the same registrar ID, ignoring case, street,
+# country, and state, as in voter.importer.getOrCreateVoter.  The updates join grouped subqueries instead
+# of running a subquery per row.
+MATCH_VOTERS = """
+    UPDATE {staging} SET voter_id = m.voter_id FROM (
+        SELECT s.line AS line, MIN(v.id) AS voter_id FROM {staging} s
+        INNER JOIN {address} a ON a.street = s.street AND a.country = s.country AND a.state = s.state
+        INNER JOIN {voter} v ON v.address_id = a.id AND UPPER(v.registrar_id) = UPPER(s.registrar_id)
+        WHERE s.voter_id IS NULL AND v.is_active = %s
+        GROUP BY s.line) m
+    WHERE {staging}.line = m.line"""
+
+# Of the unmatched rows for one voter, the first adds the voter, and the others become duplicates of it
+MARK_FIRST = """
+    UPDATE {staging} SET is_first = %s FROM (
+        SELECT MIN(line) AS line FROM {staging} WHERE voter_id IS NULL
+        GROUP BY UPPER(registrar_id), street, country, state) m
+    WHERE {staging}.line = m.line"""
+
+MATCH_ADDRESSES = """
+    UPDATE {staging} SET address_id = m.address_id FROM (
+        SELECT s.line AS line, MIN(a.id) AS address_id FROM {staging} s
+        INNER JOIN {address} a ON a.street = s.street AND a.city = s.city AND a.state = s.state
+            AND a.country = s.country AND a.postal_code = s.postal_code
+        WHERE s.is_first = %s AND s.address_id IS NULL
+        GROUP BY s.line) m
+    WHERE {staging}.line = m.line"""
+
+INSERT_ADDRESSES = """
+    INSERT INTO {address} (street, city, state, country, postal_code, datetime)
+    SELECT street, city, state, country, postal_code, %s FROM {staging}
+    WHERE is_first = %s AND address_id IS NULL
+    GROUP BY street, city, state, country, postal_code"""
+
+INSERT_VOTERS = """
+    INSERT INTO {voter} (first_name, last_name, dob, gender, affiliation_id, is_active, registration_date, registrar_id,
+        dump_date, address_id, phone_number1, phone_number2, email, wrong_address, wrong_phone_number1,
+        wrong_phone_number2)
+    SELECT first_name, last_name, dob, gender, affiliation_id, %s, registration_date, registrar_id, %s, address_id,
+        phone_number1, phone_number2, email, 0, 0, 0
+    FROM {staging} WHERE is_first = %s ORDER BY line"""
+
+# Voters the campaign already has, from another list or earlier in this one, are duplicates
+INSERT_RELATIONS = """
+    INSERT INTO {relation} (campaign_id, voter_id, voter_list_id, last_contacted, last_served, is_active, geohash)
+    SELECT %s, voter_id, %s, NULL, NULL, %s, '' FROM {staging}
+    WHERE NOT EXISTS (SELECT 1 FROM {relation} r WHERE r.campaign_id = %s AND r.voter_id = {staging}.voter_id)
+    GROUP BY voter_id"""
+
+def importStaged(voter_list, reader, batch_size=LOAD_BATCH_SIZE):
+    """
+    Import the valid rows from a ListReader through a staging table.  Return a dictionary of outcome
+    counts, like voter.importer.importVoterList.
+    """
+    with transaction.atomic(), connection.cursor() as cursor, StagingTable(cursor, voter_list) as staging:
+        batch = []
+        num_valid = 0
+        for voter_form, address_form in reader:
+            num_valid += 1
+            batch.append(getRow(reader.line_count, voter_form, address_form))
+            if len(batch) == batch_size:
+                staging.load(batch)
+                batch = []
+        staging.load(batch)
+
+        staging.execute(MATCH_VOTERS, [True])
+        staging.execute(MARK_FIRST, [True])
+        staging.execute(MATCH_ADDRESSES, [True])
+        staging.execute(INSERT_ADDRESSES, [datetime.now(), True])
+        staging.execute(MATCH_ADDRESSES, [True])
+        staging.execute(INSERT_VOTERS, [True, voter_list.dump_date, True])
+        staging.execute(MATCH_VOTERS, [True])
+        staging.execute(INSERT_RELATIONS, [voter_list.campaign_id, voter_list.pk, True, voter_list.campaign_id])
+
+    # Voters at addresses geocoded earlier can be found for door-to-door canvassing at once
+    indexVoterLocations(voter_list=voter_list)
+    relations = CampaignsToVoters.objects.filter(voter_list=voter_list)
+    num_successes = relations.count()
+    return {'lines': reader.line_count, 'added': num_successes, 'duplicates': num_valid - num_successes,
+        'bad_format': reader.num_bad_format, 'voter_count': num_successes,
+        'dialable_count': relations.filter(getDialableFilter('voter__')).count()}
@@ -5,17 +5,82 @@ All rights reserved.  You are welcome to inspect this code for your education or
 the author's qualifications.  No other uses are permitted.
 """
 
+from address import geohash
 from address.models import Address
-from campaign.models import Campaign, Office, PoliticalParty
+from campaign.models import Campaign, CampaignsToVoters, Office, PoliticalParty, indexVoterLocations
 from datetime import date
-from django.test import TestCase
-from tcsuser.models import TcsUser
-from time import sleep
-from voter.models import Voter, VoterList
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from gzip import GzipFile
+from StringIO import StringIO
+from tastypie.resources import ModelResource
+from tcsuser.models import TcsUser, TcsUserProfile
+from tcswebapp.apicache import VOTERS_VERSION, bumpVersions
+from tcswebapp.querybudget import QueryBudgetMixin
+from time import sleep, time
+from voter.api import VoterResource
+from voter.export import exportCampaign
+from voter.forms import VoterListForm
+from voter.activity import applyListActivity, setListActivity
+from voter.models import ContactMethod, Issue, Voter, VoterContact, VoterFlag, VoterList, VoterListActivityJob, countVoterList, getDialableFilter, reconcileVoterLists
+from voter.staging import StagingTable, canImportStaged
+import json
 
+@override_settings(API_THROTTLE_RATES={'votercontact': (100, 1)})
 class VoterContactTests(TestCase):
-    pass
-    
+    """Tests for voter.api.VoterContactResource."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json', 'voterdialingtesting.json']
+
+    def setUp(self):
+        """Also relate every voter to a campaign owned by another user, for which the user does not work."""
+        super(VoterContactTests, self).setUp()
+        setUpCampaignVoters(self)
+        self.method = ContactMethod.objects.create(method='Telephone (voice)')
+        other = TcsUser.objects.create_user('Neazy@tcs.com', 'Pa33word44')
+        self.other_campaign = Campaign.objects.create(owner=other, address=Address.objects.first(),
+            name='Slugworth for President', is_active=True)
+        voter_list = VoterList.objects.create(dump_date=date.today(), campaign=self.other_campaign, file_name='/dev/null')
+        CampaignsToVoters.objects.bulk_create([CampaignsToVoters(campaign=self.other_campaign, voter=voter,
+            voter_list=voter_list) for voter in Voter.objects.all()])
+
+    def patch(self, objects):
+        return self.client.patch('/api/v1/votercontact/', json.dumps({'objects': objects}),
+            content_type='application/json')
+
+    def testPatch(self):
+        """PATCHed reports should relate to the user's campaigns only, and retried reports should be skipped."""
+        objects = [{'method': self.method.pk, 'voter': 7, 'intelligence_report': {'support': [1]}, 'client_key': 'a1'},
+            {'method': self.method.pk, 'voter': 2, 'client_key': 'a2'},     # Not a voter of the user's campaign
+            {'method': self.method.pk, 'voter': 8, 'intelligence_report': 'Neazy!'}]
+        response = self.patch(objects)
+        self.assertEqual(response.status_code, 202, response.content)
+        contacts = VoterContact.objects.order_by('pk')
+        self.assertEqual([(contact.voter_id, contact.user_id, contact.client_key) for contact in contacts],
+            [(7, self.user.pk, 'a1'), (2, self.user.pk, 'a2'), (8, self.user.pk, '')])
+        self.assertEqual(contacts[0].intelligence_report, "{u'support': [1]}")
+        self.assertEqual(contacts[2].intelligence_report, 'Neazy!')
+        self.assertEqual([list(contact.campaigns.all()) for contact in contacts], [[self.campaign], [], [self.campaign]])
+        contacted = CampaignsToVoters.objects.exclude(last_contacted=None)
+        self.assertEqual(sorted(contacted.values_list('campaign', 'voter')), [(self.campaign.pk, 7), (self.campaign.pk, 8)])
+        self.assertEqual(VoterList.objects.get(campaign=self.campaign).contacted_count, 2)
+
+        # A retry of the same batch creates only the report without a key
+        self.assertEqual(self.patch(objects).status_code, 202)
+        self.assertEqual(VoterContact.objects.count(), 4)
+        self.assertEqual(VoterList.objects.get(campaign=self.campaign).contacted_count, 2)   # Contacted again
+
+        # The request is all or nothing
+        self.assertEqual(self.patch([{'method': self.method.pk, 'voter': 7}, {'method': self.method.pk,
+            'voter': 999}]).status_code, 400)
+        self.assertEqual(self.patch([{'method': 999, 'voter': 7}]).status_code, 400)
+        self.assertEqual(self.patch([{'resource_uri': '/api/v1/votercontact/1/', 'method': self.method.pk,
+            'voter': 7}]).status_code, 401)
+        self.assertEqual(VoterContact.objects.count(), 4)
+
+
 class VoterListTests(TestCase):
     """Tests for voter.model.VoterList."""
     fixtures = ['addresses.json', 'offices.json', 'politicalparties.json']
@@ -69,6 +134,10 @@ class VoterListTests(TestCase):
             file_name='voter/voterlist.txt'
         )
         self.assertEqual(VoterList.objects.count(), 1)
+        self.assertImported(voter_list)
+
+    def assertImported(self, voter_list):
+        """Check the results of importing voter/voterlist.txt into an empty database.  See testSignals."""
         self.assertEqual(Voter.objects.count(), 9)
         
         # Make sure the e-mail column, which is between two ignored columns, is recognized
@@ -100,3 +169,551 @@ class VoterListTests(TestCase):
         self.assertEqual(self.campaign.voters.count(), 9)
 
         self.assertEqual(voter_list.processed, 'Imported 9 of 11 voters.  1 duplicates.  1 bad format.')
+
+    @override_settings(STAGED_IMPORT_MIN_BYTES=0)
+    def testStagedImport(self):
+        """Importing through a staging table should have the same results as importing row by row."""
+        voter_list = VoterList.objects.create(dump_date=date.today(), campaign=self.campaign,
+            file_name='voter/voterlist.txt')
+        self.assertImported(voter_list)
+        self.assertEqual((voter_list.voter_count, voter_list.dialable_count),
+            (9, CampaignsToVoters.objects.filter(voter_list=voter_list).filter(getDialableFilter('voter__')).count()))
+        self.assertEqual(reconcileVoterLists(), [])
+        self.assertFalse(connection.introspection.table_names().count('voter_staging_{0}'.format(voter_list.pk)))
+
+        # Another campaign's import of the same list finds the voters and addresses
+        other = TcsUser.objects.create_user('Neazy@tcs.com', 'Pa33word44')
+        other_campaign = Campaign.objects.create(owner=other, address=Address.objects.first(), name='Slugworth')
+        other_list = VoterList.objects.create(dump_date=date.today(), campaign=other_campaign,
+            file_name='voter/voterlist.txt')
+        self.assertEqual(other_list.processed, 'Imported 9 of 11 voters.  1 duplicates.  1 bad format.')
+        self.assertEqual((Voter.objects.count(), Address.objects.count(), other_campaign.voters.count()), (9, 18, 9))
+
+        # Voters the campaign already has are duplicates
+        again = VoterList.objects.create(dump_date=date.today(), campaign=self.campaign, file_name='voter/voterlist.txt')
+        self.assertEqual(again.processed, 'Imported 0 of 11 voters.  10 duplicates.  1 bad format.')
+        self.assertFalse(again.is_active)
+
+    @override_settings(STAGED_IMPORT_MIN_BYTES=0)
+    def testStagedImportFallback(self):
+        """Without UPDATE ... FROM, before SQLite 3.33, lists should be imported row by row."""
+        sqlite_version_info = connection.Database.sqlite_version_info
+        connection.Database.sqlite_version_info = (3, 32, 3)
+        try:
+            self.assertFalse(canImportStaged())
+            with CaptureQueriesContext(connection) as queries:
+                voter_list = VoterList.objects.create(dump_date=date.today(), campaign=self.campaign,
+                    file_name='voter/voterlist.txt')
+        finally:
+            connection.Database.sqlite_version_info = sqlite_version_info
+        self.assertFalse([query for query in queries.captured_queries if 'voter_staging' in query['sql']])
+        self.assertImported(voter_list)
+
+    def testStagingTableError(self):
+        """After an error, the staging table should be left to the rollback instead of dropped."""
+        voter_list = VoterList(pk=1000)
+        with CaptureQueriesContext(connection) as queries, self.assertRaises(ValueError):
+            with transaction.atomic(), connection.cursor() as cursor, StagingTable(cursor, voter_list):
+                raise ValueError
+        self.assertEqual([query['sql'].split(' (')[0] for query in queries.captured_queries if 'voter_staging' in query['sql']],
+            ['DROP TABLE IF EXISTS "voter_staging_1000"', 'CREATE TEMPORARY TABLE "voter_staging_1000"'])
+        self.assertNotIn('voter_staging_1000', connection.introspection.table_names())
+
+    def testDelta(self):
+        """
+        A list that updates an earlier list should add, update, retire, and keep voters by registrar ID.
+        The update, voterlist-update.txt, changes Donald's phone number and Daisy's address, drops Louis,
+        adds Scrooge twice, and changes only the case of Victoria's registrar ID.  The two Donalds in
+        voterlist.txt share a registrar ID, so the second is retired.
+        """
+        voter_list = VoterList.objects.create(dump_date=date(2014, 1, 1), campaign=self.campaign,
+            file_name='voter/voterlist.txt')
+        donald = Voter.objects.get(address__street='49 S Byron St')
+        Voter.objects.filter(pk=donald.pk).update(wrong_phone_number1=2)
+        huey = Voter.objects.get(first_name='Huey M.')
+        method = ContactMethod.objects.create(method='Door-to-door')
+        VoterContact.objects.create(voter=huey, user=self.user, method=method).campaigns.add(self.campaign)
+        # Daisy moves to a geocoded address, and her row must leave the cell of her old one
+        CampaignsToVoters.objects.filter(voter__first_name='Daisy L.').update(geohash='dphgr6')
+        Address.objects.create(street='100 N Main St', city='Pendleton', state='IN', country='US',
+            postal_code='44444', latitude=40.0, longitude=-85.75)
+        # Another campaign's list shares Donald, whose new phone number makes him dialable
+        other = Campaign.objects.create(owner=TcsUser.objects.create_user('Neazy@tcs.com', 'Pa33word44'),
+            address=Address.objects.first(), name='Slugworth for POTUS')
+        other_list = VoterList.objects.create(dump_date=date(2014, 1, 1), campaign=other, file_name='/dev/null')
+        CampaignsToVoters.objects.create(campaign=other, voter=donald, voter_list=other_list)
+        reconcileVoterLists(VoterList.objects.filter(pk=other_list.pk))
+        self.assertEqual(VoterList.objects.get(pk=other_list.pk).dialable_count, 0)
+
+        update = VoterList.objects.create(dump_date=date(2014, 6, 1), campaign=self.campaign,
+            file_name='voter/voterlist-update.txt', previous=voter_list)
+        self.assertEqual(update.processed, 'Added 1, updated 2, retired 2, and kept 5 of 10 voters.  '
+            '1 duplicates.  1 bad format.')
+        self.assertEqual(Voter.objects.count(), 10)     # Only Scrooge is new
+
+        donald = Voter.objects.get(pk=donald.pk)
+        self.assertEqual((donald.phone_number1, donald.wrong_phone_number1, donald.dump_date),
+            ('3175550101', 0, date(2014, 6, 1)))
+        self.assertEqual(Voter.objects.get(first_name='Daisy L.').address.street, '100 N Main St')
+        self.assertEqual(Voter.objects.get(first_name='Victoria A.').dump_date, date(2014, 1, 1))
+
+        # Retired voters stay in the earlier list, deactivated, and others move with their history
+        rows = CampaignsToVoters.objects.filter(campaign=self.campaign)
+        self.assertEqual(sorted(rows.filter(voter_list=voter_list).values_list('voter__first_name', 'is_active')),
+            [('Donald J.', False), ('Louis J.', False)])
+        self.assertEqual(rows.filter(voter_list=update, is_active=True).count(), 8)
+        self.assertIsNotNone(rows.get(voter=huey).last_contacted)
+        self.assertTrue(Voter.objects.get(first_name='Louis J.').is_active)    # Shared with other campaigns
+        self.assertEqual(rows.get(voter__first_name='Daisy L.').geohash, geohash.encode(40.0, -85.75))
+        self.assertEqual(self.campaign.getVotersDoorToDoor(40.0, -85.75, 1).filter(first_name='Daisy L.').count(), 1)
+
+        voter_list.refresh_from_db()
+        update.refresh_from_db()
+        self.assertFalse(voter_list.is_active)
+        self.assertTrue(update.is_active)
+        self.assertEqual((voter_list.voter_count, voter_list.active_count, update.voter_count, update.active_count,
+            update.contacted_count), (2, 0, 8, 8, 1))
+        self.assertEqual(VoterList.objects.get(pk=other_list.pk).dialable_count, 1)
+        self.assertEqual(reconcileVoterLists(), [])
+
+        # Only the campaign's own lists can be updated
+        form = VoterListForm(campaign=self.campaign)
+        self.assertEqual(list(form.fields['previous'].queryset), [update, voter_list])
+        self.assertFalse(VoterListForm(campaign=None).fields['previous'].queryset.exists())
+
+    def testCounters(self):
+        """The counters of a VoterList should match its rows of CampaignsToVoters as the rows change."""
+        voter_list = VoterList.objects.create(dump_date=date.today(), campaign=self.campaign,
+            file_name='voter/voterlist.txt')
+        counts = countVoterList(voter_list)
+        voter_list.refresh_from_db()
+        self.assertEqual(dict((name, getattr(voter_list, name)) for name in VoterList.COUNTERS), counts)
+        self.assertEqual((voter_list.voter_count, voter_list.active_count, voter_list.contacted_count), (9, 9, 0))
+
+        # Deactivating and reactivating the list
+        voter_list.is_active = False
+        voter_list.save()
+        self.assertEqual(VoterList.objects.get(pk=voter_list.pk).active_count, 0)
+        voter_list.is_active = True
+        voter_list.save()
+        self.assertEqual(VoterList.objects.get(pk=voter_list.pk).active_count, 9)
+
+        # Contacting a voter twice counts once, and saving a stale instance keeps the count
+        method = ContactMethod.objects.create(method='Door-to-door')
+        for i in range(2):
+            contact = VoterContact.objects.create(voter=self.campaign.voters.first(), user=self.user, method=method)
+            contact.campaigns.add(self.campaign)
+        voter_list.save()
+        self.assertEqual(VoterList.objects.get(pk=voter_list.pk).contacted_count, 1)
+
+        # Reconciling corrects drift and reports it
+        VoterList.objects.filter(pk=voter_list.pk).update(voter_count=5, contacted_count=0)
+        output = StringIO()
+        call_command('reconcilevoterlists', campaign=self.campaign.pk, stdout=output)
+        self.assertIn('contacted_count 0 -> 1, voter_count 5 -> 9', output.getvalue())
+        self.assertIn('Corrected 1 of 1 voter lists.', output.getvalue())
+        self.assertEqual(reconcileVoterLists(), [])
+
+class VoterListActivityTests(QueryBudgetMixin, TestCase):
+    """Tests for voter.activity and the view voter.views.voterListsActivity."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json', 'voterdialingtesting.json']
+
+    def setUp(self):
+        super(VoterListActivityTests, self).setUp()
+        setUpCampaignVoters(self)
+        VoterList.objects.update(is_active=True)   # The importer deactivates an empty list
+        self.voter_list = VoterList.objects.get(campaign=self.campaign)
+        reconcileVoterLists()
+
+    def addLists(self, number):
+        """Add 'number' lists to the campaign, each with a row for every voter of the first list.  Return 'number'."""
+        voters = list(self.campaign.voters.distinct())
+        for i in range(number):
+            voter_list = VoterList.objects.create(dump_date=date.today(), campaign=self.campaign, file_name='/dev/null')
+            CampaignsToVoters.objects.bulk_create([CampaignsToVoters(campaign=self.campaign, voter=voter,
+                voter_list=voter_list) for voter in voters])
+        VoterList.objects.update(is_active=True)
+        reconcileVoterLists()
+        return number
+
+    def postActivity(self, activity, follow=True):
+        """POST the lists formset with 'activity', a list of tuples (list primary key, is_active)."""
+        data = {'form-TOTAL_FORMS': len(activity), 'form-INITIAL_FORMS': len(activity)}
+        for index, (pk, is_active) in enumerate(activity):
+            data['form-{0}-id'.format(index)] = pk
+            if is_active:
+                data['form-{0}-is_active'.format(index)] = 'on'
+        return self.client.post(reverse('voter_lists_activity'), data, follow=follow)
+
+    def testSmallLists(self):
+        """Lists should be changed and checked with a number of queries that does not grow with the lists."""
+        activity = [(self.voter_list.pk, False)]
+        def reactivate():
+            VoterList.objects.update(is_active=True)
+            CampaignsToVoters.objects.update(is_active=True)
+            number = self.addLists(10)
+            activity[:] = [(pk, False) for pk in VoterList.objects.values_list('pk', flat=True)]
+            return number
+        # 5 queries authenticate the user, and 5 invalidate the cached voter lists
+        self.assertQueryBudget(14, lambda: self.postActivity(activity, follow=False), reactivate)
+        self.assertFalse(CampaignsToVoters.objects.filter(is_active=True).exists())
+        self.assertEqual(list(VoterList.objects.values_list('is_active', 'active_count').distinct()), [(False, 0)])
+
+        response = self.postActivity([(self.voter_list.pk, True)])
+        self.assertContains(response, 'You saved your voter list activity preferences.')
+        self.assertEqual(CampaignsToVoters.objects.filter(is_active=True).count(), 4)
+        self.assertEqual(VoterList.objects.get(pk=self.voter_list.pk).active_count, 4)
+        self.assertEqual(reconcileVoterLists(), [])
+
+    def testOwnership(self):
+        """A request that includes another campaign's list should change nothing."""
+        other = TcsUser.objects.create_user('Neazy@tcs.com', 'Pa33word44')
+        other_campaign = Campaign.objects.create(owner=other, address=Address.objects.first(), name='Slugworth')
+        other_list = VoterList.objects.create(dump_date=date.today(), campaign=other_campaign, file_name='/dev/null')
+        VoterList.objects.update(is_active=True)
+        response = self.postActivity([(self.voter_list.pk, False), (other_list.pk, False)])
+        self.assertContains(response, 'You must manage the campaign that owns a voter list.')
+        self.assertTrue(VoterList.objects.get(pk=self.voter_list.pk).is_active)
+        self.assertTrue(VoterList.objects.get(pk=other_list.pk).is_active)
+        response = self.postActivity([(999, False)])
+        self.assertContains(response, 'You must manage the campaign that owns a voter list.')
+        response = self.client.post(reverse('voter_lists_activity'), {'form-TOTAL_FORMS': 1, 'form-INITIAL_FORMS': 1,
+            'form-0-id': 'one'}, follow=True)
+        self.assertContains(response, 'Enter a whole number.')
+        self.assertTrue(CampaignsToVoters.objects.filter(is_active=True).exists())
+
+    def testLargeLists(self):
+        """The voters of large lists should be updated by the worker, which shows its progress."""
+        jobs = setListActivity(self.campaign, {self.voter_list.pk: False}, background_threshold=3)
+        self.assertEqual([(job.voter_list_id, job.is_active, job.total) for job in jobs], [(self.voter_list.pk, False, 4)])
+        self.assertFalse(VoterList.objects.get(pk=self.voter_list.pk).is_active)
+        self.assertEqual(CampaignsToVoters.objects.filter(is_active=True).count(), 4)
+        self.assertContains(self.client.get(reverse('voter_lists')), '<em>(Deactivating: 0%)</em>')
+
+        # Partly applied
+        job = VoterListActivityJob.objects.get()
+        VoterListActivityJob.objects.filter(pk=job.pk).update(done=3)
+        CampaignsToVoters.objects.filter(pk__in=CampaignsToVoters.objects.order_by('pk').values_list('pk',
+            flat=True)[:3]).update(is_active=False)
+        bumpVersions(VOTERS_VERSION.format(self.campaign.pk))
+        self.assertContains(self.client.get(reverse('voter_lists')), '<em>(Deactivating: 75%)</em>')
+        VoterListActivityJob.objects.filter(pk=job.pk).update(done=0)
+
+        output = StringIO()
+        call_command('applylistactivity', batch_size=2, stdout=output)
+        self.assertEqual(output.getvalue(), 'Updated 1 voters.\n')
+        self.assertFalse(CampaignsToVoters.objects.filter(is_active=True).exists())
+        job = VoterListActivityJob.objects.get(pk=job.pk)
+        self.assertIsNotNone(job.finished_on)
+        self.assertEqual(job.done, 1)
+        self.assertNotContains(self.client.get(reverse('voter_lists')), 'Deactivating')
+        self.assertEqual(applyListActivity(), 0)
+
+        # A new change supersedes an unfinished job
+        setListActivity(self.campaign, {self.voter_list.pk: True}, background_threshold=3)
+        setListActivity(self.campaign, {self.voter_list.pk: False}, background_threshold=3)
+        self.assertEqual(list(VoterListActivityJob.objects.filter(finished_on=None).values_list('is_active', flat=True)),
+            [False])
+        self.assertEqual(applyListActivity(), 0)
+        self.assertFalse(VoterListActivityJob.objects.filter(finished_on=None).exists())
+
+@override_settings(API_THROTTLE_RATES={'issue': (100, 1), 'issue_changes': (100, 1), 'contactmethod_changes': (100, 1)})
+class IssueResourceTests(TestCase):
+    """Tests for conditional GET, response caching, and delta sync by voter.api.IssueResource."""
+    fixtures = ['addresses.json', 'issues.json']
+
+    def setUp(self):
+        """Create and log in an active user who lives in the United States."""
+        super(IssueResourceTests, self).setUp()
+        self.user = TcsUser.objects.create_user('test@tcs.com', 'Pa33word44')
+        self.user.is_active = True
+        self.user.save()
+        TcsUserProfile.objects.create(user=self.user, name='Circus McGuirkus', address=Address.objects.first(),
+            phone_number='123-456-7890', gender='M')
+        self.client.login(email='test@tcs.com', password='Pa33word44')
+
+    def testConditionalGet(self):
+        """A current ETag should receive 304 without querying the issue table."""
+        response = self.client.get('/api/v1/issue/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['objects']), 4)   # Excludes the Canadian issue
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/issue/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries if 'voter_issue' in query['sql']])
+
+        # A cached response should not query the issue table either
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/issue/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse([query for query in queries if 'voter_issue' in query['sql']])
+
+        # Changing an issue should change the ETag and the response
+        Issue.objects.filter(pk=7).get().delete()
+        response = self.client.get('/api/v1/issue/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(json.loads(response.content)['objects']), 3)
+
+    def getChanges(self, since=None, resource='issue'):
+        response = self.client.get('/api/v1/{0}/changes/'.format(resource), {} if since is None else {'since': since})
+        return response.status_code, json.loads(response.content) if response.status_code == 200 else None
+
+    def testChanges(self):
+        """Clients should receive only the issues changed since their version, or 304 if none changed."""
+        status, changes = self.getChanges()
+        self.assertEqual(status, 200)
+        self.assertEqual((changes['version'], changes['full'], changes['deleted']), (0, True, []))
+        self.assertEqual([data['issue'] for data in changes['objects']], ['abortion legal',
+            'direct election of President', 'reduce military spending', 'reduce taxes'])
+        self.assertEqual(self.getChanges(0), (304, None))
+
+        # Saves increment the version; deactivated and foreign issues are reported as deleted
+        Issue.objects.create(issue='term limits')
+        issue = Issue.objects.get(pk=6)
+        issue.is_active = False
+        issue.save()
+        issue = Issue.objects.get(pk=3)
+        issue.issue = 'Quebec sovereignty'
+        issue.save()
+        status, changes = self.getChanges(0)
+        self.assertEqual((status, changes['version'], changes['full']), (200, 3, False))
+        self.assertEqual([data['issue'] for data in changes['objects']], ['term limits'])
+        self.assertEqual(changes['deleted'], [3, 6])
+        status, changes = self.getChanges(2)
+        self.assertEqual((changes['objects'], changes['deleted']), ([], [3]))
+        self.assertEqual(self.getChanges(3), (304, None))
+
+        # After a deletion, and for unknown versions, clients must replace their copy
+        Issue.objects.get(pk=7).delete()
+        for since in (3, 99):
+            status, changes = self.getChanges(since)
+            self.assertEqual((changes['version'], changes['full'], len(changes['objects'])), (4, True, 3))
+        self.assertEqual(self.getChanges(4), (304, None))
+        self.assertEqual(self.getChanges('x')[0], 400)
+
+        # Contact methods have their own version
+        ContactMethod.objects.create(method='Telephone (voice)')
+        status, changes = self.getChanges(0, 'contactmethod')
+        self.assertEqual((changes['version'], [method['method'] for method in changes['objects']]), (1, ['Telephone (voice)']))
+        self.assertEqual(self.getChanges(4), (304, None))
+        self.client.logout()
+        self.assertEqual(self.getChanges(4)[0], 401)
+
+def setUpCampaignVoters(obj):
+    """
+    This utility function relates the Democratic voters in the fixture voterdialingtesting.json to a
+    new campaign, and it logs in the campaign's owner.  It sets the attributes 'user' and 'campaign'
+    on 'obj', an instance of TestCase.
+    """
+    obj.user = TcsUser.objects.create_user('test@tcs.com', 'Pa33word44')
+    obj.user.is_active = True
+    obj.user.save()
+    obj.campaign = Campaign.objects.create(owner=obj.user, address=Address.objects.first(),
+        name='Sprout for POTUS', is_active=True)
+    voter_list = VoterList.objects.create(dump_date=date.today(), campaign=obj.campaign, file_name='/dev/null')
+    CampaignsToVoters.objects.bulk_create([CampaignsToVoters(campaign=obj.campaign, voter=voter, voter_list=voter_list)
+        for voter in Voter.objects.filter(affiliation__title='Democratic')])
+    obj.client.login(email='test@tcs.com', password='Pa33word44')
+
+@override_settings(API_THROTTLE_RATES={'voter': (100, 1)})
+class VoterResourceTests(TestCase):
+    """Tests for voter.api.VoterResource."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json', 'voterdialingtesting.json']
+
+    def setUp(self):
+        super(VoterResourceTests, self).setUp()
+        setUpCampaignVoters(self)
+
+    def testFastPath(self):
+        """VoterResource.get_list should return the same JSON as ModelResource.get_list."""
+        url = '/api/v1/voter/?campaign_id={0}'.format(self.campaign.pk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)['objects']), 3)
+
+        request = RequestFactory().get(url)
+        request.user = self.user
+        expected = ModelResource.get_list(VoterResource(), request)
+        self.assertEqual(response.content, expected.content)
+
+        # Paging parameters should work as before
+        response = self.client.get(url + '&limit=2&offset=1')
+        request = RequestFactory().get(url + '&limit=2&offset=1')
+        request.user = self.user
+        self.assertEqual(response.content, ModelResource.get_list(VoterResource(), request).content)
+
+    def testExcludeIds(self):
+        """Voters whose IDs are passed in 'exclude_ids' should not be served."""
+        url = '/api/v1/voter/?campaign_id={0}'.format(self.campaign.pk)
+        served = [voter['id'] for voter in json.loads(self.client.get(url).content)['objects']]
+        response = self.client.get(url + '&exclude_ids={0},{1}'.format(*served[:2]))
+        self.assertEqual([voter['id'] for voter in json.loads(response.content)['objects']], served[2:])
+        self.assertEqual(self.client.get(url + '&exclude_ids=7,eight').status_code, 400)
+        self.assertEqual(self.client.get(url + '&exclude_ids=' + ','.join(map(str, range(101)))).status_code, 400)
+
+    def testFlagCounters(self):
+        """A voter whose last phone number is flagged twice should no longer be counted as dialable."""
+        reconcileVoterLists()
+        voter_list = VoterList.objects.get(campaign=self.campaign)
+        self.assertEqual(voter_list.dialable_count, 3)  # Voter 8's numbers are both flagged twice
+        flag = json.dumps({'objects': [{'resource_uri': '/api/v1/voter/9/', 'phone_number1': 'flagged'}]})
+        self.assertEqual(self.client.patch('/api/v1/voter/', flag, content_type='application/json').status_code, 202)
+        self.assertEqual(VoterList.objects.get(pk=voter_list.pk).dialable_count, 3)
+        self.assertEqual(self.client.patch('/api/v1/voter/', flag, content_type='application/json').status_code, 202)
+        self.assertEqual(VoterList.objects.get(pk=voter_list.pk).dialable_count, 2)
+        self.assertEqual(reconcileVoterLists(), [])
+
+    def testRetriedFlags(self):
+        """A flag uploaded again with the same client_key should be counted once."""
+        flags = json.dumps({'objects': [{'resource_uri': '/api/v1/voter/9/', 'phone_number1': 'flagged', 'client_key': 'f1'},
+            {'resource_uri': '/api/v1/voter/7/', 'phone_number2': 'flagged', 'client_key': 'f2'}]})
+        for i in range(2):
+            self.assertEqual(self.client.patch('/api/v1/voter/', flags, content_type='application/json').status_code, 202)
+        self.assertEqual(list(Voter.objects.filter(pk__in=[7, 9]).order_by('pk').values_list('wrong_phone_number1',
+            'wrong_phone_number2')), [(2, 1), (1, 0)])
+        self.assertEqual(sorted(VoterFlag.objects.values_list('voter', 'field', 'client_key')),
+            [(7, 'phone_number2', 'f2'), (9, 'phone_number1', 'f1')])
+
+    def testDoorToDoor(self):
+        """Given GPS coordinates, VoterResource should serve nearby voters nearest first."""
+        for pk, latitude in ((7, 38.254), (8, 38.2535), (9, 38.30), (10, 38.2528)):
+            Voter.objects.filter(pk=pk).update(address=Address.objects.create(street='{0} Main Str'.format(pk),
+                city='Louisville', state='KY', country='US', postal_code='40202', latitude=latitude, longitude=-85.7585))
+        indexVoterLocations()
+        url = '/api/v1/voter/?campaign_id={0}&latitude=38.2527&longitude=-85.7585'.format(self.campaign.pk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([voter['id'] for voter in json.loads(response.content)['objects']], [10, 8, 7])
+        response = self.client.get(url + '&radius=5')
+        self.assertEqual(len(json.loads(response.content)['objects']), 3)   # Voter 9 is about 5.3 km away
+
+        self.assertEqual(self.client.get(url + '&radius=100').status_code, 400)
+        self.assertEqual(self.client.get(url.replace('38.2527', 'north')).status_code, 400)
+
+class VoterThrottleTests(TestCase):
+    """Tests for the default throttles of voter.api.VoterResource."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json', 'voterdialingtesting.json']
+
+    def setUp(self):
+        super(VoterThrottleTests, self).setUp()
+        setUpCampaignVoters(self)
+        self.now = [1000000.0]
+        self.throttles = [VoterResource._meta.throttle, VoterResource.flag_throttle]
+        for throttle in self.throttles:
+            throttle.clock = lambda: self.now[0]
+
+    def tearDown(self):
+        for throttle in self.throttles:
+            throttle.clock = time
+        super(VoterThrottleTests, self).tearDown()
+
+    def testCampaignerLoop(self):
+        """
+        Campaigner PATCHes flags after a call and requests voters when its batch of 20 runs out.  A
+        volunteer who flags every voter and dials one every 15 seconds should never be throttled.
+        """
+        url = '/api/v1/voter/?campaign_id={0}'.format(self.campaign.pk)
+        flag = json.dumps({'objects': [{'resource_uri': '/api/v1/voter/9/', 'phone_number1': 'flagged'}]})
+        for call in range(240):     # One hour
+            if call % 20 == 0:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(self.client.patch('/api/v1/voter/', flag, content_type='application/json').status_code, 202)
+            self.now[0] += 15
+
+        # A client requesting voters far faster should be throttled
+        statuses = [self.client.get(url).status_code for i in range(4)]
+        self.assertEqual(statuses[-1], 429)
+
+@override_settings(API_THROTTLE_RATES={'voter': (100, 1), 'votercontact': (100, 1)})
+class VoterQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """Query budgets for VoterResource GET and VoterContactResource PATCH."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json', 'voterdialingtesting.json']
+
+    def setUp(self):
+        super(VoterQueryBudgetTests, self).setUp()
+        setUpCampaignVoters(self)
+        self.method = ContactMethod.objects.create(method='Telephone (voice)')
+        self.batch_size = 2
+        self.voter_ids = list(self.campaign.voters.values_list('pk', flat=True))
+
+    def addVoters(self, number):
+        """Relate 'number' new voters, each with an address, to the campaign.  Return 'number'."""
+        voter_list = VoterList.objects.filter(campaign=self.campaign).first()
+        for i in range(number):
+            voter = Voter.objects.create(first_name='Voter', last_name=str(i), phone_number1='5025550100',
+                dump_date=date.today(),
+                address=Address.objects.create(street='{0} Main Str'.format(i + 1), city='Louisville', state='KY',
+                country='US', postal_code='40202'))
+            CampaignsToVoters.objects.create(campaign=self.campaign, voter=voter, voter_list=voter_list)
+        return number
+
+    def patchContacts(self):
+        """PATCH an intelligence report for each of 'batch_size' of the campaign's voters."""
+        objects = [{'method': self.method.pk, 'voter': pk, 'intelligence_report': {'support': [1]}}
+            for pk in self.voter_ids[:self.batch_size]]
+        return self.client.patch('/api/v1/votercontact/', json.dumps({'objects': objects}),
+            content_type='application/json')
+
+    def testVoterGet(self):
+        url = '/api/v1/voter/?campaign_id={0}'.format(self.campaign.pk)
+        small, large = self.assertQueryBudget(11, lambda: self.client.get(url), lambda: self.addVoters(40))
+        self.assertEqual(len(json.loads(small.content)['objects']), 3)
+        self.assertEqual(len(json.loads(large.content)['objects']), 20)
+
+    def testVoterContactPatch(self):
+        """Reports are saved in bulk, so the budget does not grow with the size of the batch."""
+        def grow():
+            self.addVoters(40)
+            self.voter_ids = list(self.campaign.voters.values_list('pk', flat=True))
+            self.batch_size = 20
+            return 18
+        # 5 of the queries count first contacts per voter list
+        small, large = self.assertQueryBudget(16, self.patchContacts, grow)
+        self.assertEqual((small.status_code, large.status_code), (202, 202))
+        self.assertEqual(VoterContact.objects.count(), 22)
+
+class ExportTests(TestCase):
+    """Tests for voter.export and the view voter.views.voterExport."""
+    fixtures = ['addresses.json', 'offices.json', 'politicalparties.json', 'voterdialingtesting.json']
+
+    def setUp(self):
+        super(ExportTests, self).setUp()
+        setUpCampaignVoters(self)
+
+    def testExportCampaign(self):
+        """Chunked exports should include every row exactly once, in every format."""
+        lines = ''.join(exportCampaign(self.campaign, 'voters', 'csv', chunk_size=2)).splitlines()
+        self.assertEqual(len(lines), 5)    # Header and 4 voters
+        self.assertTrue(lines[0].startswith('voter_id,registrar_id,first_name'))
+        self.assertEqual(sorted(int(line.split(',')[0]) for line in lines[1:]), [7, 8, 9, 10])
+
+        rows = [json.loads(line) for line in ''.join(exportCampaign(self.campaign, 'voters', 'ndjson', chunk_size=3)).splitlines()]
+        self.assertEqual(sorted(row['voter_id'] for row in rows), [7, 8, 9, 10])
+        self.assertTrue(all(row['affiliation'] == 'Democratic' for row in rows))
+
+        compressed = ''.join(exportCampaign(self.campaign, 'voters', 'csv', gzip=True))
+        self.assertEqual(GzipFile(fileobj=StringIO(compressed)).read().splitlines(), lines)
+
+    def testExportView(self):
+        """Only a campaign owner can export, and only the campaign's own intelligence reports."""
+        method = ContactMethod.objects.create(method='Telephone (voice)')
+        contact = VoterContact.objects.create(voter_id=7, user=self.user, method=method, intelligence_report='"Neazy!"')
+        contact.campaigns.add(self.campaign)
+        VoterContact.objects.create(voter_id=8, user=self.user, method=method)  # Not related to the campaign
+
+        response = self.client.get(reverse('voter_export', args=['contacts', 'ndjson']))
+        self.assertEqual(response.status_code, 200)
+        rows = [json.loads(line) for line in ''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['voter_id'], rows[0]['user'], rows[0]['method']), (7, 'test@tcs.com', 'Telephone (voice)'))
+
+        self.client.logout()
+        TcsUser.objects.create_user('Neazy@tcs.com', 'Pa33word44')
+        TcsUser.objects.update(is_active=True)
+        self.client.login(email='Neazy@tcs.com', password='Pa33word44')
+        self.assertEqual(self.client.get(reverse('voter_export', args=['voters', 'csv'])).status_code, 302)
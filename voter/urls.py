@@ -9,6 +9,7 @@ from django.conf.urls import url
 from . import views
 
 urlpatterns = [
+    url(r'^export/(?P<kind>voters|contacts)\.(?P<output_format>csv|ndjson)$', views.voterExport, name='voter_export'),
     url(r'^list_activity/$', views.voterListsActivity, name='voter_lists_activity'),
     url(r'^manage/$', views.voterLists, name='voter_lists'),
 ]
@@ -7,13 +7,18 @@ the author's qualifications.  No other uses are permitted.
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.core.exceptions import PermissionDenied, ValidationError
 from django.core.urlresolvers import reverse
+from django.db.models import Prefetch
 from django.forms.models import modelformset_factory
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render
 from django.views.decorators.http import require_POST
-from voter.forms import VoterListForm
-from voter.models import VoterList
+from tcswebapp.apicache import CONTACTS_VERSION, VOTERS_VERSION, getFragmentVersion
+from voter.activity import setListActivity
+from voter.export import FORMATS, exportCampaign
+from voter.forms import VoterListForm, getListActivity
+from voter.models import VoterList, VoterListActivityJob, getContactsMark
 
 @login_required
 def voterLists(request):
@@ -24,44 +29,67 @@ def voterLists(request):
     The user can modify via a formset the 'is_active' value of uploaded lists.
     This view directly handles uploading new lists, but updates to previously
     uploaded lists target the view 'voterListsActivity'.
+
+    The template caches the formset's table until the campaign's lists or contact counts change.  The
+    table shows the progress of lists being activated or deactivated in the background.
     """
     if not getattr(request.user, 'campaign', None):
         messages.error(request, "You don't own a campaign.")
         return HttpResponseRedirect(reverse('home'))
     # The user owns a campaign
     VoterListFormSet = modelformset_factory(VoterList, fields=('is_active',), extra=0)
-    formset = VoterListFormSet(queryset=VoterList.objects.filter(campaign=request.user.campaign))
+    formset = VoterListFormSet(queryset=VoterList.objects.filter(campaign=request.user.campaign).prefetch_related(
+        Prefetch('activity_jobs', queryset=VoterListActivityJob.objects.filter(finished_on=None),
+        to_attr='pending_jobs')))
     if request.method == 'POST':
-        upload_form = VoterListForm(request.POST, request.FILES)
+        upload_form = VoterListForm(request.POST, request.FILES, campaign=request.user.campaign)
         if upload_form.is_valid():  # Custom validation tests size and MIME type
             upload_form.instance.campaign = request.user.campaign
             upload_form.save()
             messages.success(request, 'Successfully uploaded a list of voters.')
     else:
-        upload_form = VoterListForm()
-    return render(request, 'voter/lists.html', {'upload_form': upload_form, 'formset': formset})
+        upload_form = VoterListForm(campaign=request.user.campaign)
+    return render(request, 'voter/lists.html', {'upload_form': upload_form, 'formset': formset,
+        'lists_version': getFragmentVersion(VOTERS_VERSION.format(request.user.campaign.pk),
+            CONTACTS_VERSION.format(request.user.campaign.pk), marks=[getContactsMark(campaign_id=request.user.campaign.pk)])})
 
 @login_required
 @require_POST
 def voterListsActivity(request):
-    """Use this view to update the activity status of voter lists.  The user must own a campaign."""
+    """
+    Use this view to update the activity status of voter lists.  The user must own a campaign.  The
+    lists are changed together, and the voters of large lists are activated or deactivated in the
+    background.  See voter.activity.
+    """
     if not getattr(request.user, 'campaign', None):
-        # TODO - test this
         messages.error(request, "You don't own a campaign.")
         return HttpResponseRedirect(reverse('home'))
     # The user owns a campaign
-    VoterListFormSet = modelformset_factory(VoterList, fields=('is_active',), extra=0)
-    formset = VoterListFormSet(request.POST)
-    if formset.is_valid():
-        # Make sure the user owns the campaign that owns the lists
-        # TODO - test this with cURL
-        for form in formset:
-            if form.instance.campaign != request.user.campaign:
-                messages.error(request, "You must manage the campaign that owns a voter list.")
-                break
-        else:
-            # This gets executed if the for loop continues through exhaustion (all forms are valid)
-            # https://docs.python.org/2/tutorial/controlflow.html#break-and-continue-statements-and-else-clauses-on-loops
-            formset.save()
-            messages.success(request, "You saved your voter list activity preferences.")
+    try:
+        jobs = setListActivity(request.user.campaign, getListActivity(request.POST))
+    except ValidationError as e:
+        messages.error(request, ' '.join(e.messages))
+    except PermissionDenied as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, "You saved your voter list activity preferences.")
+        if jobs:
+            messages.info(request, "Large lists are being updated.  Their progress is shown below.")
     return HttpResponseRedirect(reverse('voter_lists'))
+
+@login_required
+def voterExport(request, kind, output_format):
+    """
+    Stream an export of the constituents ('voters') or intelligence reports ('contacts') of the campaign
+    the user owns as CSV or newline-delimited JSON.  Add the GET parameter "gzip=1" to compress the export.
+    See voter.export.
+    """
+    if not getattr(request.user, 'campaign', None):
+        messages.error(request, "You don't own a campaign.")
+        return HttpResponseRedirect(reverse('home'))
+    gzip = request.GET.get('gzip') == '1'
+    response = StreamingHttpResponse(exportCampaign(request.user.campaign, kind, output_format, gzip=gzip),
+        content_type='application/gzip' if gzip else FORMATS[output_format][1])
+    response['Content-Disposition'] = 'attachment; filename="campaign{0}-{1}.{2}{3}"'.format(
+        request.user.campaign.pk, kind, output_format, '.gz' if gzip else '')
+    return response